@@ -1,24 +1,28 @@
+from __future__ import annotations
+
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, PhotoImage
 import os
 import numpy as np
-import faiss
-import torch
-import clip
-from PIL import Image
 import webbrowser
 import tempfile
 import logging
-from typing import List, Optional
+from typing import Callable, List, Optional
 import threading
 import json
-import pickle
-import io
-import base64
+import time
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from image_search_collections import CollectionManager
+from image_search_engine import (
+    CONFIG_FILE, INDEX_DIR, ImageSearchEngine, IndexingCancelled, IndexingError, read_config_file, render_results_html,
+)
+from image_search_filters import ImageFilter, parse_filter
+from image_search_metrics import ProgressRate, format_duration
+from image_search_watcher import DirectoryWatcher
 
-CONFIG_FILE = "image_search_config.json"
-INDEX_FILE = "image_index.bin"
-os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
+POLL_INTERVAL_MS = 100
 
 
 class AboutWindow(tk.Toplevel):
@@ -96,29 +100,138 @@ class AboutWindow(tk.Toplevel):
 
 class ImageSearchWindow:
     def __init__(self, root):
+        self.startup_start = time.perf_counter()
+        self.startup_timings = {}
         self.root = root
         self.root.title("Búsqueda Semántica de Imágenes")
         self.root.geometry("800x600")
-        self.image_dir = None
-        self.index = None
-        self.image_paths = None
         self.query_type = tk.StringVar(value="text")
         logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.model, self.preprocess = clip.load("ViT-L/14", device=self.device)
-        logging.info("Modelo CLIP cargado correctamente.")
-        self.feature_dim = 768
-        self.config = self.load_config()
-        self.index_metadata = {}
+        # El motor base carga el modelo; `self.engine` es el de la colección activa y comparte ese modelo.
+        self.model_engine = ImageSearchEngine(self.load_config())
+        self.engine = self.model_engine
+        self.collections = CollectionManager(self.model_engine)
+        # Los hilos de trabajo no tocan Tk: encolan sus actualizaciones y process_ui_queue las aplica.
+        self.ui_queue = queue.Queue()
+        self.model_engine.progress_callback = lambda done, total: self.post(self.update_progress, done, total)
+        self.model_engine.status_callback = lambda text, color: self.post(self.set_status, text, color)
+        self.config = self.model_engine.config
+        self.search_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search")
+        self.search_future: Optional[Future] = None
+        self.search_generation = 0
+        self.indexing = False
+        self.status_text = ""
+        self.progress_rate = ProgressRate()
+        self.model_error = None
+        self.model_ready = threading.Event()
+        self.index_check = None
+        self.watcher: Optional[DirectoryWatcher] = None
+        self.watch_enabled = tk.BooleanVar(value=bool(self.config.get("watch", False)))
+        self.search_all_collections = tk.BooleanVar(value=False)
         self.k_value = tk.IntVar(value=5)
-        self.batch_size = 64
         try:
             self.root.iconphoto(False, PhotoImage(file="SS.png"))
         except tk.TclError:
             logging.warning("Archivo de icono 'SS.png' no encontrado, omitiendo la carga del icono.")
         self._create_widgets()
-        self._load_last_paths_and_check_index()
+        self.startup_timings["widgets"] = time.perf_counter() - self.startup_start
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.after(POLL_INTERVAL_MS, self.process_ui_queue)
+        self.disable_search_button()
+        self.status_label.config(text="Cargando modelo CLIP...", foreground="gray")
+        threading.Thread(target=self.load_model, daemon=True).start()
+        self._load_last_paths_and_check_index()
+        if not self.image_dir:
+            self.when_model_ready(self.on_model_ready_without_index)
+
+    def load_model(self):
+        """Importa torch y CLIP y carga el modelo. Se ejecuta en segundo plano."""
+        try:
+            start = time.perf_counter()
+            import torch  # noqa: F401
+            import clip  # noqa: F401
+            self.startup_timings["import_torch_clip"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            self.model_engine.load_model()
+            self.collections.share_model()
+            self.startup_timings["model_load"] = time.perf_counter() - start
+        except Exception as e:
+            self.model_error = e
+            logging.error(f"Error al cargar el modelo CLIP: {e}")
+        finally:
+            self.model_ready.set()
+
+    @property
+    def image_dir(self) -> str:
+        return self.engine.image_dir
+
+    @image_dir.setter
+    def image_dir(self, value: str):
+        self.engine.image_dir = value
+
+    def post(self, callback: Callable, *args):
+        """Encola `callback(*args)` para ejecutarlo en el hilo de la interfaz. Se puede llamar desde cualquier hilo."""
+        self.ui_queue.put((callback, args))
+
+    def process_ui_queue(self):
+        """Aplica las actualizaciones encoladas por los hilos de trabajo y vuelve a programarse."""
+        try:
+            while True:
+                callback, args = self.ui_queue.get_nowait()
+                try:
+                    callback(*args)
+                except Exception as e:
+                    logging.error(f"Error al actualizar la interfaz: {e}")
+        except queue.Empty:
+            pass
+        self.root.after(POLL_INTERVAL_MS, self.process_ui_queue)
+
+    def set_status(self, text: str, color: str = "gray"):
+        """Muestra un mensaje de estado del motor en la barra inferior."""
+        self.status_text = text
+        self.status_label.config(text=text, foreground=color)
+
+    def update_progress(self, done: int, total: int):
+        """Refleja en la barra de progreso el avance de la indexación y en la de estado su ritmo y tiempo restante."""
+        self.progress_bar["maximum"] = max(total, 1)
+        self.progress_bar["value"] = done
+        rate, remaining = self.progress_rate.update(done, total)
+        if rate is not None and done < total:
+            self.status_label.config(text=f"{self.status_text} {done}/{total} · {rate:.1f} img/s · "
+                                          f"quedan {format_duration(remaining)}")
+
+    def dump_metrics(self, event=None):
+        """Guarda una instantánea de las métricas de rendimiento (Ctrl+M)."""
+        try:
+            file_path = self.engine.dump_metrics()
+        except OSError as e:
+            logging.error(f"No se pudieron guardar las métricas: {e}")
+            self.status_label.config(text=f"No se pudieron guardar las métricas: {e}", foreground="red")
+            return
+        self.status_label.config(text=f"Métricas guardadas en {file_path}", foreground="gray")
+
+    def when_model_ready(self, callback: Callable[[], None]):
+        """Ejecuta `callback` en el hilo de la interfaz cuando el modelo haya terminado de cargarse."""
+        if not self.model_ready.is_set():
+            self.root.after(POLL_INTERVAL_MS, self.when_model_ready, callback)
+            return
+        if self.model_error is not None:
+            self.status_label.config(text=f"Error al cargar el modelo CLIP: {self.model_error}", foreground="red")
+            return
+        callback()
+
+    def on_model_ready_without_index(self):
+        self.status_label.config(text="Modelo cargado. Seleccione un directorio de imágenes.", foreground="gray")
+        self.log_startup_timings()
+
+    def log_startup_timings(self):
+        """Registra una sola vez la duración de cada fase del arranque."""
+        if "ready" in self.startup_timings:
+            return
+        self.startup_timings["ready"] = time.perf_counter() - self.startup_start
+        phases = ", ".join(f"{name}: {seconds:.2f}s" for name, seconds in self.startup_timings.items())
+        logging.info(f"Tiempos de arranque: {phases}")
 
     def _create_widgets(self):
         """Crea los widgets de la interfaz"""
@@ -134,6 +247,16 @@ class ImageSearchWindow:
         self.entry_image_dir.grid(row=0, column=1, padx=5, pady=5, sticky="ew")
         self.btn_browse_image_dir = ttk.Button(self.frame_image_dir, text="Examinar", command=self.browse_image_dir)
         self.btn_browse_image_dir.grid(row=0, column=2, padx=5, pady=5)
+        self.btn_add_image_dir = ttk.Button(self.frame_image_dir, text="Añadir", command=self.add_image_dir)
+        self.btn_add_image_dir.grid(row=0, column=3, padx=5, pady=5)
+        self.check_watch = ttk.Checkbutton(self.frame_image_dir, text="Vigilar carpetas y actualizar el índice automáticamente",
+                                           variable=self.watch_enabled, command=self.toggle_watch)
+        self.check_watch.grid(row=2, column=1, padx=5, pady=(0, 5), sticky="w")
+        self.label_collection = ttk.Label(self.frame_image_dir, text="Colección:", font=("Arial", "10"))
+        self.label_collection.grid(row=1, column=0, padx=5, pady=5, sticky="w")
+        self.combo_collection = ttk.Combobox(self.frame_image_dir, state="readonly", width=30)
+        self.combo_collection.grid(row=1, column=1, padx=5, pady=5, sticky="w")
+        self.combo_collection.bind("<<ComboboxSelected>>", lambda event: self.select_collection())
         self.frame_image_dir.columnconfigure(1, weight=1)
 
         self.frame_query = ttk.LabelFrame(self.main_frame, text="Búsqueda", padding=5)
@@ -162,6 +285,13 @@ class ImageSearchWindow:
         self.label_k_value.grid(row=3, column=0, padx=5, pady=5, sticky="w")
         self.entry_k_value = ttk.Spinbox(self.frame_query, from_=1, to=20, textvariable=self.k_value, width=5)
         self.entry_k_value.grid(row=3, column=1, padx=5, pady=5, sticky="w")
+        self.label_filter = ttk.Label(self.frame_query, text="Filtro (opcional):", font=("Arial", "10"))
+        self.label_filter.grid(row=4, column=0, padx=5, pady=5, sticky="w")
+        self.entry_filter = ttk.Entry(self.frame_query, width=60)
+        self.entry_filter.grid(row=4, column=1, padx=5, pady=5, sticky="ew")
+        self.check_search_all = ttk.Checkbutton(self.frame_query, text="Buscar en todas las colecciones",
+                                                variable=self.search_all_collections)
+        self.check_search_all.grid(row=5, column=1, padx=5, pady=(0, 5), sticky="w")
 
         self.frame_query.columnconfigure(1, weight=1)
 
@@ -172,9 +302,13 @@ class ImageSearchWindow:
         self.btn_update_index.pack(side=tk.LEFT, padx=(165, 20), pady=5)
 
         self.btn_search = ttk.Button(self.frame_buttons, text="Buscar",width=20, command=self.search, style="Blue.TButton")
-        self.btn_search.pack(side=tk.LEFT, padx=(20, 105), pady=5)
+        self.btn_search.pack(side=tk.LEFT, padx=(20, 20), pady=5)
+        self.btn_cancel = ttk.Button(self.frame_buttons, text="Cancelar", width=12, command=self.cancel, state="disabled")
+        self.btn_cancel.pack(side=tk.LEFT, padx=(0, 5), pady=5)
         self.btn_search.bind('<Return>', lambda event: self.search())
         self.root.bind('<Return>', lambda event: self.search())
+        self.root.bind('<Control-m>', self.dump_metrics)
+        self.root.bind('<Escape>', lambda event: self.cancel())
         self.about_button = ttk.Button(self.frame_buttons, text="Acerca de", width=12, command=self.show_about)
         self.about_button.pack(side=tk.RIGHT, padx=5, pady=5)
 
@@ -186,7 +320,13 @@ class ImageSearchWindow:
                             "5. Haz clic en 'Buscar' o presiona la tecla ENTER. Los resultados se mostrarán en una nueva pestaña del Navegador.\n\n" \
                             "Consejos:\n\n" \
                             "*. Prueba con sinónimos e incluso en inglés y otros idiomas\n" \
-                            "*. En caso de que cambie el directorio de imágenes, usar botón para actualiza el índice."
+                            "*. En caso de que cambie el directorio de imágenes, usar botón para actualiza el índice.\n" \
+                            "*. Con 'Añadir' se pueden buscar varias carpetas a la vez; se incluyen sus subcarpetas.\n" \
+                            "*. Cada carpeta elegida con 'Examinar' es una colección; se cambia entre ellas con 'Colección'.\n" \
+                            "*. Con 'Vigilar carpetas' el índice se actualiza solo al añadir, cambiar o borrar imágenes.\n" \
+                            "*. 'Filtro' limita los resultados, p. ej.: folder:vacaciones date>=2023-06 width>=1024 size<5MB\n" \
+                            "*. 'Cancelar' (o ESC) detiene la indexación o la búsqueda en curso.\n" \
+                            "*. Ctrl+M guarda las métricas de rendimiento en la carpeta 'metrics'."
         self.instructions_label = ttk.Label(self.main_frame, text=instructions_text, font=("Arial", "11"),
                                         foreground="gray", justify=tk.LEFT)
         self.instructions_label.pack(side=tk.TOP, fill=tk.X, padx=5, pady=5)
@@ -207,40 +347,91 @@ class ImageSearchWindow:
 
     def load_config(self):
         """Carga la configuración desde un archivo o crea una configuración por defecto."""
-        try:
-            with open(CONFIG_FILE, "r") as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return {"image_dir": ""}
+        return read_config_file()
 
     def save_config(self):
         """Guarda la configuración actual en un archivo."""
-        config = {
-            "image_dir": self.image_dir
-        }
+        self.config["image_dir"] = self.image_dir
+        self.config["collection"] = self.collections.active or ""
+        self.config["watch"] = self.watch_enabled.get()
         with open(CONFIG_FILE, "w") as f:
-            json.dump(config, f)
+            json.dump(self.config, f, indent=2)
 
     def _load_last_paths_and_check_index(self):
         """Carga los últimos valores usados desde la configuración y verifica el índice."""
-        self.image_dir = self.config.get("image_dir", "")
+        image_dir = self.config.get("image_dir", "")
+        name = self.config.get("collection", "")
+        if name not in self.collections.collections and image_dir:
+            # Índice de una versión sin colecciones: se adopta como colección sin reindexar.
+            name = self.collections.name_for(image_dir)
+            if name not in self.collections.collections:
+                self.collections.add(name, image_dir, index_dir=INDEX_DIR)
+        if name in self.collections.collections:
+            self.engine = self.collections.activate(name)
+        self.refresh_collection_list()
         self.entry_image_dir.insert(0, self.image_dir)
 
         if self.image_dir:
             self.load_or_create_index()
 
+    def refresh_collection_list(self):
+        self.combo_collection["values"] = self.collections.names()
+        self.combo_collection.set(self.collections.active or "")
+
+    def select_collection(self):
+        name = self.combo_collection.get()
+        if name and name != self.collections.active:
+            self.switch_collection(name)
+
+    def switch_collection(self, name: str):
+        """Activa otra colección; si su índice sigue en memoria, se puede buscar en ella al instante."""
+        if self.indexing:
+            messagebox.showerror("Error", "Espere a que termine la indexación o cancélela antes de cambiar de colección.")
+            self.refresh_collection_list()
+            return
+        self.stop_watcher()
+        self.engine = self.collections.activate(name)
+        self.refresh_collection_list()
+        self.entry_image_dir.delete(0, tk.END)
+        self.entry_image_dir.insert(0, self.image_dir)
+        self.load_or_create_index()
+        self.save_config()
+
+    def ensure_collection(self, image_dir: str):
+        """Asigna `image_dir` a la colección activa, o crea (o elige) una colección para él si no hay ninguna."""
+        name = self.collections.active or self.collections.name_for(image_dir)
+        self.collections.add(name, image_dir)
+        if name != self.collections.active:
+            self.engine = self.collections.activate(name)
+            self.refresh_collection_list()
+
     def on_close(self):
-        """Guarda los valores de configuración antes de cerrar."""
+        """Guarda los valores de configuración y la caché de consultas antes de cerrar."""
+        self.engine.cancel_indexing()
+        self.stop_watcher()
+        self.search_generation += 1
+        self.search_executor.shutdown(wait=False, cancel_futures=True)
         self.save_config()
+        self.model_engine.save_query_cache()
         self.root.destroy()
 
     def browse_image_dir(self):
         """Abre un diálogo para seleccionar el directorio de imágenes."""
         new_image_dir = filedialog.askdirectory(title="Seleccionar Directorio de Imágenes")
         if new_image_dir:
+            name = self.collections.name_for(new_image_dir)
+            if name not in self.collections.collections:
+                self.collections.add(name, new_image_dir)
+            self.switch_collection(name)
+
+    def add_image_dir(self):
+        """Añade otro directorio raíz a los directorios de imágenes seleccionados."""
+        new_image_dir = filedialog.askdirectory(title="Añadir Directorio de Imágenes")
+        if new_image_dir and new_image_dir not in self.engine.root_dirs():
+            image_dirs = os.pathsep.join(self.engine.root_dirs() + [new_image_dir])
             self.entry_image_dir.delete(0, tk.END)
-            self.entry_image_dir.insert(0, new_image_dir)
-            self.image_dir = new_image_dir
+            self.entry_image_dir.insert(0, image_dirs)
+            self.ensure_collection(image_dirs)
             self.load_or_create_index()
             self.save_config()
 
@@ -253,368 +444,320 @@ class ImageSearchWindow:
             self.entry_query_image.delete(0, tk.END)
             self.entry_query_image.insert(0, query_image_path)
 
-    def is_index_valid(self):
-        """Verifica si el índice almacenado es válido para el directorio de imágenes actual."""
-        try:
-            with open(INDEX_FILE, "rb") as f:
-                stored_data = pickle.load(f)
-                stored_metadata = stored_data.get("metadata", {})
-                stored_image_dir = stored_data.get("image_dir", "")
-
-                if not stored_metadata or self.image_dir != stored_image_dir:
-                    logging.info("El directorio de imágenes ha cambiado o no hay metadatos almacenados.")
-                    return False
-
-                image_paths = [os.path.join(self.image_dir, img) for img in os.listdir(self.image_dir) if
-                                img.lower().endswith(('.png', '.jpg', '.jpeg'))]
-
-                current_metadata = {}
-                for path in image_paths:
-                    try:
-                        with Image.open(path) as img:
-                            current_metadata[path] = os.path.getmtime(path)
-                    except Exception as e:
-                        logging.warning(f"No se pudo leer la imagen: {path}. Será ignorada. Error: {e}")
-                        continue
-
-                valid_image_count = len([p for p in image_paths if os.path.getmtime(p) in current_metadata.values()])
-                if valid_image_count != len(stored_metadata):
-                    logging.info("El número de imágenes legibles ha cambiado.")
-                    return False
-
-                if current_metadata != stored_metadata:
-                    logging.info("Los metadatos de las imágenes han cambiado.")
-                    return False
-
-                logging.info("El índice es válido y está actualizado.")
-                return True
-
-        except (FileNotFoundError, pickle.UnpicklingError) as e:
-            logging.warning(f"No se encontró el archivo del índice o está corrupto: {e}")
-            return False
-
-    def load_or_create_index(self):
-        """Carga un índice existente o crea uno nuevo si es necesario."""
+    def load_or_create_index(self, manual: bool = False):
+        """Carga un índice existente o crea uno nuevo si es necesario.
+
+        La verificación y la lectura del índice se hacen en segundo plano; el resultado se aplica
+        en el hilo de la interfaz. `manual` indica que la pidió el botón "Actualizar Índice".
+        """
         current_image_dir = self.entry_image_dir.get()
         if not current_image_dir:
             return
 
-        if self.image_dir != current_image_dir:
-            self.image_dir = current_image_dir
+        if self.image_dir != current_image_dir or self.collections.active is None:
+            self.ensure_collection(current_image_dir)
 
+        self.stop_watcher()
         self.status_label.config(text="Verificando cambios del directorio...", foreground="gray")
         self.disable_search_button()
-
-        if self.is_index_valid():
-            self.load_index()
-            self.status_label.config(text="Índice cargado desde archivo. ", foreground="green")
-            self.enable_search_button()
-        else:
-            self.status_label.config(text="Índice desactualizado. Reindexando imágenes...", foreground="orange")
-            self.index_images_threaded()
-
-    def load_index(self):
-        """Carga el índice FAISS almacenado en disco."""
+        if self.engine.has_index() and self.model_ready.is_set() and self.model_error is None:
+            # La colección sigue en memoria: se puede buscar mientras se comprueban los cambios.
+            self.btn_search.config(state="normal")
+
+        check = {"manual": manual, "result": None, "engine": self.engine}
+        self.index_check = check
+        threading.Thread(target=self.check_index, args=(check,), daemon=True).start()
+        self.root.after(POLL_INTERVAL_MS, self.poll_index_check, check)
+
+    def check_index(self, check: dict):
+        """Verifica el índice almacenado y lo lee si es válido. Se ejecuta en segundo plano."""
+        start = time.perf_counter()
+        engine = check["engine"]
         try:
-            with open(INDEX_FILE, "rb") as f:
-                stored_data = pickle.load(f)
-                self.index = stored_data.get("index")
-                self.image_paths = stored_data.get("image_paths")
-                self.index_metadata = stored_data.get("metadata")
-
-                if self.index is None or self.image_paths is None or self.index_metadata is None:
-                    logging.error("Los datos del índice están incompletos o son inválidos. Reindexando...")
-                    self.index = None
-                    self.image_paths = None
-                    self.index_metadata = {}
-                    self.status_label.config(text="Datos del índice incompletos. Reindexando...", foreground="red")
-                    self.index_images_threaded()
-                    return
-
-                if self.index.ntotal != len(self.image_paths):
-                    logging.error(
-                        f"Inconsistencia en el índice: Número de imágenes ({len(self.image_paths)}) no coincide con el número de vectores en el índice ({self.index.ntotal}). Reindexando...")
-                    self.index = None
-                    self.image_paths = None
-                    self.index_metadata = {}
-                    self.status_label.config(text="Inconsistencia en el índice detectada. Reindexando...",
-                                            foreground="red")
-                    self.index_images_threaded()
+            if engine.is_index_valid():
+                if engine.has_index():
+                    check["result"] = ("loaded", None)
                     return
+                stored_data = engine.read_stored_index()
+                check["result"] = ("valid", stored_data) if stored_data is not None else ("rebuild", None)
+            elif engine.can_update_incrementally():
+                check["result"] = ("update", None)
+            else:
+                check["result"] = ("rebuild", None)
+        except Exception as e:
+            logging.error(f"Error al verificar el índice: {e}")
+            check["result"] = ("rebuild", None)
+        finally:
+            self.startup_timings.setdefault("index_check", time.perf_counter() - start)
+
+    def poll_index_check(self, check: dict):
+        """Aplica el resultado de check_index cuando está disponible."""
+        if check is not self.index_check:
+            return
+        if check["result"] is None:
+            self.root.after(POLL_INTERVAL_MS, self.poll_index_check, check)
+            return
 
-                logging.info(
-                    f"Índice cargado correctamente. Imágenes: {len(self.image_paths)}, Vectores en el índice: {self.index.ntotal}")
-        except (FileNotFoundError, pickle.UnpicklingError) as e:
-            logging.error(f"Error al cargar el archivo del índice: {e}")
-            self.index = None
-            self.image_paths = None
-            self.index_metadata = {}
+        status, stored_data = check["result"]
+        if status == "loaded":
+            self.when_model_ready(lambda: self.on_index_loaded(check["manual"], from_memory=True))
+        elif status == "valid" and self.engine.apply_stored_index(stored_data):
+            logging.info(
+                f"Índice cargado correctamente. Imágenes: {self.engine.count_indexed_images()}, Fragmentos: {len(self.engine.shards)}")
+            if not self.model_ready.is_set():
+                self.status_label.config(text="Índice cargado. Cargando modelo CLIP...", foreground="gray")
+            self.when_model_ready(lambda: self.on_index_loaded(check["manual"]))
+        elif status == "update":
+            self.status_label.config(text="Índice desactualizado. Actualizando cambios...", foreground="orange")
+            self.when_model_ready(self.update_index_incremental_threaded)
+        else:
+            self.status_label.config(text="Índice desactualizado. Reindexando imágenes...", foreground="orange")
+            self.when_model_ready(self.index_images_threaded)
 
-    def save_index(self):
-        """Guarda el índice FAISS en disco junto con los metadatos de las imágenes."""
-        try:
-            with open(INDEX_FILE, "wb") as f:
-                data = {
-                    "index": self.index,
-                    "image_paths": self.image_paths,
-                    "metadata": self.index_metadata,
-                    "image_dir": self.image_dir,
-                }
-                pickle.dump(data, f)
-        except Exception as e:
-            logging.error(f"Error al guardar el índice en el archivo: {e}")
+    def on_index_loaded(self, manual: bool, from_memory: bool = False):
+        if manual:
+            self.status_label.config(text="Índice está actualizado. ", foreground="green")
+            messagebox.showinfo("Información", "El índice ya está actualizado. ")
+        elif from_memory:
+            self.status_label.config(text="Colección cargada desde la memoria. ", foreground="green")
+        else:
+            self.status_label.config(text="Índice cargado desde archivo. ", foreground="green")
+        self.collections.touch(self.collections.active)
+        self.enable_search_button()
+        self.update_watcher()
+        self.log_startup_timings()
 
     def index_images_threaded(self):
         """Inicia el proceso de indexación en un hilo separado."""
         self.status_label.config(text="Indexando imágenes, por favor espere...", foreground="red")
+        self.start_indexing(self.index_images)
+
+    def update_index_incremental_threaded(self):
+        """Inicia la actualización incremental del índice en un hilo separado."""
+        self.status_label.config(text="Actualizando el índice, por favor espere...", foreground="red")
+        self.start_indexing(self.update_index_incremental)
+
+    def start_indexing(self, target: Callable[[], None]):
+        self.indexing = True
         self.disable_search_button()
-        threading.Thread(target=self.index_images, daemon=True).start()
+        self.btn_cancel.config(state="normal")
+        threading.Thread(target=target, daemon=True).start()
 
     def index_images(self):
-        """Indexa las imágenes en el directorio seleccionado."""
-        if not self.image_dir:
-            messagebox.showerror("Error", "Por favor, seleccione un directorio de imágenes.")
-            self.status_label.config(text="", foreground="gray")
-            self.enable_search_button()
+        """Indexa las imágenes en el directorio seleccionado. Se ejecuta en segundo plano."""
+        try:
+            self.engine.index_images()
+        except IndexingError as e:
+            self.post(self.on_indexing_failed, e)
             return
-
-        image_paths = [os.path.join(self.image_dir, img) for img in os.listdir(self.image_dir) if
-                    img.lower().endswith(('.png', '.jpg', '.jpeg'))]
-        num_images = len(image_paths)
-
-        if num_images == 0:
-            logging.warning("No se encontraron imágenes en el directorio especificado.")
-            messagebox.showerror("Error", "No se encontraron imágenes en el directorio especificado.")
-            self.status_label.config(text="", foreground="gray")
-            self.enable_search_button()
+        except Exception as e:
+            logging.exception(f"Error inesperado durante la indexación: {e}")
+            self.post(self.on_indexing_failed, e)
             return
+        self.post(self.on_indexing_finished, "Imágenes indexadas correctamente. ", True)
 
-        self.index = faiss.IndexFlatIP(self.feature_dim)
-        features = []
-        self.index_metadata = {}
+    def update_index_incremental(self):
+        """Actualiza el índice procesando solo las imágenes nuevas, modificadas o eliminadas. Se ejecuta en segundo plano."""
+        try:
+            self.engine.update_index_incremental()
+        except IndexingError as e:
+            self.post(self.on_indexing_failed, e)
+            return
+        except Exception as e:
+            logging.exception(f"Error inesperado durante la actualización del índice: {e}")
+            self.post(self.on_indexing_failed, e)
+            return
+        self.post(self.on_indexing_finished, "Índice actualizado correctamente. ", False)
 
-        self.progress_bar["maximum"] = num_images
+    def on_indexing_finished(self, message: str, notify: bool):
+        self.indexing = False
+        self.btn_cancel.config(state="disabled")
+        self.status_label.config(text=message, foreground="green")
         self.progress_bar["value"] = 0
+        self.collections.touch(self.collections.active)
+        self.enable_search_button()
+        self.update_watcher()
+        if notify:
+            messagebox.showinfo("Información", message)
+
+    def on_indexing_failed(self, error: Exception):
+        """Restablece la interfaz tras una indexación cancelada o fallida (IndexingError o cualquier otro error)."""
+        self.indexing = False
+        self.btn_cancel.config(state="disabled")
+        self.progress_bar["value"] = 0
+        if isinstance(error, IndexingCancelled):
+            self.status_label.config(text="Indexación cancelada. 'Actualizar Índice' la reanuda.", foreground="orange")
+        else:
+            self.status_label.config(text="", foreground="gray")
+            message = str(error) if isinstance(error, IndexingError) else f"Error durante la indexación: {error}"
+            messagebox.showerror("Error", message)
+        self.btn_update_index.config(state="normal")
+        if self.engine.has_index():
+            self.btn_search.config(state="normal")
 
-        for i in range(0, num_images, self.batch_size):
-            batch_paths = image_paths[i:i + self.batch_size]
-            batch_features = self.extract_image_features_batch(batch_paths)
-
-            if batch_features is not None:
-                features.extend(batch_features)
-                for path in batch_paths:
-                    try:
-                        self.index_metadata[path] = os.path.getmtime(path)
-                    except FileNotFoundError:
-                        logging.warning(f"Imagen no encontrada, no se indexará: {path}")
-                        continue
-            else:
-                logging.warning(f"Error al procesar el lote de imágenes {batch_paths}. Saltando este lote.")
-
-            self.progress_bar["value"] = i + len(batch_paths)
-            self.progress_bar.update()
-
-        self.progress_bar["value"] = num_images
-        self.progress_bar.update()
+    def toggle_watch(self):
+        self.update_watcher()
+        self.save_config()
 
-        if not features:
-            logging.error("No se pudieron extraer las características de ninguna imagen.")
-            messagebox.showerror("Error", "No se pudieron extraer las características de ninguna imagen.")
-            self.status_label.config(text="", foreground="gray")
-            self.enable_search_button()
+    def update_watcher(self):
+        """Inicia o detiene la vigilancia de los directorios según la casilla, si hay un índice cargado."""
+        if not self.watch_enabled.get() or self.indexing or not self.engine.has_index():
+            self.stop_watcher()
+            return
+        if self.watcher is None:
+            watcher = DirectoryWatcher(self.engine)
+            watcher.on_update = lambda refreshed: self.post(self.on_watch_update, watcher, refreshed)
+            self.watcher = watcher.start()
+
+    def stop_watcher(self):
+        # No se espera a los hilos: una actualización en curso termina sola y la siguiente indexación
+        # aguarda a que suelte el índice.
+        if self.watcher is not None:
+            self.watcher.stop(wait=False)
+            self.watcher = None
+
+    def on_watch_update(self, watcher: DirectoryWatcher, refreshed: List[str]):
+        if watcher is not self.watcher:
             return
-
-        features = np.array(features, dtype=np.float32)
-        features = self.normalize_vectors(features)
-        self.index.add(features)
-        self.image_paths = image_paths
-        self.save_index()
-        self.status_label.config(text="Imágenes indexadas correctamente. ", foreground="green")
-        messagebox.showinfo("Información", "Imágenes indexadas correctamente. ")
-        self.enable_search_button()
         self.progress_bar["value"] = 0
-        self.progress_bar.update()
-        logging.info(
-            f"Indexación finalizada. Imágenes: {len(self.image_paths)}, Vectores en el índice: {self.index.ntotal}")
-
-    def extract_image_features_batch(self, image_paths: List[str]) -> Optional[List[np.ndarray]]:
-        """Extrae las características de un lote de imágenes utilizando el modelo CLIP."""
-        images = []
-        valid_paths = []
-        for path in image_paths:
-            try:
-                with Image.open(path) as img:
-                    img = img.convert('RGB')
-                    img_tensor = self.preprocess(img).unsqueeze(0)
-                    images.append(img_tensor)
-                    valid_paths.append(path)
-            except Exception as e:
-                logging.error(f"Error al abrir o procesar imagen: {path}. Error: {e}")
-                continue
-
-        if not images:
-            logging.warning("No se pudieron cargar imágenes validas del lote.")
-            return None
+        self.status_label.config(
+            text=f"Índice actualizado automáticamente ({len(refreshed)} carpetas). "
+                 f"Imágenes: {self.engine.count_indexed_images()}", foreground="green")
+
+    def cancel(self):
+        """Cancela la indexación en curso o la búsqueda pendiente."""
+        if self.indexing:
+            self.engine.cancel_indexing()
+            self.status_label.config(text="Cancelando la indexación...", foreground="orange")
+            return
+        self.search_generation += 1
+        if self.search_future is not None:
+            self.search_future.cancel()
+        self.btn_cancel.config(state="disabled")
+        self.status_label.config(text="Búsqueda cancelada.", foreground="gray")
 
-        try:
-            batch_images = torch.cat(images).to(self.device)
-            with torch.no_grad():
-                batch_features = self.model.encode_image(batch_images).cpu().numpy()
-                return [feature for feature in batch_features]
+    def generate_html(self, query_feature: np.ndarray, k: int = 5, query_type: str = "image",
+                        query_text: str = "", collections: Optional[List[str]] = None,
+                        image_filter: Optional[ImageFilter] = None) -> Optional[str]:
+        """Genera un archivo HTML con los resultados de búsqueda y lo abre en un navegador.
 
-        except Exception as e:
-            logging.error(f"Error al procesar el lote de imágenes: {e}")
+        Con `collections` se busca en esas colecciones y se mezclan sus resultados; con `image_filter`
+        solo se muestran las imágenes que cumplen el filtro.
+        """
+        if query_feature is None:
+            logging.error(f"No se pudieron extraer las features de la consulta tipo {query_type}")
             return None
 
-    def extract_image_features(self, image_path: str) -> Optional[np.ndarray]:
-        """Extrae las características de una imagen utilizando el modelo CLIP."""
-        try:
-            with Image.open(image_path) as img:
-                image = img.convert('RGB')
-                image = self.preprocess(image).unsqueeze(0).to(self.device)
-
-            with torch.no_grad():
-                features = self.model.encode_image(image)
-                features = features.squeeze().cpu().numpy()
-
-            return features
+        if collections:
+            results = self.collections.search_features(collections, query_feature.reshape(1, -1), k, image_filter)[0]
+        else:
+            results = self.engine.search(query_feature, k, image_filter)
 
-        except Exception as e:
-            logging.error(f"Error al extraer características de la imagen {image_path}: {e}")
+        if not results:
+            logging.error("No se encontraron resultados para la búsqueda.")
             return None
 
-    def extract_text_features(self, text: str) -> Optional[np.ndarray]:
-        """Extrae las características de un texto utilizando el modelo CLIP."""
-        try:
-            text_input = clip.tokenize([text]).to(self.device)
-            with torch.no_grad():
-                features = self.model.encode_text(text_input)
-                features = features.squeeze().cpu().numpy()
+        with self.engine.metrics.time("generate_html", len(results)):
+            return render_results_html(results, self.engine.thumbnail_store, query_type, query_text)
 
-            return features
+    def submit_search(self, query_type: str, query: str, k: int, image_filter: Optional[ImageFilter] = None):
+        """Lanza la búsqueda en segundo plano; una búsqueda nueva sustituye a la anterior.
 
+        Si la anterior aún no había empezado se descarta; si está en marcha, su resultado se ignora.
+        """
+        self.search_generation += 1
+        if self.search_future is not None:
+            self.search_future.cancel()
+        collections = self.collections.names() if self.search_all_collections.get() else None
+        self.search_future = self.search_executor.submit(self.run_search, self.search_generation, query_type, query, k,
+                                                         collections, image_filter)
+        self.btn_cancel.config(state="normal")
+        self.status_label.config(text="Buscando...", foreground="gray")
+
+    def is_superseded(self, generation: int) -> bool:
+        return generation != self.search_generation
+
+    def run_search(self, generation: int, query_type: str, query: str, k: int,
+                   collections: Optional[List[str]] = None, image_filter: Optional[ImageFilter] = None):
+        """Codifica la consulta, busca y genera la página de resultados. Se ejecuta en segundo plano.
+
+        Cualquier error se notifica a la interfaz con on_search_failed; el futuro nunca se consulta.
+        """
+        try:
+            if query_type == "image":
+                query_feature = self.engine.get_image_query_features(query)
+            else:
+                query_feature = self.engine.get_text_query_features(query)
+            if self.is_superseded(generation):
+                logging.debug(f"Búsqueda descartada por otra más reciente: {query}")
+                return
+            html_content = self.generate_html(query_feature, k, query_type, query if query_type == "text" else "",
+                                              collections, image_filter)
+            if self.is_superseded(generation):
+                return
+
+            temp_filename = None
+            if html_content:
+                with tempfile.NamedTemporaryFile(mode='w', suffix=".html", delete=False) as f:
+                    temp_filename = f.name
+                    f.write(html_content)
         except Exception as e:
-            logging.error(f"Error al extraer features de texto: {e}")
-            return None
-
-    def normalize_vectors(self, vectors: np.ndarray) -> np.ndarray:
-        """Normaliza un array de vectores para que tenga longitud unitaria."""
-        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
-        return vectors / (norms + 1e-8)
-
-    def generate_html(self, query_feature: np.ndarray, k: int = 5, query_type: str = "image",
-                        query_text: str = "") -> Optional[str]:
-        """Genera un archivo HTML con los resultados de búsqueda y lo abre en un navegador."""
-        if query_feature is None:
-            logging.error(f"No se pudieron extraer las features de la consulta tipo {query_type}")
-            return None
-
-        query_feature = self.normalize_vectors(query_feature.reshape(1, -1))
-        D, I = self.index.search(query_feature, k)
+            logging.error(f"Error durante la búsqueda '{query}': {e}")
+            self.post(self.on_search_failed, generation, str(e))
+            return
+        self.post(self.on_search_finished, generation, temp_filename)
 
-        if I.size == 0 or len(I[0]) == 0:
-            logging.error("No se encontraron resultados para la búsqueda.")
-            return None
+    def on_search_failed(self, generation: int, message: str):
+        """Muestra el error de una búsqueda si sigue siendo la más reciente."""
+        if self.is_superseded(generation):
+            return
+        self.btn_cancel.config(state="disabled")
+        self.status_label.config(text=f"Error durante la búsqueda: {message}", foreground="red")
 
-        html_content = """
-            <html>
-            <head>
-                <style>
-                    .container { display: flex; flex-wrap: wrap; justify-content: flex-start; }
-                    .image-item { margin: 10px; text-align: center; }
-                    .image-item img { width: 150px; height: auto; border: 1px solid #ddd; }
-                    .query-title { margin-bottom: 10px; }
-                    .dist-indices { margin-top: 10px; font-size: 0.8em; color: #555;}
-                    .image-text-container { display: inline-block; margin: 10px; text-align: left; width: 150px;}
-                    .image-item a { text-decoration: none; }
-                    .image-item a:hover { text-decoration: underline; }
-                    body { font-family: sans-serif; margin: 20px; }
-                </style>
-            </head>
-            <body>
-        """
+    def on_search_finished(self, generation: int, temp_filename: Optional[str]):
+        """Abre la página de resultados en el navegador si la búsqueda sigue siendo la más reciente."""
+        if self.is_superseded(generation):
+            return
+        self.btn_cancel.config(state="disabled")
+        if temp_filename is None:
+            self.status_label.config(text="No se encontraron resultados para la búsqueda.", foreground="red")
+            return
+        self.status_label.config(text="", foreground="gray")
+        webbrowser.open_new_tab(f"file:///{temp_filename}")
 
-        if query_type == "image":
-            html_content += f'<h1 class="query-title">Resultados de la Búsqueda por Imagen</h1>'
-        elif query_type == "text":
-            html_content += f'<h1 class="query-title">Resultados de la Búsqueda por Texto</h1>'
-            html_content += f'<p class="query-title">Texto de la Consulta: {query_text}</p>'
-
-        html_content += f'<p class="dist-indices">Distancias: {D.tolist()}</p>'
-        html_content += f'<p class="dist-indices">Indices: {I.tolist()}</p>'
-        html_content += '<div class="container">'
-        for idx in I[0]:
-            if 0 <= idx < len(self.image_paths):
-                image_path = self.image_paths[idx]
-                try:
-                    with Image.open(image_path) as img:
-                        if img.mode == 'RGBA':
-                            img = img.convert('RGB')
-                        img.thumbnail((150, 150))
-                        buffered = io.BytesIO()
-                        img.save(buffered, format="JPEG")
-                        encoded_image = f"data:image/jpeg;base64,{base64.b64encode(buffered.getvalue()).decode()}"
-                    html_content += f"""
-                        <div class="image-item">
-                            <a href="file:///{image_path}">
-                                <img src="{encoded_image}" alt="Imagen" />
-                            </a>
-                            <br>
-                        </div>
-                    """
-                except Exception as e:
-                    logging.error(f"No se pudo crear la miniatura para la imagen {image_path} : {e}")
-                    html_content += f"""
-                        <div class="image-item">
-                            <a href="file:///{image_path}">
-                                <span>Imagen No Disponible</span>
-                            </a>
-                            <br>
-                        </div>
-                    """
-            else:
-                logging.warning(f"Index {idx} fuera de rango. Número de imagenes: {len(self.image_paths)}")
-        html_content += '</div></body></html>'
-        return html_content
-
-    def search_and_display(self, query_feature: np.ndarray, k: int = 5, query_type: str = "image",
-                        query_text: str = ""):
-        """Genera un archivo HTML con los resultados de búsqueda y lo abre en un navegador."""
-        html_content = self.generate_html(query_feature, k, query_type, query_text)
-
-        if html_content:
-            with tempfile.NamedTemporaryFile(mode='w', suffix=".html", delete=False) as f:
-                temp_filename = f.name
-                f.write(html_content)
-            webbrowser.open_new_tab(f"file:///{temp_filename}")
-
-    def search_by_image(self, query_image_path: str, k: int = 5):
+    def search_by_image(self, query_image_path: str, k: int = 5, image_filter: Optional[ImageFilter] = None):
         """Realiza una búsqueda de imágenes basada en una imagen de consulta."""
-        query_feature = self.extract_image_features(query_image_path)
-        self.search_and_display(query_feature, k, query_type="image")
+        self.submit_search("image", query_image_path, k, image_filter)
 
-    def search_by_text(self, query_text: str, k: int = 3):
+    def search_by_text(self, query_text: str, k: int = 3, image_filter: Optional[ImageFilter] = None):
         """Realiza una búsqueda de imágenes basada en una consulta de texto."""
-        query_feature = self.extract_text_features(query_text)
-        self.search_and_display(query_feature, k, query_type="text", query_text=query_text)
+        self.submit_search("text", query_text, k, image_filter)
 
     def search(self):
         """Realiza una búsqueda basada en la consulta proporcionada (texto o imagen)."""
-        if not self.index:
+        if not self.engine.has_index():
             messagebox.showerror("Error", "Por favor, seleccione un directorio de imágenes e indexe las imágenes.")
             return
+        if self.engine.model is None:
+            messagebox.showerror("Error", "El modelo CLIP todavía se está cargando. Inténtelo de nuevo en unos segundos.")
+            return
 
         k = self.k_value.get()
+        try:
+            image_filter = parse_filter(self.entry_filter.get())
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
         if self.query_type.get() == "image":
             query_image_path = self.entry_query_image.get()
             if query_image_path:
-                self.search_by_image(query_image_path, k)
+                self.search_by_image(query_image_path, k, image_filter)
             else:
                 messagebox.showerror("Error", "Por favor, seleccione una imagen de consulta.")
         elif self.query_type.get() == "text":
             query_text = self.entry_query_text.get()
             if query_text:
-                self.search_by_text(query_text, k)
+                self.search_by_text(query_text, k, image_filter)
             else:
                 messagebox.showerror("Error", "Por favor, ingrese un texto de consulta.")
 
@@ -635,22 +778,10 @@ class ImageSearchWindow:
             messagebox.showerror("Error", "Por favor, seleccione un directorio de imágenes.")
             return
 
-        if self.image_dir != current_image_dir:
-            self.image_dir = current_image_dir
-
-        self.status_label.config(text="Verificando cambios en el directorio...", foreground="gray")
-        self.disable_search_button()
-
-        if self.is_index_valid():
-            self.load_index()
-            self.status_label.config(text="Índice está actualizado. ", foreground="green")
-            messagebox.showinfo("Información", "El índice ya está actualizado. ")
-            self.enable_search_button()
-        else:
-            self.index_images_threaded()
+        self.load_or_create_index(manual=True)
 
 
 if __name__ == "__main__":
     root = tk.Tk()
     app = ImageSearchWindow(root)
-    root.mainloop()
\ No newline at end of file
+    root.mainloop()
@@ -0,0 +1,511 @@
+"""Benchmark reproducible de la indexación, las consultas y la página de resultados.
+
+Genera un corpus sintético sin conexión, mide cada etapa por separado y devuelve un informe JSON
+(rendimiento, percentiles de latencia y memoria máxima) que se puede comparar entre ejecuciones.
+Con el codificador `random` funciona en CPU sin descargar el modelo CLIP.
+
+También incluye las comparaciones con el modelo CLIP real sobre imágenes del usuario: la velocidad y
+la calidad de cada precisión (`benchmark_precisions`) y del preprocesamiento rápido (`benchmark_preprocessing`).
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+from contextlib import contextmanager
+from functools import partial
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from image_search_engine import (
+    DEFAULT_FEATURE_DIM, IMAGE_EXTENSIONS, QueryEmbeddingCache, ImageSearchEngine, ThumbnailStore,
+    load_and_preprocess_batch, load_clip_model, render_results_html, select_device,
+)
+from image_search_filters import parse_filter
+from image_search_preprocess import FastPreprocess
+
+BENCHMARK_FORMAT_VERSION = 1
+CLIP_INPUT_SIZE = 224
+CLIP_MEAN = np.array([0.48145466, 0.4578275, 0.40821073], dtype=np.float32)
+CLIP_STD = np.array([0.26862954, 0.26130258, 0.27577711], dtype=np.float32)
+RANDOM_VOCAB_SIZE = 49408
+CONTEXT_LENGTH = 77
+QUERY_WORDS = ("perro", "gato", "playa", "montaña", "ciudad", "noche", "bosque", "coche", "retrato", "comida",
+               "rojo", "azul", "verde", "nieve", "río", "puente")
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Memoria residente máxima del proceso en MB, o None si la plataforma no la expone."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux la devuelve en KB y macOS en bytes.
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+    except (ImportError, AttributeError):
+        return None
+
+
+def generate_corpus(directory: str, num_images: int, resolution: Tuple[int, int] = (640, 480),
+                    num_folders: int = 4, seed: int = 0) -> List[str]:
+    """Genera `num_images` JPEG deterministas repartidas en `num_folders` subcarpetas."""
+    rng = np.random.default_rng(seed)
+    width, height = resolution
+    paths = []
+    for i in range(num_images):
+        folder = os.path.join(directory, f"folder{i % max(num_folders, 1):02d}")
+        os.makedirs(folder, exist_ok=True)
+        # Un degradado con ruido y unas formas de color da un JPEG de tamaño y coste de decodificación realistas.
+        base = rng.integers(0, 256, size=3)
+        gradient = np.linspace(0, 1, width, dtype=np.float32)[None, :, None]
+        pixels = base[None, None, :] * (0.5 + 0.5 * gradient) + rng.normal(0, 12, size=(height, width, 3))
+        img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+        draw = ImageDraw.Draw(img)
+        for _ in range(6):
+            x0, y0 = int(rng.integers(0, width)), int(rng.integers(0, height))
+            x1, y1 = x0 + int(rng.integers(10, width // 2 + 11)), y0 + int(rng.integers(10, height // 2 + 11))
+            draw.ellipse((x0, y0, x1, y1), fill=tuple(int(c) for c in rng.integers(0, 256, size=3)))
+        path = os.path.join(folder, f"img{i:06d}.jpg")
+        img.save(path, "JPEG", quality=90)
+        paths.append(path)
+    return paths
+
+
+def random_preprocess(img: Image.Image):
+    """Transformación equivalente a la de CLIP: redimensiona, recorta al centro y normaliza."""
+    import torch
+    scale = CLIP_INPUT_SIZE / min(img.size)
+    width, height = max(CLIP_INPUT_SIZE, round(img.width * scale)), max(CLIP_INPUT_SIZE, round(img.height * scale))
+    img = img.resize((width, height), Image.BICUBIC)
+    left, top = (width - CLIP_INPUT_SIZE) // 2, (height - CLIP_INPUT_SIZE) // 2
+    img = img.crop((left, top, left + CLIP_INPUT_SIZE, top + CLIP_INPUT_SIZE))
+    pixels = (np.asarray(img, dtype=np.float32) / 255.0 - CLIP_MEAN) / CLIP_STD
+    return torch.from_numpy(pixels.transpose(2, 0, 1).copy())
+
+
+def random_tokenize(texts, context_length: int = CONTEXT_LENGTH, truncate: bool = False):
+    """Tokenizador determinista de reemplazo con la misma interfaz que clip.tokenize."""
+    import torch
+    if isinstance(texts, str):
+        texts = [texts]
+    tokens = torch.zeros(len(texts), context_length, dtype=torch.long)
+    for row, text in enumerate(texts):
+        ids = [zlib.crc32(word.encode("utf-8")) % (RANDOM_VOCAB_SIZE - 1) + 1 for word in text.lower().split()]
+        if len(ids) > context_length and not truncate:
+            raise RuntimeError(f"El texto es demasiado largo para el contexto de {context_length} tokens: {text}")
+        ids = ids[:context_length]
+        tokens[row, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+    return tokens
+
+
+def create_random_encoder(dim: int = DEFAULT_FEATURE_DIM, seed: int = 0):
+    """Codificador pequeño con pesos aleatorios que imita la interfaz encode_image/encode_text de CLIP."""
+    import torch
+    from torch import nn
+
+    class RandomEncoder(nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.image_layers = nn.Sequential(
+                nn.Conv2d(3, 32, kernel_size=8, stride=8), nn.GELU(),
+                nn.Conv2d(32, 64, kernel_size=4, stride=4), nn.GELU(),
+                nn.AdaptiveAvgPool2d(1), nn.Flatten(), nn.Linear(64, dim))
+            self.token_embedding = nn.Embedding(RANDOM_VOCAB_SIZE, dim, padding_idx=0)
+            self.text_projection = nn.Linear(dim, dim)
+
+        def encode_image(self, images):
+            return self.image_layers(images)
+
+        def encode_text(self, tokens):
+            mask = (tokens != 0).unsqueeze(-1).float()
+            pooled = (self.token_embedding(tokens) * mask).sum(1) / mask.sum(1).clamp(min=1)
+            return self.text_projection(pooled)
+
+    torch.manual_seed(seed)
+    return RandomEncoder().eval()
+
+
+def load_random_worker_model(dim: int = DEFAULT_FEATURE_DIM, seed: int = 0):
+    """(codificador aleatorio, preprocesado rápido) para los procesos de inferencia del benchmark."""
+    return create_random_encoder(dim, seed), FastPreprocess(CLIP_INPUT_SIZE, CLIP_MEAN, CLIP_STD)
+
+
+def summarize_timings(durations: List[float], items: Optional[int] = None) -> dict:
+    """Tiempo total, rendimiento y percentiles (en ms) de las repeticiones de una etapa."""
+    durations = np.asarray(durations, dtype=np.float64)
+    total = float(durations.sum())
+    items = len(durations) if items is None else items
+    summary = {
+        "seconds": total,
+        "count": int(len(durations)),
+        "items": int(items),
+        "throughput_per_s": items / total if total > 0 else None,
+    }
+    for q in (50, 95, 99):
+        summary[f"p{q}_ms"] = float(np.percentile(durations, q) * 1000) if len(durations) else None
+    summary["peak_rss_mb"] = peak_rss_mb()
+    return summary
+
+
+class StageTimer:
+    """Acumula las duraciones de cada etapa del benchmark."""
+
+    def __init__(self):
+        self.durations: Dict[str, List[float]] = {}
+        self.items: Dict[str, int] = {}
+
+    @contextmanager
+    def measure(self, stage: str, items: int = 1):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations.setdefault(stage, []).append(time.perf_counter() - start)
+            self.items[stage] = self.items.get(stage, 0) + items
+
+    def report(self) -> Dict[str, dict]:
+        return {stage: summarize_timings(durations, self.items[stage]) for stage, durations in self.durations.items()}
+
+
+def create_benchmark_engine(encoder: str, image_dir: str, index_dir: str, thumbnail_dir: str,
+                            decode_workers: int, batch_size: int, seed: int,
+                            embedding_store: Optional[str] = None, model_workers: int = 0) -> ImageSearchEngine:
+    """Crea un motor aislado en el directorio de trabajo, con CLIP o con el codificador aleatorio."""
+    engine = ImageSearchEngine({
+        "image_dir": image_dir,
+        "decode_workers": decode_workers,
+        "model_workers": model_workers,
+        "checkpoint_interval": 0,
+        "precision": "fp32",
+        "query_cache_persist": False,
+        "embedding_store": embedding_store,
+    }, index_dir=index_dir)
+    engine.thumbnail_store = ThumbnailStore(thumbnail_dir)
+    engine.batch_size = batch_size
+    if encoder == "clip":
+        engine.load_model()
+        engine.feature_dim = engine.model.visual.output_dim
+    else:
+        import torch
+        engine.device = torch.device("cpu")
+        engine.model = create_random_encoder(engine.feature_dim, seed)
+        engine.model_loader = partial(load_random_worker_model, engine.feature_dim, seed)
+        engine.preprocess = random_preprocess
+        engine.fast_preprocess = FastPreprocess(CLIP_INPUT_SIZE, CLIP_MEAN, CLIP_STD)
+        engine.tokenize = random_tokenize
+        engine.precision = "fp32"
+        engine.query_cache = engine.create_query_cache()
+        engine.embedding_store = engine.create_embedding_store()
+    return engine
+
+
+def make_queries(num_queries: int, seed: int) -> List[str]:
+    rng = np.random.default_rng(seed)
+    return [" ".join(rng.choice(QUERY_WORDS, size=int(rng.integers(2, 6)))) + f" {i}" for i in range(num_queries)]
+
+
+def measure_model_worker_scaling(encoder: str, image_dir: str, work_dir: str, decode_workers: int, batch_size: int,
+                                 seed: int, num_images: int, model_workers: Sequence[int], timer: StageTimer
+                                 ) -> List[dict]:
+    """Indexa el corpus completo con cada número de procesos de inferencia y compara su rendimiento.
+
+    Cada ejecución parte de un índice vacío, sin almacén de vectores ni miniaturas, y se registra
+    como la etapa `index_images_workers_<N>` (0 es la inferencia en el proceso principal). El
+    arranque de los procesos (carga de los modelos) se mide aparte y no cuenta en imágenes/s.
+    """
+    rows = []
+    for num_workers in model_workers:
+        index_dir = os.path.join(work_dir, f"index_workers_{num_workers}")
+        shutil.rmtree(index_dir, ignore_errors=True)
+        engine = create_benchmark_engine(encoder, image_dir, index_dir, os.path.join(work_dir, "thumbnails"),
+                                         decode_workers, batch_size, seed, model_workers=num_workers)
+        engine.config["thumbnails_during_indexing"] = False
+        start = time.perf_counter()
+        engine.model_worker_pool()
+        startup = time.perf_counter() - start
+        with timer.measure(f"index_images_workers_{num_workers}", num_images):
+            start = time.perf_counter()
+            engine.index_images()
+            seconds = time.perf_counter() - start
+        shutil.rmtree(index_dir, ignore_errors=True)
+        rows.append({"model_workers": num_workers, "images_per_s": num_images / seconds, "startup_s": startup})
+    baseline = rows[0]["images_per_s"] if rows else 0
+    for row in rows:
+        row["speedup"] = row["images_per_s"] / baseline if baseline else None
+        row["efficiency"] = row["speedup"] / max(row["model_workers"], 1) if baseline else None
+    return rows
+
+
+def run_benchmark(num_images: int = 512, resolution: Tuple[int, int] = (640, 480), batch_size: int = 32,
+                  num_queries: int = 100, k: int = 10, encoder: str = "random", decode_workers: int = 0,
+                  repeats: int = 5, work_dir: Optional[str] = None, seed: int = 0,
+                  model_workers: Sequence[int] = ()) -> dict:
+    """Ejecuta todas las etapas sobre un corpus sintético y devuelve el informe.
+
+    Las etapas de decodificación, codificación e index.add se miden lote a lote y por separado;
+    `index_images` mide la indexación completa tal como la ejecuta la aplicación y
+    `reindex_from_store`, la reconstrucción del índice con todos los vectores ya en el almacén.
+    Con `model_workers` (p. ej. 0, 2, 4) se añade el escalado de la indexación con procesos de inferencia.
+    """
+    import faiss
+    import torch
+
+    owns_work_dir = work_dir is None
+    work_dir = work_dir or tempfile.mkdtemp(prefix="image_search_benchmark_")
+    image_dir = os.path.join(work_dir, "images")
+    index_dir = os.path.join(work_dir, "index")
+    thumbnail_dir = os.path.join(work_dir, "thumbnails")
+    store_dir = os.path.join(work_dir, "embeddings")
+    for directory in (index_dir, thumbnail_dir, store_dir):
+        shutil.rmtree(directory, ignore_errors=True)
+    store_file = os.path.join(store_dir, "embeddings.sqlite")
+    timer = StageTimer()
+
+    try:
+        existing = [name for _, _, names in os.walk(image_dir) for name in names if name.lower().endswith(IMAGE_EXTENSIONS)]
+        if len(existing) != num_images:
+            shutil.rmtree(image_dir, ignore_errors=True)
+            logging.info(f"Generando {num_images} imágenes sintéticas de {resolution[0]}x{resolution[1]}...")
+            with timer.measure("generate_corpus", num_images):
+                generate_corpus(image_dir, num_images, resolution, seed=seed)
+
+        engine = create_benchmark_engine(encoder, image_dir, index_dir, thumbnail_dir, decode_workers,
+                                         batch_size, seed, store_file)
+
+        for _ in range(repeats):
+            with timer.measure("scan", num_images):
+                for shard in engine.plan_shards():
+                    shard.scan_image_dir()
+
+        image_paths = sorted(os.path.join(root, name) for root, _, names in os.walk(image_dir)
+                             for name in names if name.lower().endswith(IMAGE_EXTENSIONS))
+        index = faiss.IndexIDMap2(faiss.IndexFlatIP(engine.feature_dim))
+        for start in range(0, len(image_paths), batch_size):
+            batch_paths = image_paths[start:start + batch_size]
+            if engine.fast_preprocess is not None:
+                with timer.measure("preprocess_reference", len(batch_paths)):
+                    load_and_preprocess_batch(batch_paths, engine.preprocess)
+            with timer.measure("decode_preprocess", len(batch_paths)):
+                valid_paths, batch_images = load_and_preprocess_batch(batch_paths, engine.image_preprocess())
+            if batch_images is None:
+                continue
+            with timer.measure("encode_image", len(valid_paths)):
+                features = engine.encode_image_batch(batch_images)
+            vectors = engine.normalize_vectors(features.astype(np.float32))
+            ids = np.arange(start, start + len(valid_paths), dtype=np.int64)
+            with timer.measure("index_add", len(valid_paths)):
+                index.add_with_ids(vectors, ids)
+        del index
+
+        with timer.measure("index_images", num_images):
+            engine.index_images()
+        with timer.measure("reindex_from_store", num_images):
+            engine.index_images()
+        scaling = measure_model_worker_scaling(encoder, image_dir, work_dir, decode_workers, batch_size, seed,
+                                               num_images, model_workers, timer)
+
+        for _ in range(repeats):
+            with timer.measure("save_index"):
+                for shard in engine.shards:
+                    shard.save_index()
+                engine.save_collection()
+
+        for _ in range(repeats):
+            with timer.measure("is_index_valid"):
+                engine.is_index_valid()
+
+        for _ in range(repeats):
+            loaded = create_benchmark_engine(encoder, image_dir, index_dir, thumbnail_dir, decode_workers,
+                                             batch_size, seed)
+            with timer.measure("load_index"):
+                stored_data = loaded.read_stored_index()
+                loaded.apply_stored_index(stored_data)
+            del loaded
+
+        queries = make_queries(num_queries, seed)
+        query_cache = engine.query_cache
+        engine.query_cache = QueryEmbeddingCache(query_cache.namespace, 0)
+        for query in queries:
+            with timer.measure("text_query_uncached"):
+                engine.search_by_text(query, k)
+        engine.query_cache = query_cache
+        for query in queries:
+            engine.search_by_text(query, k)
+        for query in queries:
+            with timer.measure("text_query_cached"):
+                engine.search_by_text(query, k)
+        # Filtro que deja pasar la mitad de las imágenes de cada carpeta: debe costar casi lo mismo que sin filtro.
+        median_size = np.median(np.concatenate([shard.attributes.column("size") for shard in engine.shards]))
+        image_filter = parse_filter(f"size>={int(median_size)}")
+        for query in queries:
+            with timer.measure("text_query_filtered"):
+                engine.search_by_text(query, k, image_filter)
+        engine.query_cache = QueryEmbeddingCache(query_cache.namespace, 0)
+        with timer.measure("text_query_batch", len(queries)):
+            engine.search_texts(queries, k)
+        engine.query_cache = query_cache
+
+        html_queries = queries[:max(1, min(len(queries), 20))]
+        results = [engine.search_by_text(query, k) for query in html_queries]
+        shutil.rmtree(thumbnail_dir, ignore_errors=True)
+        for query, matches in zip(html_queries, results):
+            with timer.measure("generate_html_cold", len(matches)):
+                render_results_html(matches, engine.thumbnail_store, "text", query)
+        for query, matches in zip(html_queries, results):
+            with timer.measure("generate_html_warm", len(matches)):
+                render_results_html(matches, engine.thumbnail_store, "text", query)
+
+        indexed = engine.count_indexed_images()
+        engine_metrics = engine.metrics_snapshot()
+        engine.embedding_store.close()
+    finally:
+        if owns_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "version": BENCHMARK_FORMAT_VERSION,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "torch": torch.__version__,
+            "torch_threads": torch.get_num_threads(),
+            "faiss": getattr(faiss, "__version__", None),
+        },
+        "parameters": {
+            "images": num_images,
+            "indexed_images": indexed,
+            "resolution": list(resolution),
+            "batch_size": batch_size,
+            "queries": num_queries,
+            "k": k,
+            "encoder": encoder,
+            "feature_dim": engine.feature_dim,
+            "decode_workers": decode_workers,
+            "model_workers": list(model_workers),
+            "repeats": repeats,
+            "seed": seed,
+        },
+        "stages": timer.report(),
+        "model_worker_scaling": scaling,
+        "engine_metrics": engine_metrics,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def compare_reports(current: dict, previous: dict) -> List[Tuple[str, Optional[float], Optional[float], Optional[float]]]:
+    """Compara el rendimiento de cada etapa con un informe anterior: (etapa, anterior, actual, cociente)."""
+    rows = []
+    for stage, summary in current["stages"].items():
+        before = previous.get("stages", {}).get(stage, {}).get("throughput_per_s")
+        after = summary.get("throughput_per_s")
+        rows.append((stage, before, after, after / before if before and after else None))
+    return rows
+
+
+def benchmark_precisions(image_paths: List[str], precisions: Iterable[str] = ("fp32", "bf16", "int8"),
+                         batch_size: int = 32, k: int = 10, num_queries: int = 50) -> List[dict]:
+    """Mide imágenes/s de encode_image en cada precisión y el solapamiento del top-k con fp32.
+
+    Cada imagen de las primeras `num_queries` se usa como consulta sobre el resto del conjunto,
+    en el espacio de vectores de cada precisión.
+    """
+    import torch
+
+    device = select_device()
+    precisions = ["fp32"] + [p for p in precisions if p != "fp32"]
+    batches = [image_paths[i:i + batch_size] for i in range(0, len(image_paths), batch_size)]
+    reference = None
+    report = []
+    for precision in precisions:
+        model, preprocess, device, effective = load_clip_model(precision, device)
+        features = []
+        encode_seconds = 0.0
+        for batch_paths in batches:
+            _, batch_images = load_and_preprocess_batch(batch_paths, preprocess)
+            if batch_images is None:
+                continue
+            start = time.perf_counter()
+            with torch.no_grad():
+                features.append(model.encode_image(batch_images.to(device)).float().cpu().numpy())
+            encode_seconds += time.perf_counter() - start
+        del model
+
+        vectors = np.concatenate(features).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-8
+        queries = min(num_queries, len(vectors))
+        scores = vectors[:queries] @ vectors.T
+        scores[np.arange(queries), np.arange(queries)] = -np.inf
+        top_k = np.argsort(-scores, axis=1)[:, :k]
+        if reference is None:
+            reference = (vectors, top_k)
+
+        overlap = np.mean([len(set(top_k[i]) & set(reference[1][i])) / k for i in range(queries)])
+        report.append({
+            "precision": effective,
+            "images": len(vectors),
+            "images_per_s": len(vectors) / encode_seconds if encode_seconds else 0.0,
+            "top_k_overlap": float(overlap),
+            "cosine_to_fp32": float(np.mean(np.sum(vectors * reference[0], axis=1))),
+        })
+    return report
+
+
+def benchmark_preprocessing(image_paths: List[str], batch_size: int = 32, precision: str = "fp32") -> dict:
+    """Compara la transformación de CLIP con FastPreprocess: imágenes/s al preparar los lotes y coseno entre vectores.
+
+    Ambas transformaciones procesan las mismas imágenes y sus lotes se codifican con el mismo modelo;
+    la similitud coseno por imagen mide cuánto se aparta el camino rápido del de referencia.
+    """
+    import torch
+
+    model, preprocess, device, effective = load_clip_model(precision)
+    fast = FastPreprocess.from_transform(preprocess)
+    if fast is None:
+        raise ValueError("La transformación del modelo no admite el preprocesamiento rápido.")
+    batches = [image_paths[i:i + batch_size] for i in range(0, len(image_paths), batch_size)]
+    seconds = {"reference": 0.0, "fast": 0.0}
+    features = {"reference": {}, "fast": {}}
+    for batch_paths in batches:
+        for name, transform in (("reference", preprocess), ("fast", fast)):
+            start = time.perf_counter()
+            valid_paths, batch_images = load_and_preprocess_batch(batch_paths, transform)
+            seconds[name] += time.perf_counter() - start
+            if batch_images is None:
+                continue
+            with torch.no_grad():
+                encoded = model.encode_image(batch_images.to(device)).float().cpu().numpy()
+            features[name].update(zip(valid_paths, encoded))
+    del model
+
+    common = [path for path in features["reference"] if path in features["fast"]]
+    if not common:
+        raise ValueError("No se pudo procesar ninguna imagen.")
+    reference = np.stack([features["reference"][path] for path in common])
+    candidate = np.stack([features["fast"][path] for path in common])
+    reference /= np.linalg.norm(reference, axis=1, keepdims=True) + 1e-8
+    candidate /= np.linalg.norm(candidate, axis=1, keepdims=True) + 1e-8
+    cosine = np.sum(reference * candidate, axis=1)
+    worst = int(np.argmin(cosine))
+    return {
+        "precision": effective,
+        "images": len(common),
+        "reference_images_per_s": len(image_paths) / seconds["reference"] if seconds["reference"] else 0.0,
+        "fast_images_per_s": len(image_paths) / seconds["fast"] if seconds["fast"] else 0.0,
+        "mean_cosine": float(np.mean(cosine)),
+        "min_cosine": float(cosine[worst]),
+        "min_cosine_image": common[worst],
+    }
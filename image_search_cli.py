@@ -0,0 +1,496 @@
+"""Línea de comandos de la búsqueda semántica de imágenes: indexación, consultas por lotes y evaluaciones."""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import logging
+import os
+import signal
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from image_search_engine import (
+    INDEX_DIR, QUERY_CHUNK_SIZE, ImageSearchEngine, IndexingError, evaluate_index_types, read_config_file,
+)
+from image_search_collections import CollectionManager
+from image_search_filters import parse_filter
+from image_search_metrics import PROFILERS, ProgressRate, format_duration, profile_output_path, profile_run
+
+IMAGE_QUERY_PREFIX = "image:"
+
+
+def read_queries(file_path: str) -> List[Tuple[str, str]]:
+    """Lee un archivo de consultas, una por línea, y devuelve pares (tipo, consulta).
+
+    Las líneas que empiezan por `image:` son rutas de imágenes de consulta; el resto, textos.
+    Se ignoran las líneas vacías y las que empiezan por `#`.
+    """
+    queries = []
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith(IMAGE_QUERY_PREFIX):
+                queries.append(("image", line[len(IMAGE_QUERY_PREFIX):].strip()))
+            else:
+                queries.append(("text", line))
+    return queries
+
+
+def write_results(file_path: str, results: List[dict]):
+    """Guarda los resultados en JSON o, si la extensión es .csv, una fila por resultado."""
+    if file_path.lower().endswith(".csv"):
+        with open(file_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["query", "type", "rank", "path", "score"])
+            for result in results:
+                for item in result["results"]:
+                    writer.writerow([result["query"], result["type"], item["rank"], item["path"],
+                                     f"{item['score']:.6f}"])
+    else:
+        with open(file_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+def create_engine(args, image_dirs: Optional[List[str]] = None) -> ImageSearchEngine:
+    """Crea el motor; con `--collection` usa el índice de esa colección (y la crea o actualiza con `image_dirs`)."""
+    engine = ImageSearchEngine(read_config_file(), index_dir=args.index_dir)
+    # Se guarda para volcar sus métricas al terminar o al recibir SIGUSR1 (--metrics).
+    args.engine = engine
+    if args.collection:
+        collections = CollectionManager(engine)
+        if image_dirs:
+            collections.add(args.collection, os.pathsep.join(image_dirs))
+        elif args.collection not in collections.collections:
+            raise SystemExit(f"No existe la colección '{args.collection}'. Créela con 'index --collection'.")
+        collection = collections.collections[args.collection]
+        engine.index_dir = collection["index_dir"]
+        engine.image_dir = collection["image_dir"]
+    return engine
+
+
+def log_progress(rate_meter: ProgressRate, done: int, total: int):
+    rate, remaining = rate_meter.update(done, total)
+    if rate is None or done >= total:
+        logging.info(f"Procesadas {done}/{total} imágenes")
+    else:
+        logging.info(f"Procesadas {done}/{total} imágenes ({rate:.1f} img/s, quedan {format_duration(remaining)})")
+
+
+def dump_metrics(args):
+    engine = getattr(args, "engine", None)
+    if args.metrics and engine is not None:
+        engine.dump_metrics(args.metrics)
+
+
+def start_watcher(engine: ImageSearchEngine):
+    from image_search_watcher import DirectoryWatcher
+
+    return DirectoryWatcher(engine, on_update=lambda refreshed: logging.info(
+        f"Índice actualizado: {engine.count_indexed_images()} imágenes en {len(engine.shards)} fragmentos")).start()
+
+
+def run_index(args):
+    """Indexa uno o varios directorios: carga, actualiza o reconstruye (`--full`) sus fragmentos.
+
+    Con `--watch` sigue vigilando los directorios y aplica los cambios hasta que se pulse Ctrl+C.
+    """
+    image_dirs = [os.path.abspath(image_dir) for image_dir in args.image_dirs]
+    for image_dir in image_dirs:
+        if not os.path.isdir(image_dir):
+            raise SystemExit(f"El directorio de imágenes no existe: {image_dir}")
+    engine = create_engine(args, image_dirs)
+    engine.image_dir = os.pathsep.join(image_dirs)
+    if args.no_recursive:
+        engine.config["recursive"] = False
+    if args.model_workers is not None:
+        engine.config["model_workers"] = args.model_workers
+    engine.load_model()
+    rate_meter = ProgressRate()
+    engine.progress_callback = lambda done, total: log_progress(rate_meter, done, total)
+    try:
+        if args.full:
+            engine.index_images()
+        else:
+            engine.refresh_index()
+    except IndexingError as e:
+        raise SystemExit(str(e))
+    print(f"Índice listo: {engine.count_indexed_images()} imágenes en {len(engine.shards)} fragmentos")
+    if args.watch:
+        watcher = start_watcher(engine)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.stop()
+
+
+def run_search(args):
+    """Ejecuta todas las consultas de un archivo sobre el índice almacenado y guarda los resultados.
+
+    Con `--collections` (o `--all-collections`) cada consulta se busca en varias colecciones y se
+    mezclan sus top-k. Con `--filter` solo se devuelven las imágenes que cumplen el filtro.
+    """
+    try:
+        image_filter = parse_filter(args.filter)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    engine = create_engine(args)
+    engine.load_model()
+    queries = read_queries(args.queries)
+    texts = [query for query_type, query in queries if query_type == "text"]
+    images = [query for query_type, query in queries if query_type == "image"]
+
+    if args.collections or args.all_collections:
+        collections = CollectionManager(engine)
+        names = collections.names() if args.all_collections else args.collections
+        unknown = [name for name in names if name not in collections.collections]
+        if unknown or not names:
+            raise SystemExit(f"Colecciones desconocidas: {', '.join(unknown)}" if unknown else "No hay colecciones.")
+        start = time.perf_counter()
+        text_matches = iter([matches for i in range(0, len(texts), args.chunk_size)
+                             for matches in collections.search_texts(names, texts[i:i + args.chunk_size], args.k,
+                                                                     image_filter)])
+        image_matches = iter([matches for i in range(0, len(images), args.chunk_size)
+                              for matches in collections.search_images(names, images[i:i + args.chunk_size], args.k,
+                                                                       image_filter)])
+    else:
+        if not engine.load_stored_index():
+            raise SystemExit("No hay un índice utilizable. Indexe primero el directorio con el comando 'index'.")
+        start = time.perf_counter()
+        text_matches = iter(engine.search_texts(texts, args.k, args.chunk_size, image_filter))
+        image_matches = iter(engine.search_images(images, args.k, args.chunk_size, image_filter))
+    elapsed = time.perf_counter() - start
+    logging.info(f"{len(queries)} consultas en {elapsed:.2f}s ({len(queries) / max(elapsed, 1e-9):.1f} consultas/s)")
+
+    results = []
+    for query_type, query in queries:
+        matches = next(image_matches) if query_type == "image" else next(text_matches)
+        results.append({
+            "query": query,
+            "type": query_type,
+            "results": [{"rank": rank, "path": path, "score": score}
+                        for rank, (path, score) in enumerate(matches, start=1)],
+        })
+    write_results(args.output, results)
+    engine.save_query_cache()
+    print(f"{len(results)} consultas guardadas en {args.output}")
+
+
+def run_server(args):
+    """Carga el modelo y el índice almacenado una sola vez y atiende búsquedas por HTTP."""
+    from image_search_server import SearchServer
+
+    engine = create_engine(args)
+    engine.load_model()
+    if not engine.load_stored_index():
+        raise SystemExit("No hay un índice utilizable. Indexe primero el directorio con el comando 'index'.")
+    server = SearchServer(engine, args.host, args.port)
+    host, port = server.server_address[:2]
+    watcher = start_watcher(engine) if args.watch or engine.config.get("watch") else None
+    print(f"Sirviendo {engine.count_indexed_images()} imágenes en http://{host}:{port}/search")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if watcher is not None:
+            watcher.stop()
+        server.server_close()
+        engine.save_query_cache()
+
+
+def run_collections(args):
+    """Lista las colecciones o quita una del registro (y, con `--delete-index`, su índice)."""
+    collections = CollectionManager(create_engine(args))
+    if args.action == "remove":
+        if not args.name:
+            raise SystemExit("Indique la colección que se elimina.")
+        if args.name not in collections.collections:
+            raise SystemExit(f"No existe la colección '{args.name}'.")
+        collections.remove(args.name, delete_files=args.delete_index)
+        print(f"Colección '{args.name}' eliminada")
+        return
+    if not collections.collections:
+        print("No hay colecciones. Créelas con 'index --collection NOMBRE DIRECTORIOS...'.")
+    for name in collections.names():
+        collection = collections.collections[name]
+        print(f"{name}\t{collection['index_dir']}\t{collection['image_dir'].replace(os.pathsep, ', ')}")
+
+
+def run_duplicates(args):
+    """Busca grupos de imágenes casi duplicadas en el índice almacenado y guarda el informe."""
+    engine = create_engine(args)
+    if not engine.load_stored_index():
+        raise SystemExit("No hay un índice utilizable. Indexe primero el directorio con el comando 'index'.")
+
+    start = time.perf_counter()
+    clusters = engine.find_near_duplicates(args.threshold, args.k, args.block_size)
+    elapsed = time.perf_counter() - start
+    duplicates = sum(cluster["size"] for cluster in clusters)
+    print(f"{len(clusters)} grupos con {duplicates} imágenes de {engine.count_indexed_images()} "
+          f"(umbral {args.threshold}, {elapsed:.1f}s)")
+
+    if args.output.lower().endswith(".csv"):
+        with open(args.output, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["cluster", "size", "min_similarity", "max_similarity", "path"])
+            for number, cluster in enumerate(clusters, start=1):
+                for path in cluster["images"]:
+                    writer.writerow([number, cluster["size"], f"{cluster['min_similarity']:.6f}",
+                                     f"{cluster['max_similarity']:.6f}", path])
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(clusters, f, indent=2, ensure_ascii=False)
+    print(f"Informe guardado en {args.output}")
+
+
+def run_index_evaluation(args):
+    """Evalúa los tipos de índice con los vectores del índice almacenado e imprime el informe."""
+    engine = create_engine(args)
+    if not engine.load_stored_index():
+        raise SystemExit("No hay un índice almacenado con el formato actual. Vuelva a indexar el directorio.")
+
+    vectors = []
+    for shard in engine.shards:
+        live_ids = np.array([i for i, path in enumerate(shard.image_paths) if path is not None], dtype=np.int64)
+        vectors.append(np.asarray(shard.vector_store.array()[live_ids], dtype=np.float32))
+    vectors = np.concatenate(vectors)
+    print(f"Evaluando {len(vectors)} vectores, {min(args.queries, len(vectors) // 10)} consultas, k={args.k}")
+
+    report = evaluate_index_types(vectors, k=args.k, num_queries=args.queries)
+    print(f"{'índice':<10} {'parámetros':<34} {'recall@k':>9} {'p50 ms':>9} {'p99 ms':>9} {'build s':>9} "
+          f"{'bytes/vec':>10}")
+    for row in report:
+        params = ", ".join(f"{key}={value}" for key, value in row["params"].items())
+        print(f"{row['index_type']:<10} {params:<34} {row['recall_at_k']:>9.4f} {row['p50_ms']:>9.3f} "
+              f"{row['p99_ms']:>9.3f} {row['build_s']:>9.2f} {row['bytes_per_vector']:>10.1f}")
+
+
+def benchmark_image_paths(args) -> Tuple[str, List[str]]:
+    """Directorios de imágenes de un benchmark (los indicados o los configurados) y sus primeras `args.images`.
+
+    `image_dir` admite varios directorios separados por os.pathsep; se recorren como al indexar,
+    con sus subcarpetas salvo que `recursive` esté desactivado.
+    """
+    engine = ImageSearchEngine(read_config_file())
+    if args.image_dir:
+        engine.image_dir = args.image_dir
+    roots = engine.root_dirs()
+    if not roots:
+        raise SystemExit("No hay un directorio de imágenes configurado. Indíquelo con --image-dir.")
+    for root in roots:
+        if not os.path.isdir(root):
+            raise SystemExit(f"El directorio de imágenes no existe: {root}")
+    image_paths = sorted(path for shard in engine.plan_shards() for path in shard.scan_image_dir())[:args.images]
+    return engine.image_dir, image_paths
+
+
+def run_precision_benchmark(args):
+    """Ejecuta benchmark_precisions con imágenes del directorio indicado o del configurado e imprime el informe."""
+    from image_search_benchmark import benchmark_precisions
+    image_dir, image_paths = benchmark_image_paths(args)
+    print(f"Midiendo {len(image_paths)} imágenes de {image_dir}, k={args.k}")
+
+    report = benchmark_precisions(image_paths, k=args.k)
+    print(f"{'precisión':<10} {'imágenes/s':>11} {'top-k vs fp32':>14} {'coseno vs fp32':>15}")
+    for row in report:
+        print(f"{row['precision']:<10} {row['images_per_s']:>11.2f} {row['top_k_overlap']:>14.4f} "
+              f"{row['cosine_to_fp32']:>15.4f}")
+
+
+def run_preprocess_benchmark(args):
+    """Compara el preprocesamiento de CLIP con el rápido sobre imágenes reales e imprime el informe."""
+    from image_search_benchmark import benchmark_preprocessing
+    image_dir, image_paths = benchmark_image_paths(args)
+    if not image_paths:
+        raise SystemExit(f"No hay imágenes en {image_dir}.")
+    print(f"Midiendo {len(image_paths)} imágenes de {image_dir}")
+    try:
+        report = benchmark_preprocessing(image_paths, batch_size=args.batch_size)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    speedup = report["fast_images_per_s"] / report["reference_images_per_s"] if report["reference_images_per_s"] else 0
+    print(f"Imágenes/s (CLIP):   {report['reference_images_per_s']:.2f}")
+    print(f"Imágenes/s (rápido): {report['fast_images_per_s']:.2f} ({speedup:.2f}x)")
+    print(f"Coseno medio: {report['mean_cosine']:.5f}")
+    print(f"Coseno mínimo: {report['min_cosine']:.5f} ({report['min_cosine_image']})")
+
+
+def parse_resolution(value: str) -> Tuple[int, int]:
+    try:
+        width, height = (int(part) for part in value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Resolución inválida: {value}. Use ANCHOxALTO, por ejemplo 640x480.")
+    return width, height
+
+
+def parse_worker_counts(value: str) -> List[int]:
+    try:
+        counts = [int(part) for part in value.split(",") if part.strip()]
+    except ValueError:
+        counts = [-1]
+    if any(count < 0 for count in counts):
+        raise argparse.ArgumentTypeError(f"Lista de procesos inválida: {value}. Use números separados por comas, p. ej. 0,2,4.")
+    return counts
+
+
+def run_benchmark_suite(args):
+    """Ejecuta el benchmark sobre un corpus sintético, guarda el informe JSON y lo compara con otro anterior."""
+    from image_search_benchmark import compare_reports, run_benchmark
+
+    report = run_benchmark(args.images, args.resolution, args.batch_size, args.queries, args.k, args.encoder,
+                           args.decode_workers, args.repeats, args.work_dir, args.seed, args.model_workers)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'etapa':<22} {'elementos/s':>12} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for stage, summary in report["stages"].items():
+        print(f"{stage:<22} {summary['throughput_per_s'] or 0:>12.2f} {summary['p50_ms']:>9.3f} "
+              f"{summary['p95_ms']:>9.3f} {summary['p99_ms']:>9.3f}")
+    if report["model_worker_scaling"]:
+        print(f"\n{'procesos':<10} {'imágenes/s':>11} {'aceleración':>12} {'eficiencia':>11} {'arranque s':>11}")
+        for row in report["model_worker_scaling"]:
+            print(f"{row['model_workers']:<10} {row['images_per_s']:>11.2f} {row['speedup'] or 0:>12.2f} "
+                  f"{row['efficiency'] or 0:>11.2f} {row['startup_s']:>11.2f}")
+    print(f"Memoria máxima: {report['peak_rss_mb'] or 0:.1f} MB. Informe guardado en {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        print(f"\nComparación con {args.compare}:")
+        print(f"{'etapa':<22} {'anterior':>12} {'actual':>12} {'cociente':>9}")
+        for stage, before, after, ratio in compare_reports(report, previous):
+            print(f"{stage:<22} {before or 0:>12.2f} {after or 0:>12.2f} "
+                  f"{'-' if ratio is None else f'{ratio:.3f}':>9}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Búsqueda Semántica de Imágenes (línea de comandos)")
+    parser.add_argument("--index-dir", default=INDEX_DIR, help="Directorio donde se guarda el índice.")
+    parser.add_argument("--collection", help="Colección con nombre cuyo índice se usa (en lugar de --index-dir).")
+    parser.add_argument("--metrics", help="Guarda las métricas por etapa en este JSON al terminar "
+                                          "(y al recibir SIGUSR1, donde exista).")
+    parser.add_argument("--profile", choices=PROFILERS, help="Perfila la ejecución con cProfile o con el perfilador de torch.")
+    parser.add_argument("--profile-output", help="Archivo del perfil (por defecto, en profile_dir con marca de tiempo).")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    index_parser = subparsers.add_parser("index", help="Indexa (o actualiza el índice de) directorios de imágenes.")
+    index_parser.add_argument("image_dirs", nargs="+", help="Directorios raíz de imágenes; se incluyen sus subcarpetas.")
+    index_parser.add_argument("--no-recursive", action="store_true",
+                              help="Indexa solo las imágenes sueltas de cada directorio, sin subcarpetas.")
+    index_parser.add_argument("--full", action="store_true", help="Reindexa todas las imágenes desde cero.")
+    index_parser.add_argument("--watch", action="store_true",
+                              help="Tras indexar, vigila los directorios y actualiza el índice con cada cambio.")
+    index_parser.add_argument("--model-workers", type=int,
+                              help="Procesos de inferencia en CPU, cada uno con su copia del modelo (0 = ninguno).")
+    index_parser.set_defaults(func=run_index)
+
+    search_parser = subparsers.add_parser("search", help="Ejecuta un archivo de consultas sobre el índice almacenado.")
+    search_parser.add_argument("--queries", required=True,
+                               help="Archivo con una consulta por línea; 'image:<ruta>' para buscar por imagen.")
+    search_parser.add_argument("--k", type=int, default=5, help="Resultados por consulta.")
+    search_parser.add_argument("--output", required=True, help="Archivo de resultados (.json o .csv).")
+    search_parser.add_argument("--chunk-size", type=int, default=QUERY_CHUNK_SIZE,
+                               help="Consultas que se codifican y buscan juntas.")
+    search_parser.add_argument("--collections", nargs="+", metavar="NOMBRE",
+                               help="Busca en estas colecciones y mezcla sus resultados.")
+    search_parser.add_argument("--all-collections", action="store_true", help="Busca en todas las colecciones.")
+    search_parser.add_argument("--filter", metavar="EXPRESIÓN",
+                               help="Solo imágenes que cumplen todas las condiciones, p. ej. "
+                                    "'folder:vacaciones date>=2023-06 width>=1024 pixels>=2M size<5MB'.")
+    search_parser.set_defaults(func=run_search)
+
+    collections_parser = subparsers.add_parser("collections", help="Lista o elimina colecciones con nombre.")
+    collections_parser.add_argument("action", choices=("list", "remove"), nargs="?", default="list")
+    collections_parser.add_argument("name", nargs="?", help="Colección que se elimina.")
+    collections_parser.add_argument("--delete-index", action="store_true",
+                                    help="Borra también los archivos del índice de la colección.")
+    collections_parser.set_defaults(func=run_collections)
+
+    serve_parser = subparsers.add_parser(
+        "serve", help="Servidor HTTP local que agrupa las consultas concurrentes en lotes.")
+    serve_parser.add_argument("--host", help="Dirección de escucha (por defecto, server_host de la configuración).")
+    serve_parser.add_argument("--port", type=int, help="Puerto (por defecto, server_port de la configuración).")
+    serve_parser.add_argument("--watch", action="store_true",
+                              help="Vigila los directorios indexados y actualiza el índice sin detener el servidor.")
+    serve_parser.set_defaults(func=run_server)
+
+    duplicates_parser = subparsers.add_parser(
+        "duplicates", help="Agrupa las imágenes duplicadas o casi duplicadas del índice almacenado.")
+    duplicates_parser.add_argument("--threshold", type=float, default=0.95,
+                                   help="Similitud coseno mínima para considerar dos imágenes duplicadas.")
+    duplicates_parser.add_argument("--k", type=int, default=10, help="Vecinos que se examinan por imagen.")
+    duplicates_parser.add_argument("--block-size", type=int, default=4096,
+                                   help="Imágenes que se consultan a la vez (limita la memoria).")
+    duplicates_parser.add_argument("--output", default="duplicates.json", help="Informe (.json o .csv).")
+    duplicates_parser.set_defaults(func=run_duplicates)
+
+    evaluate_parser = subparsers.add_parser(
+        "evaluate-index", help="Compara recall@k y latencia (p50/p99) de los tipos de índice con el índice almacenado.")
+    evaluate_parser.add_argument("--k", type=int, default=10, help="Número de resultados para recall@k.")
+    evaluate_parser.add_argument("--queries", type=int, default=1000, help="Número de consultas de la evaluación.")
+    evaluate_parser.set_defaults(func=run_index_evaluation)
+
+    benchmark_parser = subparsers.add_parser(
+        "benchmark-precision", help="Compara imágenes/s y el solapamiento del top-k de fp32, bf16 e int8.")
+    benchmark_parser.add_argument("--image-dir",
+                                  help="Directorios de imágenes separados por os.pathsep (por defecto, los configurados).")
+    benchmark_parser.add_argument("--images", type=int, default=256, help="Número de imágenes del benchmark.")
+    benchmark_parser.add_argument("--k", type=int, default=10, help="Número de resultados para el solapamiento.")
+    benchmark_parser.set_defaults(func=run_precision_benchmark)
+
+    preprocess_parser = subparsers.add_parser(
+        "benchmark-preprocess", help="Compara la velocidad y los vectores del preprocesamiento rápido con el de CLIP.")
+    preprocess_parser.add_argument("--image-dir",
+                                   help="Directorios de imágenes separados por os.pathsep (por defecto, los configurados).")
+    preprocess_parser.add_argument("--images", type=int, default=256, help="Número de imágenes del benchmark.")
+    preprocess_parser.add_argument("--batch-size", type=int, default=32, help="Imágenes por lote.")
+    preprocess_parser.set_defaults(func=run_preprocess_benchmark)
+
+    suite_parser = subparsers.add_parser(
+        "benchmark", help="Mide cada etapa de la indexación y las consultas sobre un corpus sintético.")
+    suite_parser.add_argument("--images", type=int, default=512, help="Número de imágenes sintéticas.")
+    suite_parser.add_argument("--resolution", type=parse_resolution, default=(640, 480),
+                              help="Resolución de las imágenes, ANCHOxALTO.")
+    suite_parser.add_argument("--batch-size", type=int, default=32, help="Imágenes por lote.")
+    suite_parser.add_argument("--queries", type=int, default=100, help="Consultas de texto que se miden.")
+    suite_parser.add_argument("--k", type=int, default=10, help="Resultados por consulta.")
+    suite_parser.add_argument("--encoder", choices=("random", "clip"), default="random",
+                              help="'random' usa un codificador aleatorio en CPU sin conexión; 'clip', el modelo real.")
+    suite_parser.add_argument("--decode-workers", type=int, default=0,
+                              help="Procesos de decodificación durante index_images.")
+    suite_parser.add_argument("--model-workers", type=parse_worker_counts, default=[],
+                              help="Números de procesos de inferencia cuyo escalado se mide, p. ej. 0,2,4.")
+    suite_parser.add_argument("--repeats", type=int, default=5,
+                              help="Repeticiones de las etapas rápidas (escaneo, validación, guardado y carga).")
+    suite_parser.add_argument("--work-dir", help="Directorio de trabajo; se reutiliza el corpus si ya existe.")
+    suite_parser.add_argument("--seed", type=int, default=0, help="Semilla del corpus, las consultas y el codificador.")
+    suite_parser.add_argument("--output", default="benchmark.json", help="Informe JSON.")
+    suite_parser.add_argument("--compare", help="Informe JSON anterior con el que comparar el rendimiento.")
+    suite_parser.set_defaults(func=run_benchmark_suite)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_args()
+    if args.metrics and hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: dump_metrics(args))
+    try:
+        if args.profile:
+            output_path = args.profile_output or profile_output_path(
+                read_config_file().get("profile_dir") or "profiles", args.command, args.profile)
+            with profile_run(output_path, args.profile):
+                args.func(args)
+        else:
+            args.func(args)
+    finally:
+        dump_metrics(args)
@@ -0,0 +1,238 @@
+"""Colecciones con nombre: cada una con su propio índice en disco y una caché LRU de índices cargados."""
+
+from __future__ import annotations
+
+import hashlib
+import heapq
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from image_search_engine import ImageSearchEngine, atomic_write
+from image_search_filters import ImageFilter
+
+COLLECTIONS_FILE = "collections.json"
+COLLECTIONS_DIR = "collections"
+
+
+def collection_dir_name(name: str) -> str:
+    """Nombre de directorio seguro para una colección; el hash evita colisiones entre nombres parecidos."""
+    slug = re.sub(r"[^\w.-]+", "_", name).strip("._")[:40] or "coleccion"
+    return f"{slug}-{hashlib.sha1(name.encode('utf-8')).hexdigest()[:8]}"
+
+
+def merge_top_k(result_lists: Iterable[List[Tuple[str, float]]], k: int) -> List[Tuple[str, float]]:
+    """Mezcla varias listas (ruta, puntuación) ordenadas de mayor a menor y devuelve las `k` mejores.
+
+    Una imagen presente en varias colecciones aparece una sola vez, con su mejor puntuación.
+    """
+    merged = []
+    seen = set()
+    for path, score in heapq.merge(*result_lists, key=lambda match: -match[1]):
+        if path in seen:
+            continue
+        seen.add(path)
+        merged.append((path, score))
+        if len(merged) == k:
+            break
+    return merged
+
+
+class CollectionManager:
+    """Registro de colecciones con nombre y caché LRU de sus índices cargados.
+
+    Cada colección guarda sus directorios de imágenes y su propio directorio de índice en
+    `collections.json`. Los motores de las colecciones comparten el modelo del motor base
+    (`share_model`), así que cargar una colección solo cuesta leer su índice. Se mantienen en
+    memoria como mucho `collection_cache_size` colecciones y, aproximadamente,
+    `collection_memory_mb` MB de índices; al superarlos se descarta la usada hace más tiempo,
+    salvo la colección activa.
+    """
+
+    def __init__(self, engine: ImageSearchEngine, file_path: str = COLLECTIONS_FILE,
+                 collections_dir: str = COLLECTIONS_DIR):
+        self.engine = engine
+        self.file_path = file_path
+        self.collections_dir = collections_dir
+        self.max_loaded = max(1, int(engine.config.get("collection_cache_size", 4)))
+        self.memory_budget = int(float(engine.config.get("collection_memory_mb", 2048)) * 1024 * 1024)
+        self.collections: Dict[str, dict] = {}
+        self.engines: Dict[str, ImageSearchEngine] = {}
+        self.loaded: OrderedDict = OrderedDict()
+        self.active: Optional[str] = None
+        self._lock = threading.RLock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.file_path, "r", encoding="utf-8") as f:
+                self.collections = json.load(f).get("collections", {})
+        except FileNotFoundError:
+            self.collections = {}
+        except (OSError, json.JSONDecodeError) as e:
+            logging.warning(f"No se pudo leer la lista de colecciones: {e}")
+            self.collections = {}
+
+    def save(self):
+        data = {"version": 1, "collections": self.collections}
+
+        def writer(tmp_path):
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+
+        atomic_write(self.file_path, writer)
+
+    def names(self) -> List[str]:
+        return sorted(self.collections, key=str.lower)
+
+    def name_for(self, image_dir: str) -> str:
+        """Colección cuyos directorios son `image_dir` o, si no hay ninguna, un nombre libre basado en la carpeta."""
+        for name, collection in self.collections.items():
+            if collection.get("image_dir") == image_dir:
+                return name
+        base = os.path.basename(os.path.normpath(image_dir.split(os.pathsep)[0])) or "Colección"
+        name, number = base, 2
+        while name in self.collections:
+            name, number = f"{base} ({number})", number + 1
+        return name
+
+    def add(self, name: str, image_dir: str, index_dir: Optional[str] = None) -> dict:
+        """Crea la colección `name` o cambia sus directorios de imágenes."""
+        name = name.strip()
+        if not name:
+            raise ValueError("El nombre de la colección no puede estar vacío.")
+        with self._lock:
+            collection = self.collections.get(name)
+            if collection is None:
+                collection = {"index_dir": index_dir or os.path.join(self.collections_dir, collection_dir_name(name))}
+                self.collections[name] = collection
+            collection["image_dir"] = image_dir
+            engine = self.engines.get(name)
+            if engine is not None:
+                engine.image_dir = image_dir
+            self.save()
+            return collection
+
+    def remove(self, name: str, delete_files: bool = False):
+        """Quita la colección del registro y, con `delete_files`, borra su índice del disco."""
+        with self._lock:
+            collection = self.collections.pop(name)
+            self.engines.pop(name, None)
+            self.loaded.pop(name, None)
+            if self.active == name:
+                self.active = None
+            self.save()
+        if delete_files:
+            shutil.rmtree(collection["index_dir"], ignore_errors=True)
+
+    def engine_for(self, name: str) -> ImageSearchEngine:
+        """Motor de la colección (cargado o no), creado la primera vez con el modelo del motor base."""
+        with self._lock:
+            engine = self.engines.get(name)
+            if engine is None:
+                collection = self.collections[name]
+                engine = ImageSearchEngine(self.engine.config, index_dir=collection["index_dir"])
+                engine.config = self.engine.config
+                engine.image_dir = collection.get("image_dir", "")
+                engine.progress_callback = lambda done, total: self.engine.progress_callback(done, total)
+                engine.status_callback = lambda text, color: self.engine.status_callback(text, color)
+                if self.engine.model is not None:
+                    engine.share_model(self.engine)
+                self.engines[name] = engine
+            return engine
+
+    def share_model(self):
+        """Comparte el modelo del motor base, una vez cargado, con los motores ya creados."""
+        with self._lock:
+            for engine in self.engines.values():
+                engine.share_model(self.engine)
+
+    def activate(self, name: str) -> ImageSearchEngine:
+        """Marca la colección como activa (nunca se descarta de la caché) y devuelve su motor."""
+        with self._lock:
+            self.active = name
+            return self.engine_for(name)
+
+    def get(self, name: str) -> Optional[ImageSearchEngine]:
+        """Motor de la colección con su índice cargado, o None si la colección no tiene un índice utilizable."""
+        with self._lock:
+            engine = self.engine_for(name)
+            if name in self.loaded and engine.has_index():
+                self.loaded.move_to_end(name)
+                self.engine.metrics.increment("collection_cache_hits")
+                return engine
+            self.engine.metrics.increment("collection_cache_misses")
+            with self.engine.metrics.time("collection_load"):
+                if not engine.has_index() and not engine.load_stored_index():
+                    return None
+            self.touch(name)
+            return engine
+
+    def touch(self, name: str):
+        """Registra que la colección está cargada (p. ej. tras indexarla) y aplica los límites de la caché."""
+        if name not in self.collections:
+            return
+        with self._lock:
+            self.loaded[name] = self.engine_for(name)
+            self.loaded.move_to_end(name)
+            self.evict(keep=name)
+
+    def evict(self, keep: Optional[str] = None):
+        """Descarta las colecciones usadas hace más tiempo mientras se superen los límites de la caché."""
+        with self._lock:
+            while len(self.loaded) > 1 and (len(self.loaded) > self.max_loaded or
+                                            self.memory_bytes() > self.memory_budget):
+                victim = next((name for name in self.loaded if name not in (keep, self.active)), None)
+                if victim is None:
+                    break
+                engine = self.loaded.pop(victim)
+                engine.shards = []
+                self.engine.metrics.increment("collection_evictions")
+                logging.info(f"Colección '{victim}' descargada de la memoria.")
+
+    def memory_bytes(self) -> int:
+        """Estimación de la memoria que ocupan los índices cargados."""
+        return sum(engine.memory_bytes() for engine in self.loaded.values())
+
+    def search_features(self, names: List[str], query_features: np.ndarray, k: int = 5,
+                        image_filter: Optional[ImageFilter] = None) -> List[List[Tuple[str, float]]]:
+        """Busca las consultas en varias colecciones y mezcla sus top-k por puntuación.
+
+        Las colecciones se consultan una tras otra (cada una ya reparte la búsqueda entre sus
+        fragmentos en paralelo); las que no tienen índice se omiten.
+        """
+        per_collection = []
+        for name in names:
+            engine = self.get(name)
+            if engine is None:
+                logging.warning(f"La colección '{name}' no tiene un índice utilizable. Se omite.")
+                continue
+            per_collection.append(engine.search_features(query_features, k, image_filter))
+        if not per_collection:
+            return [[] for _ in range(len(query_features))]
+        return [merge_top_k(results, k) for results in zip(*per_collection)]
+
+    def search_feature_list(self, names: List[str], features: List[Optional[np.ndarray]], k: int,
+                            image_filter: Optional[ImageFilter] = None) -> List[List[Tuple[str, float]]]:
+        ready = [i for i, feature in enumerate(features) if feature is not None]
+        results: List[List[Tuple[str, float]]] = [[] for _ in features]
+        if ready:
+            query_features = np.stack([features[i] for i in ready])
+            for i, matches in zip(ready, self.search_features(names, query_features, k, image_filter)):
+                results[i] = matches
+        return results
+
+    def search_texts(self, names: List[str], texts: List[str], k: int = 5,
+                     image_filter: Optional[ImageFilter] = None) -> List[List[Tuple[str, float]]]:
+        return self.search_feature_list(names, self.engine.text_query_features(texts), k, image_filter)
+
+    def search_images(self, names: List[str], image_paths: List[str], k: int = 5,
+                      image_filter: Optional[ImageFilter] = None) -> List[List[Tuple[str, float]]]:
+        return self.search_feature_list(names, self.engine.image_query_features(image_paths), k, image_filter)
@@ -0,0 +1,2915 @@
+"""Motor de búsqueda semántica de imágenes (CLIP + FAISS) sin dependencias de la interfaz gráfica."""
+
+from __future__ import annotations
+
+import os
+import numpy as np
+from PIL import Image
+import logging
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+import threading
+import json
+import io
+import base64
+import struct
+import time
+import math
+import multiprocessing
+import re
+import hashlib
+import shutil
+import sqlite3
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from functools import partial
+
+from image_search_filters import NO_DATE, ImageFilter
+from image_search_metrics import Metrics, profile_output_path, profile_run
+from image_search_preprocess import FastPreprocess
+
+if TYPE_CHECKING:
+    # Solo para las anotaciones: torch se importa dentro de las funciones que lo usan.
+    import torch
+
+CONFIG_FILE = "image_search_config.json"
+QUERY_CACHE_FILE = "query_cache.npz"
+EMBEDDING_STORE_FILE = "embeddings.sqlite"
+HASH_CHUNK_SIZE = 1024
+# Memoria aproximada de una entrada del manifiesto en memoria (ruta, tamaño y fecha, e ID del vector,
+# en dos dict de Python que comparten la ruta).
+MANIFEST_ENTRY_BYTES = 300
+THUMBNAIL_DIR = "thumbnails"
+THUMBNAIL_SIZE = (150, 150)
+INDEX_DIR = "image_index"
+INDEX_HEADER_FILE = os.path.join(INDEX_DIR, "header.json")
+COLLECTION_FILE = "collection.json"
+SHARDS_DIR = "shards"
+# Archivos que versiones anteriores escribían directamente en el directorio del índice (el pickle
+# original, la cabecera y las generaciones del índice sin fragmentos) y que se pueden borrar al guardar.
+LEGACY_INDEX_FILES = ("image_index.bin", "image_index.header", "header.json")
+LEGACY_INDEX_FILE_PATTERN = re.compile(
+    r"(index-[0-9a-f]+\.faiss|(paths|attrs|manifest)-[0-9a-f]+\.bin|vectors-[0-9a-f]+\.f32)(\.tmp-\d+(-\d+)?)?")
+SHARD_DIR_PATTERN = re.compile(r"[0-9a-f]{16}")
+INDEX_FORMAT_VERSION = 9
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+MODEL_NAME = "ViT-L/14"
+# Tiempo máximo para que todos los procesos de inferencia carguen su modelo, en segundos.
+MODEL_WORKER_START_TIMEOUT = 600
+DEFAULT_FEATURE_DIM = 768
+QUERY_CHUNK_SIZE = 256
+PRECISIONS = ("auto", "fp32", "fp16", "bf16", "int8")
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+COMPRESSIONS = ("none", "fp16", "sq8", "pq")
+DEFAULT_CONFIG = {
+    "image_dir": "",
+    "collection": "",
+    "collection_cache_size": 4,
+    "collection_memory_mb": 2048,
+    "index_type": "auto",
+    "vector_compression": "none",
+    "rerank_factor": 4,
+    "filter_exact_limit": 2048,
+    "nprobe": 16,
+    "ef_search": 64,
+    "decode_workers": None,
+    "prefetch_batches": 2,
+    "model_workers": 0,
+    "model_worker_threads": None,
+    "checkpoint_interval": 60,
+    "precision": "auto",
+    "query_cache_size": 1024,
+    "query_cache_persist": True,
+    "thumbnails_during_indexing": True,
+    "fast_preprocess": True,
+    "embedding_store": EMBEDDING_STORE_FILE,
+    "recursive": True,
+    "server_host": "127.0.0.1",
+    "server_port": 8765,
+    "server_batch_window_ms": 5,
+    "server_max_batch_size": 64,
+    "server_max_concurrent_requests": 256,
+    "metrics_dir": "metrics",
+    "profiler": None,
+    "profile_dir": "profiles",
+    "watch": False,
+    "watch_backend": "auto",
+    "watch_debounce_s": 2.0,
+    "watch_max_delay_s": 30.0,
+    "watch_poll_interval_s": 10.0,
+}
+PATH_TABLE_MAGIC = b"ISSPATH1"
+MANIFEST_MAGIC = b"ISSMANI2"
+ATTRIBUTES_MAGIC = b"ISSATTR1"
+# Columnas de atributos por imagen: carpeta (índice en la tabla de carpetas), tamaño en bytes, mtime_ns,
+# dimensiones y fecha EXIF de captura en segundos (NO_DATE si no la tiene).
+ATTRIBUTE_COLUMNS = (("folder", np.int32), ("size", np.int64), ("mtime", np.int64),
+                     ("width", np.int32), ("height", np.int32), ("taken", np.int64))
+EXIF_DATE_TAGS = ((0x8769, 36867), (0x8769, 36868), (None, 306))
+os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
+
+
+def atomic_write(file_path: str, writer: Callable[[str], None]):
+    """Escribe un archivo de forma atómica: se genera en un temporal y se renombra al terminar.
+
+    El temporal lleva el proceso y el hilo, así que escrituras concurrentes del mismo archivo no se pisan.
+    """
+    tmp_path = f"{file_path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    try:
+        writer(tmp_path)
+        with open(tmp_path, "rb+") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _write_string_table(f, strings: List[Optional[str]]):
+    """Escribe una tabla de cadenas como desplazamientos int64 seguidos de un bloque UTF-8."""
+    encoded = [s.encode("utf-8") if s is not None else b"" for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    f.write(offsets.tobytes())
+    f.write(b"".join(encoded))
+
+
+def _map_string_table(file_path: str, offset: int, count: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Mapea en memoria una tabla de cadenas escrita con _write_string_table."""
+    offsets = np.memmap(file_path, dtype=np.int64, mode="r", offset=offset, shape=(count + 1,))
+    blob_offset = offset + offsets.nbytes
+    blob_size = int(offsets[-1])
+    if blob_size == 0:
+        return offsets, np.zeros(0, dtype=np.uint8)
+    blob = np.memmap(file_path, dtype=np.uint8, mode="r", offset=blob_offset, shape=(blob_size,))
+    return offsets, blob
+
+
+class PathTable:
+    """Tabla compacta de rutas indexada por el ID del vector.
+
+    Las rutas cargadas desde disco permanecen mapeadas en memoria y solo se decodifican al
+    acceder a ellas; las añadidas o eliminadas después se guardan aparte hasta el próximo guardado.
+    Una posición eliminada devuelve None.
+    """
+
+    def __init__(self, offsets: Optional[np.ndarray] = None, blob: Optional[np.ndarray] = None):
+        self._offsets = offsets if offsets is not None else np.zeros(1, dtype=np.int64)
+        self._blob = blob if blob is not None else np.zeros(0, dtype=np.uint8)
+        self._stored_count = len(self._offsets) - 1
+        self._appended: List[Optional[str]] = []
+        self._removed = set()
+        self._live_mask: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return self._stored_count + len(self._appended)
+
+    def __getitem__(self, i: int) -> Optional[str]:
+        if i < 0 or i >= len(self):
+            raise IndexError(i)
+        if i >= self._stored_count:
+            return self._appended[i - self._stored_count]
+        if i in self._removed:
+            return None
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        if start == end:
+            return None
+        return bytes(self._blob[start:end]).decode("utf-8")
+
+    def __setitem__(self, i: int, value: None):
+        """Solo admite marcar una posición como eliminada (value=None); los IDs nunca se reutilizan."""
+        if value is not None:
+            raise ValueError("Las rutas existentes no se pueden reemplazar, solo eliminar.")
+        self._live_mask = None
+        if i >= self._stored_count:
+            self._appended[i - self._stored_count] = None
+        else:
+            self._removed.add(i)
+
+    def __iter__(self) -> Iterator[Optional[str]]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, path: str):
+        self._appended.append(path)
+        self._live_mask = None
+
+    def extend(self, paths: Iterable[str]):
+        self._appended.extend(paths)
+        self._live_mask = None
+
+    def live_mask(self) -> np.ndarray:
+        """Array booleano (de solo lectura) por ID que indica las posiciones no eliminadas."""
+        if self._live_mask is None:
+            mask = np.empty(len(self), dtype=bool)
+            mask[:self._stored_count] = np.diff(self._offsets) > 0
+            if self._removed:
+                mask[np.fromiter(self._removed, dtype=np.int64)] = False
+            mask[self._stored_count:] = [p is not None for p in self._appended]
+            mask.flags.writeable = False
+            self._live_mask = mask
+        return self._live_mask
+
+    def count(self) -> int:
+        """Número de rutas no eliminadas."""
+        stored_lengths = np.diff(self._offsets)
+        stored = int(np.count_nonzero(stored_lengths)) - sum(1 for i in self._removed if stored_lengths[i])
+        return stored + sum(1 for p in self._appended if p is not None)
+
+    def save(self, file_path: str):
+        """Guarda la tabla de forma atómica."""
+        paths = list(self)
+
+        def writer(tmp_path):
+            with open(tmp_path, "wb") as f:
+                f.write(PATH_TABLE_MAGIC)
+                f.write(struct.pack("<q", len(paths)))
+                _write_string_table(f, paths)
+
+        atomic_write(file_path, writer)
+
+    @classmethod
+    def load(cls, file_path: str) -> "PathTable":
+        """Carga la tabla mapeándola en memoria."""
+        with open(file_path, "rb") as f:
+            if f.read(len(PATH_TABLE_MAGIC)) != PATH_TABLE_MAGIC:
+                raise ValueError(f"Formato de tabla de rutas desconocido: {file_path}")
+            (count,) = struct.unpack("<q", f.read(8))
+        offsets, blob = _map_string_table(file_path, len(PATH_TABLE_MAGIC) + 8, count)
+        return cls(offsets, blob)
+
+
+def save_manifest(file_path: str, manifest: Dict[str, Tuple[int, int]], path_ids: Dict[str, int]):
+    """Guarda el manifiesto (ruta -> (tamaño, mtime_ns)) en formato columnar de forma atómica.
+
+    Junto a cada ruta se guarda el ID de su vector (`path_ids`), o -1 si la imagen no se pudo leer,
+    para localizar las imágenes cambiadas sin recorrer la tabla de rutas.
+    """
+    paths = list(manifest)
+    signatures = np.array([manifest[p] for p in paths], dtype=np.int64).reshape(-1, 2)
+    ids = np.array([path_ids.get(p, -1) for p in paths], dtype=np.int64)
+
+    def writer(tmp_path):
+        with open(tmp_path, "wb") as f:
+            f.write(MANIFEST_MAGIC)
+            f.write(struct.pack("<q", len(paths)))
+            f.write(np.ascontiguousarray(signatures).tobytes())
+            f.write(ids.tobytes())
+            _write_string_table(f, paths)
+
+    atomic_write(file_path, writer)
+
+
+def load_manifest(file_path: str) -> Tuple[Dict[str, Tuple[int, int]], Dict[str, int]]:
+    """Carga el manifiesto guardado con save_manifest; devuelve (manifiesto, ruta -> ID del vector)."""
+    with open(file_path, "rb") as f:
+        if f.read(len(MANIFEST_MAGIC)) != MANIFEST_MAGIC:
+            raise ValueError(f"Formato de manifiesto desconocido: {file_path}")
+        (count,) = struct.unpack("<q", f.read(8))
+        signatures = np.frombuffer(f.read(count * 16), dtype=np.int64).reshape(-1, 2)
+        ids = np.frombuffer(f.read(count * 8), dtype=np.int64)
+    offsets, blob = _map_string_table(file_path, len(MANIFEST_MAGIC) + 8 + count * 24, count)
+    data = bytes(blob)
+    manifest = {}
+    path_ids = {}
+    for i, ((size, mtime_ns), vector_id) in enumerate(zip(signatures.tolist(), ids.tolist())):
+        path = data[offsets[i]:offsets[i + 1]].decode("utf-8")
+        manifest[path] = (int(size), int(mtime_ns))
+        if vector_id >= 0:
+            path_ids[path] = vector_id
+    return manifest, path_ids
+
+
+def read_image_attributes(image_path: str) -> Tuple[int, int, int]:
+    """Lee (ancho, alto, fecha EXIF) de la cabecera de una imagen sin decodificar sus píxeles.
+
+    La fecha es la de captura (DateTimeOriginal, o DateTime si falta) en segundos de la hora local;
+    NO_DATE si la imagen no la tiene. Una imagen ilegible devuelve (0, 0, NO_DATE).
+    """
+    try:
+        with Image.open(image_path) as img:
+            width, height = img.size
+            exif = img.getexif()
+            for ifd, tag in EXIF_DATE_TAGS:
+                value = (exif.get_ifd(ifd) if ifd else exif).get(tag)
+                if value:
+                    try:
+                        parsed = time.strptime(str(value).strip("\x00 ")[:19], "%Y:%m:%d %H:%M:%S")
+                        return width, height, int(time.mktime(parsed))
+                    except (ValueError, OverflowError):
+                        continue
+            return width, height, NO_DATE
+    except Exception as e:
+        logging.debug(f"No se pudieron leer los atributos de {image_path}: {e}")
+        return 0, 0, NO_DATE
+
+
+class AttributeTable:
+    """Atributos de las imágenes en columnas indexadas por el ID del vector, para filtrar las búsquedas.
+
+    Cada columna es un array de numpy (ver ATTRIBUTE_COLUMNS); las carpetas se guardan una sola vez
+    y cada fila apunta a la suya. Las columnas cargadas desde disco permanecen mapeadas en memoria;
+    las filas añadidas después se acumulan aparte hasta el próximo guardado.
+    """
+
+    def __init__(self, columns: Optional[Dict[str, np.ndarray]] = None, folders: Optional[List[str]] = None):
+        self._stored = columns or {name: np.zeros(0, dtype=dtype) for name, dtype in ATTRIBUTE_COLUMNS}
+        self._stored_count = len(self._stored["folder"])
+        self.folders: List[str] = list(folders or [])
+        self._folder_ids = {folder: i for i, folder in enumerate(self.folders)}
+        self._appended: List[tuple] = []
+        self._columns: Dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return self._stored_count + len(self._appended)
+
+    def append(self, path: str, signature: Tuple[int, int], attributes: Tuple[int, int, int]):
+        """Añade la fila de una imagen: `signature` es (tamaño, mtime_ns) y `attributes` (ancho, alto, fecha)."""
+        folder = os.path.dirname(os.path.abspath(path))
+        folder_id = self._folder_ids.get(folder)
+        if folder_id is None:
+            folder_id = self._folder_ids[folder] = len(self.folders)
+            self.folders.append(folder)
+        self._appended.append((folder_id, *signature, *attributes))
+        self._columns = {}
+
+    def column(self, name: str) -> np.ndarray:
+        """Columna completa (filas almacenadas y añadidas) como array de numpy."""
+        column = self._columns.get(name)
+        if column is None:
+            if not self._appended:
+                column = self._stored[name]
+            else:
+                position = [column_name for column_name, _ in ATTRIBUTE_COLUMNS].index(name)
+                appended = np.array([row[position] for row in self._appended], dtype=self._stored[name].dtype)
+                column = np.concatenate([self._stored[name], appended])
+            self._columns[name] = column
+        return column
+
+    def save(self, file_path: str):
+        """Guarda la tabla de forma atómica."""
+        columns = [np.ascontiguousarray(self.column(name), dtype=dtype) for name, dtype in ATTRIBUTE_COLUMNS]
+        folders = list(self.folders)
+
+        def writer(tmp_path):
+            with open(tmp_path, "wb") as f:
+                f.write(ATTRIBUTES_MAGIC)
+                f.write(struct.pack("<qq", len(self), len(folders)))
+                for column in columns:
+                    f.write(column.tobytes())
+                _write_string_table(f, folders)
+
+        atomic_write(file_path, writer)
+
+    @classmethod
+    def load(cls, file_path: str) -> "AttributeTable":
+        """Carga la tabla mapeando sus columnas en memoria."""
+        with open(file_path, "rb") as f:
+            if f.read(len(ATTRIBUTES_MAGIC)) != ATTRIBUTES_MAGIC:
+                raise ValueError(f"Formato de tabla de atributos desconocido: {file_path}")
+            count, num_folders = struct.unpack("<qq", f.read(16))
+        offset = len(ATTRIBUTES_MAGIC) + 16
+        columns = {}
+        for name, dtype in ATTRIBUTE_COLUMNS:
+            if count:
+                columns[name] = np.memmap(file_path, dtype=dtype, mode="r", offset=offset, shape=(count,))
+            else:
+                columns[name] = np.zeros(0, dtype=dtype)
+            offset += count * np.dtype(dtype).itemsize
+        offsets, blob = _map_string_table(file_path, offset, num_folders)
+        data = bytes(blob)
+        folders = [data[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(num_folders)]
+        return cls(columns, folders)
+
+
+class VectorStore:
+    """Archivo de solo anexado con los vectores normalizados (float32), una fila por ID.
+
+    La cabecera del índice guarda cuántas filas están confirmadas; las filas posteriores
+    (de una escritura interrumpida) se descartan al abrir el archivo.
+    """
+
+    def __init__(self, file_path: str, dim: int, num_rows: int = 0):
+        self.file_path = file_path
+        self.dim = dim
+        self.num_rows = num_rows
+        self._array: Optional[np.ndarray] = None
+
+    @property
+    def row_bytes(self) -> int:
+        return self.dim * np.dtype(np.float32).itemsize
+
+    @classmethod
+    def create(cls, file_path: str, dim: int) -> "VectorStore":
+        """Crea un archivo de vectores vacío."""
+        open(file_path, "wb").close()
+        return cls(file_path, dim)
+
+    @classmethod
+    def open(cls, file_path: str, dim: int, num_rows: int) -> "VectorStore":
+        """Abre un archivo existente descartando las filas no confirmadas."""
+        store = cls(file_path, dim, num_rows)
+        size = os.path.getsize(file_path)
+        if size < num_rows * store.row_bytes:
+            raise ValueError(f"El archivo de vectores {file_path} tiene menos filas de las esperadas.")
+        if size > num_rows * store.row_bytes:
+            os.truncate(file_path, num_rows * store.row_bytes)
+        return store
+
+    def append(self, vectors: np.ndarray):
+        """Añade filas al final del archivo."""
+        with open(self.file_path, "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        self.num_rows += len(vectors)
+
+    def flush(self):
+        """Fuerza la escritura en disco de las filas añadidas."""
+        with open(self.file_path, "rb+") as f:
+            os.fsync(f.fileno())
+
+    def array(self) -> np.ndarray:
+        """Devuelve las filas confirmadas mapeadas en memoria (solo lectura)."""
+        if self.num_rows == 0:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        # El mapeo se reutiliza entre búsquedas mientras no se añadan filas.
+        if self._array is None or len(self._array) != self.num_rows:
+            self._array = np.memmap(self.file_path, dtype=np.float32, mode="r", shape=(self.num_rows, self.dim))
+        return self._array
+
+
+def select_device():
+    """Dispositivo de inferencia: CUDA si está disponible, si no CPU."""
+    import torch
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def resolve_precision(precision: str, device) -> str:
+    """Traduce la precisión configurada a la que realmente se usará en el dispositivo.
+
+    `auto` conserva el comportamiento de CLIP: fp16 en CUDA y fp32 en CPU. La cuantización
+    dinámica int8 solo existe en CPU y fp16 solo en CUDA.
+    """
+    if precision not in PRECISIONS:
+        logging.warning(f"Precisión desconocida '{precision}'. Se usará 'auto'.")
+        precision = "auto"
+    if precision == "auto":
+        return "fp16" if device.type == "cuda" else "fp32"
+    if precision == "int8" and device.type != "cpu":
+        logging.warning("La cuantización int8 solo está disponible en CPU. Se usará fp16.")
+        return "fp16"
+    if precision == "fp16" and device.type == "cpu":
+        logging.warning("fp16 no está soportado en CPU. Se usará fp32.")
+        return "fp32"
+    return precision
+
+
+def load_clip_model(precision: str = "auto", device=None):
+    """Carga CLIP y lo convierte a la precisión indicada.
+
+    Devuelve (modelo, preprocesado, dispositivo, precisión efectiva).
+    """
+    import torch
+    import clip
+
+    device = device or select_device()
+    precision = resolve_precision(precision, device)
+    model, preprocess = clip.load(MODEL_NAME, device=device)
+    if precision == "fp32":
+        model = model.float()
+    elif precision == "fp16":
+        model = model.half()
+    elif precision == "bf16":
+        model = model.to(torch.bfloat16)
+    elif precision == "int8":
+        model = torch.ao.quantization.quantize_dynamic(model.float(), {torch.nn.Linear}, dtype=torch.qint8)
+    model.eval()
+    return model, preprocess, device, precision
+
+
+def read_config_file() -> dict:
+    """Lee la configuración del archivo, completada con los valores por defecto."""
+    try:
+        with open(CONFIG_FILE, "r") as f:
+            return {**DEFAULT_CONFIG, **json.load(f)}
+    except (FileNotFoundError, json.JSONDecodeError):
+        return dict(DEFAULT_CONFIG)
+
+
+class ThumbnailStore:
+    """Caché en disco de miniaturas JPEG identificadas por ruta, tamaño y fecha de modificación.
+
+    Si la imagen original cambia, su clave también, así que nunca se sirve una miniatura obsoleta.
+    """
+
+    def __init__(self, directory: str = THUMBNAIL_DIR, size: Tuple[int, int] = THUMBNAIL_SIZE):
+        self.directory = directory
+        self.size = size
+
+    def thumbnail_path(self, image_path: str, stat: Optional[os.stat_result] = None) -> str:
+        stat = stat or os.stat(image_path)
+        key = hashlib.sha1(f"{image_path}|{stat.st_size}|{stat.st_mtime_ns}".encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, key[:2], f"{key[2:]}.jpg")
+
+    def get(self, image_path: str) -> Optional[bytes]:
+        """Devuelve los bytes JPEG de la miniatura si ya existe."""
+        try:
+            with open(self.thumbnail_path(image_path), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def save_from_image(self, image_path: str, img: Image.Image, stat: Optional[os.stat_result] = None) -> bytes:
+        """Genera la miniatura a partir de una imagen ya abierta y la guarda."""
+        thumbnail = img.convert("RGB") if img.mode != "RGB" else img.copy()
+        thumbnail.thumbnail(self.size)
+        buffered = io.BytesIO()
+        thumbnail.save(buffered, format="JPEG", quality=85)
+        data = buffered.getvalue()
+
+        thumbnail_path = self.thumbnail_path(image_path, stat)
+        os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+
+        def writer(tmp_path):
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+
+        atomic_write(thumbnail_path, writer)
+        return data
+
+    def ensure_from_image(self, image_path: str, img: Image.Image):
+        """Guarda la miniatura de una imagen ya decodificada si aún no existe; los errores solo se registran."""
+        try:
+            stat = os.stat(image_path)
+            if not os.path.exists(self.thumbnail_path(image_path, stat)):
+                self.save_from_image(image_path, img, stat)
+        except OSError as e:
+            logging.warning(f"No se pudo guardar la miniatura de {image_path}: {e}")
+
+    def get_or_create(self, image_path: str) -> bytes:
+        """Devuelve la miniatura, generándola si todavía no existe."""
+        data = self.get(image_path)
+        if data is not None:
+            return data
+        stat = os.stat(image_path)
+        with Image.open(image_path) as img:
+            # Los JPEG se decodifican directamente a una escala reducida cercana al tamaño final.
+            img.draft("RGB", self.size)
+            return self.save_from_image(image_path, img, stat)
+
+
+def load_and_preprocess_batch(image_paths: List[str], preprocess,
+                              thumbnail_store: Optional[ThumbnailStore] = None,
+                              metrics: Optional[Metrics] = None) -> Tuple[List[str], Optional[torch.Tensor]]:
+    """Decodifica y preprocesa un lote de imágenes; las ilegibles se omiten sin descartar el resto.
+
+    Con un FastPreprocess las imágenes se decodifican a escala reducida y el lote se normaliza de una vez.
+    Con `thumbnail_store` se aprovecha la imagen ya decodificada para guardar su miniatura.
+    Con `metrics` se registra por imagen el tiempo de decodificación, preprocesamiento y miniatura.
+    """
+    fast = isinstance(preprocess, FastPreprocess)
+    images = []
+    valid_paths = []
+    for path in image_paths:
+        try:
+            start = time.perf_counter()
+            with Image.open(path) as img:
+                img = preprocess.reduce(img) if fast else img.convert('RGB')
+                img.load()
+                decoded = time.perf_counter()
+                images.append(preprocess.crop_array(img) if fast else preprocess(img))
+                preprocessed = time.perf_counter()
+                valid_paths.append(path)
+                if thumbnail_store is not None:
+                    thumbnail_store.ensure_from_image(path, img)
+            if metrics is not None:
+                metrics.record("decode", decoded - start)
+                metrics.record("preprocess", preprocessed - decoded)
+                if thumbnail_store is not None:
+                    metrics.record("thumbnail", time.perf_counter() - preprocessed)
+        except Exception as e:
+            logging.error(f"Error al abrir o procesar imagen: {path}. Error: {e}")
+            if metrics is not None:
+                metrics.increment("images_failed")
+            continue
+
+    if not images:
+        return valid_paths, None
+    import torch
+    start = time.perf_counter()
+    batch = preprocess.to_tensor(images) if fast else torch.stack(images)
+    if metrics is not None:
+        metrics.record("stack", time.perf_counter() - start, len(images))
+    return valid_paths, batch
+
+
+_worker_preprocess = None
+_worker_thumbnail_store = None
+
+
+def _init_decode_worker(preprocess, thumbnail_store: Optional[ThumbnailStore]):
+    """Inicializa un proceso de decodificación con la transformación del modelo."""
+    import torch
+    global _worker_preprocess, _worker_thumbnail_store
+    _worker_preprocess = preprocess
+    _worker_thumbnail_store = thumbnail_store
+    # Cada proceso decodifica un lote; el paralelismo viene del número de procesos.
+    torch.set_num_threads(1)
+
+
+def _decode_worker(image_paths: List[str]) -> Tuple[List[str], Optional[torch.Tensor], dict]:
+    # Las métricas del proceso auxiliar viajan con el lote y se suman en el proceso principal.
+    metrics = Metrics()
+    valid_paths, batch_images = load_and_preprocess_batch(image_paths, _worker_preprocess, _worker_thumbnail_store,
+                                                          metrics)
+    return valid_paths, batch_images, metrics.export()
+
+
+def default_decode_workers() -> int:
+    """Número de procesos de decodificación por defecto: los núcleos libres, hasta 8."""
+    return max(1, min(8, (os.cpu_count() or 2) - 1))
+
+
+class DecodeWorkerPool:
+    """Procesos de decodificación con la transformación del modelo y el almacén de miniaturas.
+
+    Arrancar un proceso con spawn cuesta importar torch y PIL de nuevo, así que el motor crea el
+    grupo una sola vez por indexación y lo comparten todos los fragmentos.
+    """
+
+    def __init__(self, num_workers: int, preprocess, thumbnail_store: Optional[ThumbnailStore] = None):
+        self.num_workers = num_workers
+        self.broken = False
+        self.executor = ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=_init_decode_worker, initargs=(preprocess, thumbnail_store))
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+def iter_preprocessed_batches(image_paths: List[str], batch_size: int, preprocess, pool: Optional[DecodeWorkerPool],
+                              prefetch_batches: int, thumbnail_store: Optional[ThumbnailStore] = None,
+                              metrics: Optional[Metrics] = None
+                              ) -> Iterator[Tuple[List[str], List[str], Optional[torch.Tensor]]]:
+    """Genera (rutas del lote, rutas válidas, tensor) decodificando por adelantado en procesos auxiliares.
+
+    Mientras el consumidor codifica el lote N, los procesos de `pool` ya preparan hasta
+    `prefetch_batches` lotes siguientes. Los tensores llegan por memoria compartida gracias a
+    torch.multiprocessing. Sin `pool` los lotes se preparan en el propio hilo. En `metrics`,
+    `decode_wait` es el tiempo que el consumidor espera un lote (incluye la transferencia desde
+    el proceso auxiliar).
+    """
+    batches = [image_paths[i:i + batch_size] for i in range(0, len(image_paths), batch_size)]
+    if pool is None or pool.broken or len(batches) <= 1:
+        for batch_paths in batches:
+            yield (batch_paths, *load_and_preprocess_batch(batch_paths, preprocess, thumbnail_store, metrics))
+        return
+
+    pending_batches = deque(batches)
+    in_flight = deque()
+    try:
+        while pending_batches or in_flight:
+            while pending_batches and len(in_flight) < pool.num_workers + max(prefetch_batches, 0):
+                batch_paths = pending_batches.popleft()
+                in_flight.append((batch_paths, pool.executor.submit(_decode_worker, batch_paths)))
+            batch_paths, future = in_flight[0]
+            start = time.perf_counter()
+            valid_paths, batch_images, worker_metrics = future.result()
+            if metrics is not None:
+                metrics.record("decode_wait", time.perf_counter() - start, len(batch_paths))
+                metrics.merge(worker_metrics)
+            in_flight.popleft()
+            yield batch_paths, valid_paths, batch_images
+    except GeneratorExit:
+        # El consumidor se detuvo (p. ej. al cancelar): se descartan los lotes aún no empezados.
+        for _, future in in_flight:
+            future.cancel()
+        raise
+    except BrokenProcessPool as e:
+        logging.error(f"Un proceso de decodificación terminó inesperadamente: {e}. Continuando sin procesos auxiliares.")
+        pool.broken = True
+        remaining = [batch_paths for batch_paths, _ in in_flight] + list(pending_batches)
+        in_flight.clear()
+        for batch_paths in remaining:
+            yield (batch_paths, *load_and_preprocess_batch(batch_paths, preprocess, thumbnail_store, metrics))
+
+
+def load_worker_model(precision: str, fast_preprocess: bool = True):
+    """Carga CLIP en CPU con la precisión indicada para un proceso de inferencia.
+
+    Devuelve (modelo, preprocesado); el preprocesado es FastPreprocess si `fast_preprocess` y la
+    transformación de CLIP lo admite, igual que en el proceso principal.
+    """
+    import torch
+    model, preprocess = load_clip_model(precision, torch.device("cpu"))[:2]
+    if fast_preprocess:
+        preprocess = FastPreprocess.from_transform(preprocess) or preprocess
+    return model, preprocess
+
+
+def cpu_topology() -> List[Tuple[int, int, int]]:
+    """(socket, núcleo, CPU) de cada CPU que puede usar el proceso, ordenados para agrupar núcleos vecinos.
+
+    Los datos salen de /sys en Linux; en otros sistemas todas las CPU cuentan como un mismo socket.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    topology = []
+    for cpu in cpus:
+        ids = []
+        for name, default in (("physical_package_id", 0), ("core_id", cpu)):
+            try:
+                with open(f"/sys/devices/system/cpu/cpu{cpu}/topology/{name}") as f:
+                    ids.append(int(f.read()))
+            except (OSError, ValueError):
+                ids.append(default)
+        topology.append((ids[0], ids[1], cpu))
+    return sorted(topology)
+
+
+def plan_core_groups(num_workers: int) -> List[List[int]]:
+    """Reparte las CPU disponibles en `num_workers` grupos contiguos, uno por proceso de inferencia.
+
+    Al ordenar por socket y núcleo, cada grupo reúne núcleos del mismo socket (y sus hilos
+    hermanos), así que con tantos procesos como sockets (o un múltiplo) ninguno cruza de socket.
+    Si hay más procesos que CPU, varios comparten la misma.
+    """
+    cpus = [cpu for _, _, cpu in cpu_topology()]
+    if num_workers >= len(cpus):
+        return [[cpus[i % len(cpus)]] for i in range(num_workers)]
+    bounds = np.linspace(0, len(cpus), num_workers + 1).round().astype(int)
+    return [cpus[bounds[i]:bounds[i + 1]] for i in range(num_workers)]
+
+
+_worker_model = None
+_worker_ready = None
+
+
+def _init_model_worker(core_groups: List[List[int]], next_group, ready, model_loader: Callable,
+                       thumbnail_store: Optional[ThumbnailStore], threads: Optional[int]):
+    """Inicializa un proceso de inferencia: lo fija a su grupo de núcleos y carga su modelo y su preprocesado.
+
+    Cada proceso toma el siguiente grupo con el contador compartido `next_group`, sin esperas.
+    """
+    global _worker_model, _worker_preprocess, _worker_thumbnail_store, _worker_ready
+    with next_group.get_lock():
+        cores = core_groups[next_group.value % len(core_groups)]
+        next_group.value += 1
+    # Los argumentos solo llevan configuración sencilla (precisión, parámetros del preprocesado), así
+    # que torch aún no está importado: la afinidad se fija antes para que sus hilos nazcan ya en esos núcleos.
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    import torch
+    torch.set_num_threads(threads or len(cores) or 1)
+    _worker_model, _worker_preprocess = model_loader()
+    _worker_thumbnail_store = thumbnail_store
+    _worker_ready = ready
+
+
+def _model_worker_ready() -> int:
+    """Tarea de arranque: espera en la barrera a que todos los procesos estén listos y devuelve el PID.
+
+    Mientras una tarea espera, su proceso no puede recibir otra, así que cada una de las
+    `num_workers` tareas se ejecuta necesariamente en un proceso distinto.
+    """
+    _worker_ready.wait(timeout=MODEL_WORKER_START_TIMEOUT)
+    return os.getpid()
+
+
+def _model_worker(image_paths: List[str]) -> Tuple[List[str], Optional[np.ndarray], dict]:
+    import torch
+    metrics = Metrics()
+    valid_paths, batch_images = load_and_preprocess_batch(image_paths, _worker_preprocess, _worker_thumbnail_store,
+                                                          metrics)
+    features = None
+    if batch_images is not None:
+        try:
+            with metrics.time("encode_image", len(valid_paths)), torch.no_grad():
+                features = _worker_model.encode_image(batch_images).float().numpy()
+        except Exception as e:
+            logging.error(f"Error al procesar el lote de imágenes: {e}")
+    return valid_paths, features, metrics.export()
+
+
+class ModelWorkerPool:
+    """Procesos de inferencia en CPU, cada uno con su copia del modelo y fijado a un grupo de núcleos.
+
+    Un único modelo deja de escalar a partir de unos pocos hilos; con varios procesos, cada uno con
+    `torch.set_num_threads` igual a sus núcleos, se codifican varios lotes a la vez. Cada proceso
+    decodifica y codifica lotes completos (unidades de trabajo) y devuelve solo los vectores.
+    Cargar los modelos tarda unos segundos y cada copia ocupa su memoria, así que el motor crea el
+    grupo al empezar a indexar y lo cierra al terminar.
+
+    `model_loader` devuelve (modelo, preprocesado) dentro de cada proceso; debe poder enviarse sin
+    importar torch (una función del módulo con argumentos simples, p. ej. con functools.partial).
+    """
+
+    def __init__(self, num_workers: int, model_loader: Callable,
+                 thumbnail_store: Optional[ThumbnailStore] = None, threads: Optional[int] = None):
+        context = multiprocessing.get_context("spawn")
+        self.core_groups = plan_core_groups(num_workers)
+        self.num_workers = len(self.core_groups)
+        self.broken = False
+        self.worker_pids: List[int] = []
+        next_group = context.Value("i", 0)
+        ready = context.Barrier(self.num_workers)
+        self.executor = ProcessPoolExecutor(max_workers=self.num_workers, mp_context=context,
+                                            initializer=_init_model_worker,
+                                            initargs=(self.core_groups, next_group, ready, model_loader,
+                                                      thumbnail_store, threads))
+
+    def iter_batches(self, image_paths: List[str], batch_size: int, prefetch_batches: int,
+                     encode_locally: Callable[[List[str]], Tuple[List[str], Optional[np.ndarray]]],
+                     metrics: Optional[Metrics] = None
+                     ) -> Iterator[Tuple[List[str], List[str], Optional[np.ndarray]]]:
+        """Genera (rutas del lote, rutas válidas, vectores) en el orden de `image_paths`.
+
+        Se reparten lotes de `batch_size` imágenes entre los procesos, con hasta `prefetch_batches`
+        lotes de más en cola, y se recogen en orden. `model_wait` es el tiempo que el consumidor
+        espera un lote. Si un proceso termina inesperadamente, los lotes restantes se codifican
+        con `encode_locally` en el proceso principal.
+        """
+        pending_batches = deque(image_paths[i:i + batch_size] for i in range(0, len(image_paths), batch_size))
+        in_flight = deque()
+        try:
+            while pending_batches or in_flight:
+                while pending_batches and len(in_flight) < self.num_workers + max(prefetch_batches, 0):
+                    batch_paths = pending_batches.popleft()
+                    in_flight.append((batch_paths, self.executor.submit(_model_worker, batch_paths)))
+                batch_paths, future = in_flight[0]
+                start = time.perf_counter()
+                valid_paths, features, worker_metrics = future.result()
+                if metrics is not None:
+                    metrics.record("model_wait", time.perf_counter() - start, len(batch_paths))
+                    metrics.merge(worker_metrics)
+                in_flight.popleft()
+                yield batch_paths, valid_paths, features
+        except GeneratorExit:
+            for _, future in in_flight:
+                future.cancel()
+            raise
+        except BrokenProcessPool as e:
+            logging.error(f"Un proceso de inferencia terminó inesperadamente: {e}. Continuando en el proceso principal.")
+            self.broken = True
+            remaining = [batch_paths for batch_paths, _ in in_flight] + list(pending_batches)
+            in_flight.clear()
+            for batch_paths in remaining:
+                yield (batch_paths, *encode_locally(batch_paths))
+
+    def start(self):
+        """Arranca todos los procesos y espera a que cada uno haya fijado sus núcleos y cargado su modelo.
+
+        Cada proceso ejecuta una tarea de arranque que espera en una barrera a los demás, así que no
+        termina ninguna hasta que los `num_workers` procesos están listos. Lanza BrokenProcessPool si
+        alguno no arranca a tiempo.
+        """
+        futures = [self.executor.submit(_model_worker_ready) for _ in range(self.num_workers)]
+        try:
+            self.worker_pids = [future.result() for future in futures]
+        except threading.BrokenBarrierError:
+            raise BrokenProcessPool(f"Los procesos de inferencia no arrancaron en {MODEL_WORKER_START_TIMEOUT} s.")
+        if len(set(self.worker_pids)) != self.num_workers:
+            raise BrokenProcessPool("Algún proceso de inferencia no llegó a arrancar.")
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+def render_results_html(results: List[Tuple[str, float]], thumbnail_store: ThumbnailStore,
+                        query_type: str = "image", query_text: str = "") -> str:
+    """Genera la página HTML de resultados con las miniaturas incrustadas."""
+    html_content = """
+        <html>
+        <head>
+            <style>
+                .container { display: flex; flex-wrap: wrap; justify-content: flex-start; }
+                .image-item { margin: 10px; text-align: center; }
+                .image-item img { width: 150px; height: auto; border: 1px solid #ddd; }
+                .query-title { margin-bottom: 10px; }
+                .dist-indices { margin-top: 10px; font-size: 0.8em; color: #555;}
+                .image-text-container { display: inline-block; margin: 10px; text-align: left; width: 150px;}
+                .image-item a { text-decoration: none; }
+                .image-item a:hover { text-decoration: underline; }
+                body { font-family: sans-serif; margin: 20px; }
+            </style>
+        </head>
+        <body>
+    """
+
+    if query_type == "image":
+        html_content += f'<h1 class="query-title">Resultados de la Búsqueda por Imagen</h1>'
+    elif query_type == "text":
+        html_content += f'<h1 class="query-title">Resultados de la Búsqueda por Texto</h1>'
+        html_content += f'<p class="query-title">Texto de la Consulta: {query_text}</p>'
+
+    html_content += f'<p class="dist-indices">Puntuaciones: {[round(score, 4) for _, score in results]}</p>'
+    html_content += '<div class="container">'
+    for image_path, _ in results:
+        try:
+            thumbnail = thumbnail_store.get_or_create(image_path)
+            encoded_image = f"data:image/jpeg;base64,{base64.b64encode(thumbnail).decode()}"
+            html_content += f"""
+                <div class="image-item">
+                    <a href="file:///{image_path}">
+                        <img src="{encoded_image}" alt="Imagen" />
+                    </a>
+                    <br>
+                </div>
+            """
+        except Exception as e:
+            logging.error(f"No se pudo crear la miniatura para la imagen {image_path} : {e}")
+            html_content += f"""
+                <div class="image-item">
+                    <a href="file:///{image_path}">
+                        <span>Imagen No Disponible</span>
+                    </a>
+                    <br>
+                </div>
+            """
+    html_content += '</div></body></html>'
+    return html_content
+
+
+def file_sha256(file_path: str) -> str:
+    """Hash SHA-256 del contenido de un archivo, leído por bloques."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_files(file_paths: List[str], num_threads: Optional[int] = None) -> Dict[str, str]:
+    """Calcula en paralelo el SHA-256 de cada archivo; los que no se pueden leer no aparecen en el resultado.
+
+    hashlib libera el GIL con bloques grandes, así que los hilos aprovechan varios núcleos y solapan la lectura.
+    """
+    def digest(path):
+        try:
+            return path, file_sha256(path)
+        except OSError as e:
+            logging.warning(f"No se pudo leer la imagen: {path}. Error: {e}")
+            return path, None
+
+    num_threads = num_threads or min(8, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=num_threads, thread_name_prefix="hash") as executor:
+        return {path: sha for path, sha in executor.map(digest, file_paths) if sha is not None}
+
+
+class EmbeddingStore:
+    """Almacén persistente de vectores de imagen indexado por el hash del contenido y el modelo.
+
+    Lo comparten todos los directorios, fragmentos y reindexaciones: una imagen ya codificada con el
+    mismo modelo y precisión (`namespace`) no vuelve a pasar por el modelo aunque se copie, se mueva,
+    se renombre o se reconstruya su índice. Se guarda en SQLite (modo WAL) y la conexión se abre
+    en el primer uso.
+    """
+
+    # SQLite admite un número limitado de parámetros por consulta.
+    QUERY_CHUNK = 500
+
+    def __init__(self, file_path: str, namespace: str):
+        self.file_path = file_path
+        self.namespace = namespace
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.file_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.file_path, timeout=30, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS embeddings (sha256 TEXT NOT NULL, model TEXT NOT NULL, "
+                               "vector BLOB NOT NULL, PRIMARY KEY (sha256, model)) WITHOUT ROWID")
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def get_many(self, hashes: Iterable[str], dim: int) -> Dict[str, np.ndarray]:
+        """Devuelve los vectores almacenados de los hashes dados (se omiten los de otra dimensión)."""
+        hashes = list(dict.fromkeys(hashes))
+        found = {}
+        with self._lock:
+            connection = self.connection()
+            for start in range(0, len(hashes), self.QUERY_CHUNK):
+                chunk = hashes[start:start + self.QUERY_CHUNK]
+                rows = connection.execute(
+                    f"SELECT sha256, vector FROM embeddings WHERE model = ? AND sha256 IN ({','.join('?' * len(chunk))})",
+                    [self.namespace, *chunk])
+                for sha, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    if vector.shape[0] == dim:
+                        found[sha] = vector
+        return found
+
+    def put_many(self, items: Iterable[Tuple[str, np.ndarray]]):
+        rows = [(sha, self.namespace, np.ascontiguousarray(vector, dtype=np.float32).tobytes()) for sha, vector in items]
+        if not rows:
+            return
+        with self._lock:
+            connection = self.connection()
+            with connection:
+                connection.executemany("INSERT OR REPLACE INTO embeddings (sha256, model, vector) VALUES (?, ?, ?)", rows)
+
+    def count(self) -> int:
+        """Número de vectores almacenados para el modelo actual."""
+        with self._lock:
+            return self.connection().execute("SELECT COUNT(*) FROM embeddings WHERE model = ?",
+                                             [self.namespace]).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class QueryEmbeddingCache:
+    """Caché LRU de vectores de consulta (texto e imagen) con tamaño acotado.
+
+    Las entradas pertenecen a un espacio de nombres (modelo y precisión); al cargar una caché
+    guardada con otro espacio de nombres se descarta su contenido.
+    """
+
+    def __init__(self, namespace: str, max_entries: int = 1024, file_path: Optional[str] = None):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.file_path = file_path
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def text_key(text: str) -> str:
+        """Clave de un texto: espacios colapsados y minúsculas (el tokenizador de CLIP ya lo normaliza así)."""
+        return "text:" + " ".join(text.split()).lower()
+
+    @staticmethod
+    def image_key(image_path: str) -> str:
+        """Clave de una imagen: hash SHA-256 de su contenido."""
+        return "image:" + file_sha256(image_path)
+
+    @staticmethod
+    def image_bytes_key(data: bytes) -> str:
+        """Clave de una imagen recibida en memoria; coincide con la de `image_key` para el mismo contenido."""
+        return "image:" + hashlib.sha256(data).hexdigest()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            feature = self._entries.get(key)
+            if feature is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return feature
+
+    def put(self, key: str, feature: np.ndarray):
+        with self._lock:
+            self._entries[key] = np.asarray(feature, dtype=np.float32)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def save(self):
+        """Guarda la caché en disco de forma atómica, si tiene archivo asociado."""
+        if not self.file_path:
+            return
+        with self._lock:
+            keys = list(self._entries)
+            features = np.stack([self._entries[key] for key in keys]) if keys else np.zeros((0, 0), np.float32)
+
+        def writer(tmp_path):
+            with open(tmp_path, "wb") as f:
+                np.savez(f, namespace=np.array(self.namespace), keys=np.array(keys, dtype=str), features=features)
+
+        atomic_write(self.file_path, writer)
+
+    def load(self):
+        """Carga la caché guardada si corresponde al mismo modelo y precisión."""
+        if not self.file_path or not os.path.exists(self.file_path):
+            return
+        try:
+            with np.load(self.file_path, allow_pickle=False) as data:
+                if str(data["namespace"]) != self.namespace:
+                    logging.info("La caché de consultas pertenece a otro modelo o precisión. Se descarta.")
+                    return
+                keys = data["keys"].tolist()
+                features = data["features"]
+        except (OSError, KeyError, ValueError) as e:
+            logging.warning(f"No se pudo leer la caché de consultas: {e}")
+            return
+        with self._lock:
+            for key, feature in zip(keys[-self.max_entries:], features[-self.max_entries:]):
+                self._entries[key] = feature
+
+
+def choose_index_type(num_vectors: int) -> str:
+    """Elige el tipo de índice según el tamaño de la colección."""
+    if num_vectors < 100_000:
+        return "flat"
+    if num_vectors < 2_000_000:
+        return "ivf_flat"
+    return "ivf_pq"
+
+
+def ivf_nlist(num_vectors: int) -> int:
+    """Número de listas invertidas recomendado (~4·√n) para un índice IVF."""
+    return int(min(65536, max(16, 4 * math.sqrt(num_vectors))))
+
+
+def scalar_quantizer_type(compression: str):
+    import faiss
+    return faiss.ScalarQuantizer.QT_fp16 if compression == "fp16" else faiss.ScalarQuantizer.QT_8bit
+
+
+def needs_training(index_type: str, compression: str) -> bool:
+    """Los índices IVF y los cuantificadores sq8/pq se entrenan con una muestra de los vectores."""
+    return index_type in ("ivf_flat", "ivf_pq") or compression in ("sq8", "pq")
+
+
+def effective_compression(index_type: str, compression: str, num_vectors: int) -> str:
+    """Compresión con la que build_ann_index guarda realmente los vectores.
+
+    `ivf_pq` siempre usa PQ y PQ con 8 bits necesita al menos 256 vectores de entrenamiento;
+    por debajo se usa sq8.
+    """
+    if index_type == "ivf_pq":
+        return "pq"
+    if compression == "pq" and num_vectors < 256:
+        return "sq8"
+    return compression
+
+
+def build_ann_index(index_type: str, dim: int, vectors: np.ndarray, ids: np.ndarray,
+                    training_sample_size: Optional[int] = None, chunk_size: int = 65536,
+                    compression: str = "none"):
+    """Construye un índice del tipo indicado con los vectores (ya normalizados) de los IDs dados.
+
+    `vectors` se indexa por ID (puede ser un np.memmap) y solo se leen las filas de `ids`.
+    Los índices IVF se entrenan con una muestra aleatoria de los vectores. `compression` guarda
+    los vectores del índice en float16 (`fp16`, 2×), con cuantificación escalar de 8 bits (`sq8`, 4×)
+    o por producto (`pq`, dim/8 bytes por vector); `ivf_pq` ya usa PQ.
+    """
+    import faiss
+    num_vectors = len(ids)
+    if index_type in ("ivf_flat", "ivf_pq") and num_vectors < 1000:
+        logging.info(f"Muy pocas imágenes ({num_vectors}) para un índice {index_type}. Se usará 'flat'.")
+        index_type = "flat"
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Compresión desconocida: {compression}")
+    if index_type == "ivf_flat" and compression == "pq":
+        index_type = "ivf_pq"
+    compression = effective_compression(index_type, compression, num_vectors)
+
+    if index_type == "flat":
+        if compression == "none":
+            base = faiss.IndexFlatIP(dim)
+        elif compression == "pq":
+            base = faiss.IndexPQ(dim, dim // 8, 8, faiss.METRIC_INNER_PRODUCT)
+        else:
+            base = faiss.IndexScalarQuantizer(dim, scalar_quantizer_type(compression), faiss.METRIC_INNER_PRODUCT)
+        index = faiss.IndexIDMap2(base)
+    elif index_type == "hnsw":
+        if compression == "none":
+            hnsw = faiss.IndexHNSWFlat(dim, 32, faiss.METRIC_INNER_PRODUCT)
+        elif compression == "pq":
+            hnsw = faiss.IndexHNSWPQ(dim, dim // 8, 32, 8, faiss.METRIC_INNER_PRODUCT)
+        else:
+            hnsw = faiss.IndexHNSWSQ(dim, scalar_quantizer_type(compression), 32, faiss.METRIC_INNER_PRODUCT)
+        hnsw.hnsw.efConstruction = 80
+        index = faiss.IndexIDMap2(hnsw)
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        nlist = min(ivf_nlist(num_vectors), num_vectors // 39)
+        quantizer = faiss.IndexFlatIP(dim)
+        if index_type == "ivf_pq":
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, dim // 8, 8, faiss.METRIC_INNER_PRODUCT)
+        elif compression == "none":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, scalar_quantizer_type(compression),
+                                                  faiss.METRIC_INNER_PRODUCT)
+    else:
+        raise ValueError(f"Tipo de índice desconocido: {index_type}")
+
+    if needs_training(index_type, compression) and num_vectors:
+        nlist = index.nlist if index_type in ("ivf_flat", "ivf_pq") else 0
+        sample_size = min(num_vectors, training_sample_size or max(nlist * 64, 10000))
+        sample_ids = np.sort(np.random.default_rng(0).choice(ids, size=sample_size, replace=False))
+        logging.info(f"Entrenando índice {index_type} ({compression}) con {sample_size} vectores...")
+        index.train(np.ascontiguousarray(vectors[sample_ids], dtype=np.float32))
+
+    for start in range(0, num_vectors, chunk_size):
+        chunk_ids = ids[start:start + chunk_size]
+        index.add_with_ids(np.ascontiguousarray(vectors[chunk_ids], dtype=np.float32), chunk_ids)
+    return index
+
+
+def index_type_of(index) -> str:
+    """Deduce el tipo de un índice construido con build_ann_index."""
+    import faiss
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    if isinstance(base, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(base, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(base, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def index_compression_of(index) -> str:
+    """Deduce cómo guarda los vectores un índice construido con build_ann_index."""
+    import faiss
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    if isinstance(base, faiss.IndexHNSW):
+        base = faiss.downcast_index(base.storage)
+    if isinstance(base, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return "pq"
+    if isinstance(base, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return "fp16" if base.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    return "none"
+
+
+def rerank_exact(query_features: np.ndarray, candidate_ids: np.ndarray, vectors: np.ndarray,
+                 k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Reordena los candidatos por el producto escalar exacto con los vectores originales y deja los `k` mejores.
+
+    `vectors` puede ser un np.memmap: solo se leen las filas de los candidatos, en orden de ID.
+    Los huecos (ID -1) quedan al final con puntuación -inf.
+    """
+    valid = candidate_ids >= 0
+    unique_ids, inverse = np.unique(candidate_ids[valid], return_inverse=True)
+    rows = np.asarray(vectors[unique_ids], dtype=np.float32)
+    scores = np.full(candidate_ids.shape, -np.inf, dtype=np.float32)
+    query_rows = np.nonzero(valid)[0]
+    scores[valid] = np.einsum("ij,ij->i", rows[inverse], query_features[query_rows])
+    order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+    top_scores = np.take_along_axis(scores, order, axis=1)
+    top_ids = np.where(np.isfinite(top_scores), np.take_along_axis(candidate_ids, order, axis=1), -1)
+    return top_scores, top_ids
+
+
+def search_exact(query_features: np.ndarray, vectors: np.ndarray, ids: np.ndarray, k: int,
+                 chunk_size: int = 16384) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k exacto de las consultas entre las filas `ids` (ordenados) de `vectors`, por bloques.
+
+    `vectors` puede ser un np.memmap: solo se leen las filas de `ids`. Si hay menos de `k`
+    filas, los huecos quedan al final con puntuación -inf e ID -1.
+    """
+    num_queries = len(query_features)
+    best_scores = np.zeros((num_queries, 0), dtype=np.float32)
+    best_ids = np.zeros((num_queries, 0), dtype=np.int64)
+    for start in range(0, len(ids), chunk_size):
+        chunk_ids = ids[start:start + chunk_size]
+        scores = query_features @ np.asarray(vectors[chunk_ids], dtype=np.float32).T
+        best_scores = np.concatenate([best_scores, scores], axis=1)
+        best_ids = np.concatenate([best_ids, np.broadcast_to(chunk_ids, scores.shape)], axis=1)
+        if best_scores.shape[1] > k:
+            top = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(best_scores, top, axis=1)
+            best_ids = np.take_along_axis(best_ids, top, axis=1)
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    best_scores = np.take_along_axis(best_scores, order, axis=1)
+    best_ids = np.take_along_axis(best_ids, order, axis=1)
+    if best_ids.shape[1] < k:
+        pad = k - best_ids.shape[1]
+        best_scores = np.pad(best_scores, ((0, 0), (0, pad)), constant_values=-np.inf)
+        best_ids = np.pad(best_ids, ((0, 0), (0, pad)), constant_values=-1)
+    return best_scores, best_ids
+
+
+def apply_search_params(index, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """Aplica `nprobe` (IVF) o `efSearch` (HNSW) si el índice admite el parámetro."""
+    import faiss
+    params = faiss.ParameterSpace()
+    index_type = index_type_of(index)
+    if nprobe and index_type in ("ivf_flat", "ivf_pq"):
+        params.set_index_parameter(index, "nprobe", nprobe)
+    if ef_search and index_type == "hnsw":
+        params.set_index_parameter(index, "efSearch", ef_search)
+
+
+def selector_search_params(index, selector, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """Parámetros de búsqueda que limitan el índice a los IDs aceptados por `selector`.
+
+    Sustituyen a los parámetros del índice, así que llevan también `nprobe` o `efSearch`.
+    Devuelve None si el índice no admite selectores (PQ plano).
+    """
+    import faiss
+    index_type = index_type_of(index)
+    if index_type in ("ivf_flat", "ivf_pq"):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=nprobe or faiss.extract_index_ivf(index).nprobe)
+    if index_type == "hnsw":
+        ef_search = ef_search or faiss.downcast_index(index.index).hnsw.efSearch
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=ef_search)
+    if index_compression_of(index) == "pq":
+        return None
+    return faiss.SearchParameters(sel=selector)
+
+
+class UnionFind:
+    """Conjuntos disjuntos sobre los enteros 0..n-1 (compresión de caminos y unión por tamaño)."""
+
+    def __init__(self, size: int):
+        self.parent = np.arange(size, dtype=np.int64)
+        self.size = np.ones(size, dtype=np.int64)
+
+    def find(self, x: int) -> int:
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[x] != root:
+            self.parent[x], x = root, self.parent[x]
+        return int(root)
+
+    def union(self, a: int, b: int):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return
+        if self.size[root_a] < self.size[root_b]:
+            root_a, root_b = root_b, root_a
+        self.parent[root_b] = root_a
+        self.size[root_a] += self.size[root_b]
+
+
+def evaluate_index_types(vectors: np.ndarray, k: int = 10, num_queries: int = 1000,
+                         configs: Optional[List[Tuple[str, dict]]] = None) -> List[dict]:
+    """Mide recall@k frente a la búsqueda exhaustiva, la latencia por consulta y los bytes por vector.
+
+    Las consultas son vectores de la colección que se excluyen de la base indexada. Los parámetros
+    de cada configuración admiten `compression` y `rerank_factor` (reordenación exacta de
+    `rerank_factor`·k candidatos con los vectores originales).
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    num_queries = min(num_queries, len(vectors) // 10)
+    if num_queries == 0:
+        raise ValueError("La colección es demasiado pequeña para evaluar los índices.")
+
+    rng = np.random.default_rng(0)
+    query_ids = rng.choice(len(vectors), size=num_queries, replace=False)
+    base_mask = np.ones(len(vectors), dtype=bool)
+    base_mask[query_ids] = False
+    base_ids = np.flatnonzero(base_mask).astype(np.int64)
+    queries = vectors[query_ids]
+
+    if configs is None:
+        configs = [("flat", {})]
+        configs += [(t, {"nprobe": n}) for t in ("ivf_flat", "ivf_pq") for n in (1, 4, 16, 64)]
+        configs += [("hnsw", {"ef_search": ef}) for ef in (16, 32, 64, 128)]
+        configs += [("flat", {"compression": c, "rerank_factor": r}) for c in ("fp16", "sq8", "pq") for r in (1, 4)]
+        configs += [("ivf_pq", {"nprobe": 16, "rerank_factor": 4})]
+
+    ground_truth = build_ann_index("flat", vectors.shape[1], vectors, base_ids)
+    _, expected = ground_truth.search(queries, k)
+
+    report = []
+    built = {}
+    for index_type, params in configs:
+        key = (index_type, params.get("compression", "none"))
+        if key not in built:
+            start = time.perf_counter()
+            built[key] = (build_ann_index(index_type, vectors.shape[1], vectors, base_ids, compression=key[1]),
+                          time.perf_counter() - start)
+        index, build_seconds = built[key]
+        apply_search_params(index, params.get("nprobe"), params.get("ef_search"))
+        rerank_factor = params.get("rerank_factor")
+        num_candidates = min(index.ntotal, k * rerank_factor) if rerank_factor else k
+
+        latencies = []
+        found = np.empty((num_queries, k), dtype=np.int64)
+        for i in range(num_queries):
+            start = time.perf_counter()
+            _, candidate_ids = index.search(queries[i:i + 1], num_candidates)
+            if rerank_factor:
+                _, candidate_ids = rerank_exact(queries[i:i + 1], candidate_ids, vectors, k)
+            found[i:i + 1] = candidate_ids[:, :k]
+            latencies.append(time.perf_counter() - start)
+
+        hits = sum(len(set(found[i]) & set(expected[i])) for i in range(num_queries))
+        report.append({
+            "index_type": index_type_of(index),
+            "params": params,
+            "recall_at_k": hits / (num_queries * k),
+            "p50_ms": float(np.percentile(latencies, 50) * 1000),
+            "p99_ms": float(np.percentile(latencies, 99) * 1000),
+            "build_s": build_seconds,
+            "bytes_per_vector": index_bytes(index) / max(index.ntotal, 1),
+        })
+    return report
+
+
+def index_bytes(index) -> int:
+    """Tamaño serializado del índice, aproximación de la memoria que ocupa la estructura de búsqueda."""
+    import faiss
+    return int(faiss.serialize_index(index).nbytes)
+
+
+class IndexingError(Exception):
+    """Error que impide indexar el directorio de imágenes."""
+
+
+class IndexingCancelled(IndexingError):
+    """La indexación se canceló; lo ya procesado queda en un punto de control desde el que se reanuda."""
+
+
+def has_images(directory: str, recursive: bool) -> bool:
+    """Indica si el directorio contiene alguna imagen; se detiene en la primera que encuentra."""
+    pending = [directory]
+    while pending:
+        try:
+            with os.scandir(pending.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive and not entry.name.startswith("."):
+                            pending.append(entry.path)
+                    elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                        return True
+        except OSError:
+            continue
+    return False
+
+
+def shard_dir_name(image_dir: str, recursive: bool) -> str:
+    """Nombre estable del directorio en el que se guarda el fragmento de un subárbol."""
+    return hashlib.sha1(f"{image_dir}|{int(recursive)}".encode("utf-8")).hexdigest()[:16]
+
+
+class IndexShard:
+    """Índice FAISS de un subárbol de imágenes, guardado en su propio directorio.
+
+    Cada directorio raíz se reparte en un fragmento con sus imágenes sueltas y un fragmento
+    recursivo por subdirectorio, así que un cambio en una carpeta solo actualiza su fragmento.
+    El modelo, la configuración y las notificaciones son los del motor (`engine`).
+    """
+
+    def __init__(self, engine: "ImageSearchEngine", image_dir: str, recursive: bool, index_dir: str):
+        self.engine = engine
+        self.image_dir = image_dir
+        self.recursive = recursive
+        self.index_dir = index_dir
+        self.header_file = os.path.join(index_dir, os.path.basename(INDEX_HEADER_FILE))
+        self.index = None
+        self.image_paths = None
+        self.attributes = None
+        self.index_metadata = {}
+        # Ruta -> ID del vector de cada imagen indexada; se guarda en el manifiesto.
+        self.path_ids: Dict[str, int] = {}
+        self.vector_store = None
+        self.index_type = "flat"
+        self.compression = "none"
+        self.trained_size = 0
+        self.files: Dict[str, Optional[str]] = {}
+        # Archivos de la generación que el fragmento sustituido sigue usando en las búsquedas en curso;
+        # no se borran al guardar y desaparecen en el guardado siguiente.
+        self.retained_files: Set[str] = set()
+
+    def contains(self, path: str) -> bool:
+        """Indica si una ruta (archivo o directorio) pertenece al subárbol del fragmento."""
+        root = os.path.abspath(self.image_dir)
+        path = os.path.abspath(path)
+        parent = os.path.dirname(path)
+        if self.recursive:
+            return path == root or parent == root or parent.startswith(root + os.sep)
+        return parent == root
+
+    def refresh(self):
+        """Deja el fragmento al día: lo carga si es válido, lo actualiza o lo reconstruye."""
+        if self.is_index_valid():
+            stored_data = self.read_stored_index()
+            if stored_data is not None and self.apply_stored_index(stored_data):
+                return
+        if self.can_update_incrementally():
+            self.update_index_incremental()
+        else:
+            self.index_images()
+
+    def scan_image_dir(self) -> Dict[str, Tuple[int, int]]:
+        """Obtiene el manifiesto (tamaño, mtime_ns) de las imágenes del fragmento con os.scandir.
+
+        Si el fragmento es recursivo se recorren también sus subdirectorios (sin seguir enlaces simbólicos).
+        """
+        start = time.perf_counter()
+        manifest = {}
+        pending = [self.image_dir]
+        while pending:
+            directory = pending.pop()
+            try:
+                entries = list(os.scandir(directory))
+            except OSError as e:
+                if directory == self.image_dir:
+                    raise
+                logging.warning(f"No se pudo leer el directorio: {directory}. Será ignorado. Error: {e}")
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if self.recursive and not entry.name.startswith("."):
+                            pending.append(entry.path)
+                        continue
+                    if not entry.name.lower().endswith(IMAGE_EXTENSIONS) or not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except OSError as e:
+                    logging.warning(f"No se pudo leer la imagen: {entry.path}. Será ignorada. Error: {e}")
+                    continue
+                manifest[entry.path] = (stat.st_size, stat.st_mtime_ns)
+        self.engine.metrics.record("scan", time.perf_counter() - start, len(manifest))
+        return manifest
+
+    def diff_metadata(self, stored_metadata: Dict[str, Tuple[int, int]],
+                      current_metadata: Dict[str, Tuple[int, int]]) -> Tuple[List[str], List[str], List[str]]:
+        """Compara los manifiestos almacenado y actual y devuelve (nuevas, eliminadas, modificadas)."""
+        stored_keys = stored_metadata.keys()
+        current_keys = current_metadata.keys()
+        added = sorted(current_keys - stored_keys)
+        removed = sorted(stored_keys - current_keys)
+        modified = sorted(p for p in current_keys & stored_keys if current_metadata[p] != stored_metadata[p])
+        return added, removed, modified
+
+    def read_index_header(self) -> Optional[dict]:
+        """Lee la cabecera del índice y su manifiesto sin cargar los vectores."""
+        try:
+            with open(self.header_file, "r", encoding="utf-8") as f:
+                header = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError) as e:
+            logging.warning(f"No se encontró la cabecera del índice o está corrupta: {e}")
+            return None
+
+        if header.get("version") != INDEX_FORMAT_VERSION:
+            logging.info("El formato del índice almacenado es antiguo. Es necesario reindexar.")
+            return None
+
+        try:
+            header["metadata"], header["path_ids"] = load_manifest(
+                os.path.join(self.index_dir, header["files"]["manifest"]))
+        except (OSError, KeyError, ValueError) as e:
+            logging.warning(f"No se pudo leer el manifiesto del índice: {e}")
+            return None
+        return header
+
+    def read_stored_index(self, writable: bool = False) -> Optional[dict]:
+        """Lee la cabecera, el índice FAISS y las tablas de rutas y atributos almacenados.
+
+        El índice se mapea en memoria salvo que se vaya a modificar (`writable`): las listas
+        invertidas mapeadas son de solo lectura. Un punto de control de una indexación interrumpida
+        no incluye el índice FAISS, que se reconstruye (plano) desde el archivo de vectores.
+        """
+        import faiss
+        header = self.read_index_header()
+        if header is None:
+            return None
+        try:
+            files = header["files"]
+            header["image_paths"] = PathTable.load(os.path.join(self.index_dir, files["paths"]))
+            header["attributes"] = AttributeTable.load(os.path.join(self.index_dir, files["attributes"]))
+            header["vector_store"] = VectorStore.open(os.path.join(self.index_dir, files["vectors"]),
+                                                      self.engine.feature_dim, header["num_rows"])
+            if files["index"] is None:
+                ids = np.flatnonzero(header["image_paths"].live_mask()).astype(np.int64)
+                header["index"] = build_ann_index("flat", self.engine.feature_dim, header["vector_store"].array(), ids)
+                header["index_type"] = "flat"
+                header["compression"] = "none"
+                header["trained_size"] = 0
+            else:
+                io_flags = 0 if writable else faiss.IO_FLAG_MMAP
+                header["index"] = faiss.read_index(os.path.join(self.index_dir, files["index"]), io_flags)
+        except (OSError, KeyError, ValueError, RuntimeError) as e:
+            logging.warning(f"No se encontró el archivo del índice o está corrupto: {e}")
+            return None
+        return header
+
+    def can_update_incrementally(self) -> bool:
+        """Indica si existe un índice almacenado para el directorio actual que pueda actualizarse.
+
+        Los vectores de distintas precisiones no se mezclan: si cambia la precisión se reindexa todo.
+        """
+        header = self.read_index_header()
+        return bool(header) and self.matches_source(header) and self.engine.matches_model(header)
+
+    def matches_source(self, header: dict) -> bool:
+        """Comprueba que el índice almacenado corresponde al mismo directorio y modo de recorrido."""
+        return header.get("image_dir", "") == self.image_dir and header.get("recursive", False) == self.recursive
+
+    def is_index_valid(self):
+        """Verifica si el índice almacenado es válido para el directorio de imágenes actual.
+
+        Solo se lee la cabecera y se compara el manifiesto con el resultado de os.scandir,
+        sin abrir ninguna imagen ni cargar los vectores.
+        """
+        header = self.read_index_header()
+        if header is None:
+            return False
+
+        stored_metadata = header.get("metadata", {})
+
+        if not stored_metadata or not self.matches_source(header):
+            logging.info("El directorio de imágenes ha cambiado o no hay metadatos almacenados.")
+            return False
+
+        if not header.get("complete", True):
+            logging.info("La última indexación se interrumpió. Se reanudará desde el último punto de control.")
+            return False
+
+        if not self.engine.matches_model(header):
+            return False
+
+        configured_type = self.engine.config.get("index_type", "auto")
+        if configured_type in INDEX_TYPES and configured_type != header.get("index_type"):
+            logging.info(f"El tipo de índice configurado ({configured_type}) no coincide con el almacenado.")
+            return False
+
+        compression = effective_compression(header.get("index_type"), self.resolve_compression(),
+                                            header.get("num_vectors", 0))
+        if compression != header.get("compression", "none"):
+            logging.info(f"La compresión configurada ({compression}) no coincide con la almacenada.")
+            return False
+
+        try:
+            current_metadata = self.scan_image_dir()
+        except OSError as e:
+            logging.warning(f"No se pudo leer el directorio de imágenes: {e}")
+            return False
+
+        added, removed, modified = self.diff_metadata(stored_metadata, current_metadata)
+        if added or removed or modified:
+            logging.info(f"Los metadatos de las imágenes han cambiado. Nuevas: {len(added)}, "
+                         f"eliminadas: {len(removed)}, modificadas: {len(modified)}")
+            return False
+
+        logging.info("El índice es válido y está actualizado.")
+        return True
+
+    def apply_stored_index(self, stored_data: dict) -> bool:
+        """Carga en memoria los datos leídos del índice y comprueba su consistencia."""
+        self.index = stored_data.get("index")
+        self.image_paths = stored_data.get("image_paths")
+        self.attributes = stored_data.get("attributes")
+        self.index_metadata = stored_data.get("metadata")
+        self.path_ids = stored_data.get("path_ids")
+        self.vector_store = stored_data.get("vector_store")
+        self.index_type = stored_data.get("index_type", "flat")
+        self.compression = stored_data.get("compression", "none")
+        self.trained_size = stored_data.get("trained_size", 0)
+        self.files = stored_data.get("files", {})
+
+        if (self.index is None or self.image_paths is None or self.attributes is None or self.index_metadata is None
+                or self.path_ids is None or self.vector_store is None):
+            logging.error("Los datos del índice están incompletos o son inválidos. Reindexando...")
+            self.reset_index()
+            return False
+
+        if self.index.ntotal != self.count_indexed_images():
+            logging.error(
+                f"Inconsistencia en el índice: Número de imágenes ({self.count_indexed_images()}) no coincide con el número de vectores en el índice ({self.index.ntotal}). Reindexando...")
+            self.reset_index()
+            return False
+
+        if self.vector_store.num_rows != len(self.image_paths) or len(self.attributes) != len(self.image_paths):
+            logging.error("Inconsistencia entre el archivo de vectores, la tabla de rutas y la de atributos. Reindexando...")
+            self.reset_index()
+            return False
+
+        if len(self.path_ids) != self.index.ntotal:
+            logging.error("Inconsistencia entre los IDs del manifiesto y el índice. Reindexando...")
+            self.reset_index()
+            return False
+
+        apply_search_params(self.index, self.engine.config.get("nprobe"), self.engine.config.get("ef_search"))
+        return True
+
+    def reset_index(self):
+        """Descarta el índice cargado en memoria."""
+        self.index = None
+        self.image_paths = None
+        self.attributes = None
+        self.index_metadata = {}
+        self.path_ids = {}
+        self.vector_store = None
+
+    def new_index(self):
+        """Crea un índice plano vacío y un nuevo archivo de vectores; los vectores se identifican por un ID estable."""
+        import faiss
+        os.makedirs(self.index_dir, exist_ok=True)
+        self.vector_store = VectorStore.create(os.path.join(self.index_dir, f"vectors-{time.time_ns():x}.f32"),
+                                               self.engine.feature_dim)
+        self.index_type = "flat"
+        self.compression = "none"
+        self.trained_size = 0
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(self.engine.feature_dim))
+
+    def resolve_index_type(self) -> str:
+        """Tipo de índice configurado, o el elegido automáticamente según el tamaño de la colección."""
+        index_type = self.engine.config.get("index_type", "auto")
+        if index_type == "auto":
+            return choose_index_type(self.count_indexed_images())
+        if index_type not in INDEX_TYPES:
+            logging.warning(f"Tipo de índice desconocido '{index_type}'. Se usará la selección automática.")
+            return choose_index_type(self.count_indexed_images())
+        return index_type
+
+    def resolve_compression(self) -> str:
+        """Compresión configurada de los vectores del índice."""
+        compression = self.engine.config.get("vector_compression") or "none"
+        if compression not in COMPRESSIONS:
+            logging.warning(f"Compresión desconocida '{compression}'. Se guardarán los vectores sin comprimir.")
+            return "none"
+        return compression
+
+    def is_lossy(self) -> bool:
+        """Indica si el índice guarda los vectores con pérdida y sus puntuaciones deben recalcularse."""
+        return self.compression != "none"
+
+    def search(self, query_features: np.ndarray, k: int,
+               image_filter: Optional[ImageFilter] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Busca en el índice del fragmento; si comprime los vectores, reordena con los originales.
+
+        Con un índice comprimido se piden `rerank_factor`·k candidatos y sus puntuaciones se
+        recalculan con los vectores exactos del archivo mapeado en memoria, así que el top-k final
+        y sus puntuaciones coinciden con los de un índice sin comprimir salvo que algún vecino
+        quede fuera de los candidatos. Con `image_filter` solo se consideran las imágenes que lo cumplen.
+        """
+        if image_filter is not None:
+            return self.search_filtered(query_features, k, image_filter)
+        return self.search_index(query_features, k)
+
+    def search_filtered(self, query_features: np.ndarray, k: int,
+                        image_filter: ImageFilter) -> Tuple[np.ndarray, np.ndarray]:
+        """Busca solo entre las imágenes que cumplen el filtro y devuelve k resultados si hay al menos k.
+
+        El filtro se evalúa sobre las columnas de atributos como una máscara por ID. Si la cumplen
+        pocas imágenes (`filter_exact_limit`), sus vectores se comparan directamente con las consultas;
+        si no, la máscara se pasa a FAISS como un IDSelectorBitmap y el índice descarta el resto de
+        IDs durante la búsqueda. Si el índice aproximado devuelve menos de k resultados (sondeo IVF
+        o grafo HNSW demasiado restringidos), se recurre a la comparación directa.
+        """
+        import faiss
+        start = time.perf_counter()
+        mask = image_filter.mask(self.attributes) & self.image_paths.live_mask()
+        ids = np.flatnonzero(mask)
+        self.engine.metrics.record("filter_mask", time.perf_counter() - start, len(ids))
+        expected = min(k, len(ids))
+        params = None
+        if len(ids) > int(self.engine.config.get("filter_exact_limit") or 0):
+            bitmap = np.packbits(mask, bitorder="little")
+            selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))
+            params = selector_search_params(self.index, selector, self.engine.config.get("nprobe"),
+                                            self.engine.config.get("ef_search"))
+        if params is not None:
+            scores, result_ids = self.search_index(query_features, k, params)
+            if expected == 0 or (result_ids[:, expected - 1] >= 0).all():
+                return scores, result_ids
+            self.engine.metrics.increment("filter_exact_fallbacks")
+        with self.engine.metrics.time("filter_exact_search", len(query_features)):
+            return search_exact(query_features, self.vector_store.array(), ids, k)
+
+    def search_index(self, query_features: np.ndarray, k: int, params=None) -> Tuple[np.ndarray, np.ndarray]:
+        """Consulta el índice FAISS (con `params` opcionales) y reordena los candidatos si comprime los vectores."""
+        if not self.is_lossy():
+            return self.index.search(query_features, k, params=params)
+        factor = max(1, int(self.engine.config.get("rerank_factor") or 1))
+        num_candidates = min(self.index.ntotal, k * factor)
+        _, candidate_ids = self.index.search(query_features, num_candidates, params=params)
+        start = time.perf_counter()
+        scores, ids = rerank_exact(query_features, candidate_ids, self.vector_store.array(), k)
+        self.engine.metrics.record("rerank", time.perf_counter() - start, len(query_features))
+        if ids.shape[1] < k:
+            pad = k - ids.shape[1]
+            scores = np.pad(scores, ((0, 0), (0, pad)), constant_values=-np.inf)
+            ids = np.pad(ids, ((0, 0), (0, pad)), constant_values=-1)
+        return scores, ids
+
+    def finalize_index(self, force_rebuild: bool = False):
+        """Reconstruye el índice desde el archivo de vectores si cambia el tipo elegido o si está desactualizado.
+
+        Un índice IVF se vuelve a entrenar cuando la colección ha crecido o menguado mucho
+        respecto a la muestra con la que se entrenó.
+        """
+        index_type = self.resolve_index_type()
+        count = self.count_indexed_images()
+        compression = effective_compression(index_type, self.resolve_compression(), count)
+        retrain = (needs_training(index_type, compression)
+                   and not (self.trained_size / 4 <= count <= self.trained_size * 4))
+        if not (force_rebuild or retrain or index_type != self.index_type or compression != self.compression):
+            return
+
+        ids = np.array([i for i, path in enumerate(self.image_paths) if path is not None], dtype=np.int64)
+        self.engine.status_callback(f"Construyendo índice {index_type}...", "red")
+        self.index = build_ann_index(index_type, self.engine.feature_dim, self.vector_store.array(), ids,
+                                     compression=compression)
+        self.index_type = index_type_of(self.index)
+        self.compression = index_compression_of(self.index)
+        self.trained_size = count if needs_training(self.index_type, self.compression) else 0
+        apply_search_params(self.index, self.engine.config.get("nprobe"), self.engine.config.get("ef_search"))
+        logging.info(f"Índice reconstruido como '{self.index_type}' ({self.compression}) con {self.index.ntotal} vectores.")
+
+    def count_indexed_images(self) -> int:
+        """Cuenta las imágenes indexadas (las posiciones eliminadas quedan como None)."""
+        return self.image_paths.count() if self.image_paths is not None else 0
+
+    def memory_bytes(self) -> int:
+        """Estimación de la memoria que ocupa el fragmento cargado: índice FAISS, tablas de rutas y atributos y manifiesto.
+
+        El índice y las tablas ocupan aproximadamente lo mismo que sus archivos; el archivo de
+        vectores no cuenta porque se mapea en memoria y el sistema lo libera cuando le hace falta.
+        """
+        if self.index is None:
+            return 0
+        total = len(self.index_metadata) * MANIFEST_ENTRY_BYTES
+        for name, fallback in (("index", self.index.ntotal * self.engine.feature_dim * 4), ("paths", 0), ("attributes", 0)):
+            try:
+                total += os.path.getsize(os.path.join(self.index_dir, self.files[name]))
+            except (KeyError, TypeError, OSError):
+                total += fallback
+        return total
+
+    def save_index(self, checkpoint: bool = False):
+        """Guarda el índice FAISS, las tablas de rutas y atributos y el manifiesto en una nueva generación de archivos.
+
+        La cabecera JSON se reemplaza en último lugar y es la que apunta a la generación vigente,
+        así que una escritura interrumpida nunca deja un índice a medias. Un punto de control
+        (`checkpoint`) omite el índice FAISS: basta con los vectores ya confirmados para reanudar.
+        """
+        import faiss
+        start = time.perf_counter()
+        try:
+            os.makedirs(self.index_dir, exist_ok=True)
+            generation = f"{time.time_ns():x}"
+            files = {
+                "index": None if checkpoint else f"index-{generation}.faiss",
+                "paths": f"paths-{generation}.bin",
+                "attributes": f"attrs-{generation}.bin",
+                "manifest": f"manifest-{generation}.bin",
+                "vectors": os.path.basename(self.vector_store.file_path),
+            }
+            self.vector_store.flush()
+            if not checkpoint:
+                atomic_write(os.path.join(self.index_dir, files["index"]),
+                             lambda tmp_path: faiss.write_index(self.index, tmp_path))
+            self.image_paths.save(os.path.join(self.index_dir, files["paths"]))
+            self.attributes.save(os.path.join(self.index_dir, files["attributes"]))
+            save_manifest(os.path.join(self.index_dir, files["manifest"]), self.index_metadata, self.path_ids)
+
+            header = {
+                "version": INDEX_FORMAT_VERSION,
+                "image_dir": self.image_dir,
+                "recursive": self.recursive,
+                "num_vectors": self.index.ntotal,
+                "num_rows": self.vector_store.num_rows,
+                "index_type": self.index_type,
+                "compression": self.compression,
+                "trained_size": self.trained_size,
+                "model": MODEL_NAME,
+                "precision": self.engine.precision,
+                "complete": not checkpoint,
+                "files": files,
+            }
+
+            def write_header(tmp_path):
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(header, f, indent=2)
+
+            atomic_write(self.header_file, write_header)
+            self.files = files
+            self.remove_stale_index_files({name for name in files.values() if name} | self.retained_files)
+        except Exception as e:
+            logging.error(f"Error al guardar el índice en el archivo: {e}")
+        self.engine.metrics.record("checkpoint" if checkpoint else "save_index", time.perf_counter() - start)
+
+    def remove_stale_index_files(self, current_files: set):
+        """Elimina los archivos de generaciones anteriores del índice."""
+        for name in os.listdir(self.index_dir):
+            if name in current_files or name == os.path.basename(self.header_file):
+                continue
+            try:
+                os.remove(os.path.join(self.index_dir, name))
+            except OSError as e:
+                # En Windows un archivo todavía mapeado no se puede borrar; se reintenta en el próximo guardado.
+                logging.debug(f"No se pudo eliminar el archivo antiguo del índice {name}: {e}")
+
+    def index_images(self):
+        """Indexa todas las imágenes del directorio seleccionado.
+
+        Lanza IndexingError si no contiene imágenes o no se pudo procesar ninguna.
+        """
+        manifest = self.scan_image_dir()
+        image_paths = sorted(manifest)
+        num_images = len(image_paths)
+
+        if num_images == 0:
+            logging.warning(f"No se encontraron imágenes en {self.image_dir}.")
+            raise IndexingError(f"No se encontraron imágenes en {self.image_dir}.")
+
+        self.index = self.new_index()
+        self.image_paths = PathTable()
+        self.attributes = AttributeTable()
+        self.index_metadata = {}
+        self.path_ids = {}
+
+        if not self.embed_and_add(image_paths, manifest):
+            logging.error(f"No se pudieron extraer las características de ninguna imagen de {self.image_dir}.")
+            self.reset_index()
+            raise IndexingError(f"No se pudieron extraer las características de ninguna imagen de {self.image_dir}.")
+
+        self.finalize_index()
+        self.save_index()
+        logging.info(
+            f"Indexación finalizada. Imágenes: {self.count_indexed_images()}, Vectores en el índice: {self.index.ntotal}")
+
+    def update_index_incremental(self):
+        """Actualiza el índice almacenado procesando solo las imágenes nuevas, modificadas o eliminadas."""
+        stored_data = self.read_stored_index(writable=True)
+        if stored_data is None or not self.apply_stored_index(stored_data):
+            self.index_images()
+            return
+
+        manifest = self.scan_image_dir()
+        added, removed, modified = self.diff_metadata(self.index_metadata, manifest)
+        logging.info(f"Actualización incremental. Nuevas: {len(added)}, eliminadas: {len(removed)}, "
+                     f"modificadas: {len(modified)}")
+
+        stale_paths = set(removed) | set(modified)
+        stale_ids = []
+        if stale_paths:
+            # Solo se buscan las rutas cambiadas, sin decodificar la tabla de rutas completa.
+            stale_ids = sorted(self.path_ids.pop(path) for path in stale_paths if path in self.path_ids)
+            if self.index_type != "hnsw":
+                self.index.remove_ids(np.array(stale_ids, dtype=np.int64))
+            for i in stale_ids:
+                self.image_paths[i] = None
+            for path in stale_paths:
+                self.index_metadata.pop(path, None)
+
+        self.embed_and_add(added + modified, manifest)
+
+        # HNSW no admite eliminar vectores: se reconstruye desde el archivo de vectores, sin volver a extraerlos.
+        self.finalize_index(force_rebuild=self.index_type == "hnsw" and bool(stale_ids))
+        self.save_index()
+        logging.info(
+            f"Actualización finalizada. Imágenes: {self.count_indexed_images()}, Vectores en el índice: {self.index.ntotal}")
+
+    def embed_and_add(self, image_paths: List[str], manifest: Dict[str, Tuple[int, int]]) -> int:
+        """Extrae las características de las imágenes por lotes y las añade al índice con IDs estables.
+
+        Con el almacén de vectores del motor, cada imagen se busca primero por el hash de su contenido
+        y solo las que faltan pasan por el modelo; sus vectores se guardan en el almacén al codificarlas.
+        Las imágenes procesadas (también las ilegibles) se registran en el manifiesto con la firma
+        obtenida al escanear, para que no se vuelvan a procesar mientras no cambien. Cada
+        `checkpoint_interval` segundos se guarda un punto de control desde el que se reanuda
+        la indexación si se interrumpe.
+        """
+        num_images = len(image_paths)
+        added_count = 0
+        self.engine.progress_callback(0, num_images)
+
+        config = self.engine.config
+        metrics = self.engine.metrics
+        batch_size = self.engine.batch_size
+        store = self.engine.embedding_store
+        hashes = {}
+        duplicates = []
+        processed = 0
+        if store is not None and image_paths:
+            for start in range(0, num_images, HASH_CHUNK_SIZE):
+                self.check_cancelled(processed, num_images)
+                chunk = image_paths[start:start + HASH_CHUNK_SIZE]
+                with metrics.time("hash", len(chunk)):
+                    hashes.update(hash_files(chunk))
+            with metrics.time("embedding_store_get", len(hashes)):
+                stored_vectors = store.get_many(hashes.values(), self.engine.feature_dim)
+            cached_paths = [path for path in image_paths if hashes.get(path) in stored_vectors]
+            # De las copias idénticas que faltan en el almacén solo se codifica la primera.
+            pending_hashes = set()
+            misses = []
+            for path in image_paths:
+                sha = hashes.get(path)
+                if sha in stored_vectors:
+                    continue
+                if sha is not None and sha in pending_hashes:
+                    duplicates.append(path)
+                    continue
+                pending_hashes.add(sha)
+                misses.append(path)
+            if cached_paths or duplicates:
+                logging.info(f"Almacén de vectores: {len(cached_paths)} de {num_images} imágenes ya codificadas, "
+                             f"{len(duplicates)} copias idénticas.")
+            image_paths = misses
+            for start in range(0, len(cached_paths), batch_size):
+                self.check_cancelled(processed, num_images)
+                batch_paths = cached_paths[start:start + batch_size]
+                batch_vectors = np.stack([stored_vectors[hashes[path]] for path in batch_paths])
+                added_count += self.add_vectors(batch_paths, batch_paths, batch_vectors, manifest)
+                processed += len(batch_paths)
+                self.engine.progress_callback(processed, num_images)
+            metrics.increment("embeddings_reused", len(cached_paths))
+        duplicate_hashes = {hashes[path] for path in duplicates}
+        computed = {}
+
+        thumbnail_store = self.engine.thumbnail_store if config.get("thumbnails_during_indexing", True) else None
+        model_pool = self.engine.model_worker_pool() if image_paths else None
+        if model_pool is not None:
+            def encode_locally(paths):
+                valid, images = load_and_preprocess_batch(paths, self.engine.image_preprocess(), thumbnail_store,
+                                                          metrics)
+                return valid, self.engine.encode_image_batch(images) if images is not None else None
+
+            batches = model_pool.iter_batches(image_paths, batch_size, config.get("prefetch_batches", 2),
+                                              encode_locally, metrics)
+        else:
+            decode_pool = self.engine.decode_worker_pool() if len(image_paths) > batch_size else None
+            batches = iter_preprocessed_batches(image_paths, batch_size, self.engine.image_preprocess(), decode_pool,
+                                                config.get("prefetch_batches", 2), thumbnail_store, metrics)
+
+        checkpoint_interval = config.get("checkpoint_interval", 60)
+        last_checkpoint = time.monotonic()
+        for batch_paths, valid_paths, batch_data in batches:
+            if self.engine.cancel_event.is_set():
+                batches.close()
+                self.check_cancelled(processed, num_images)
+            # Los procesos de inferencia ya devuelven vectores; si no, el lote llega preprocesado.
+            if model_pool is not None:
+                batch_features = batch_data
+            else:
+                batch_features = self.engine.encode_image_batch(batch_data) if batch_data is not None else None
+
+            if batch_features is not None:
+                batch_vectors = self.engine.normalize_vectors(batch_features.astype(np.float32))
+                added_count += self.add_vectors(batch_paths, valid_paths, batch_vectors, manifest)
+                if store is not None:
+                    with metrics.time("embedding_store_put", len(valid_paths)):
+                        store.put_many((hashes[path], vector) for path, vector in zip(valid_paths, batch_vectors)
+                                       if path in hashes)
+                    computed.update((hashes[path], vector) for path, vector in zip(valid_paths, batch_vectors)
+                                    if hashes.get(path) in duplicate_hashes)
+                metrics.increment("embeddings_computed", len(valid_paths))
+            else:
+                logging.warning(f"Error al procesar el lote de imágenes {batch_paths}. Saltando este lote.")
+                metrics.increment("batches_failed")
+
+            processed += len(batch_paths)
+            self.engine.progress_callback(processed, num_images)
+
+            if checkpoint_interval and time.monotonic() - last_checkpoint >= checkpoint_interval and processed < num_images:
+                self.save_index(checkpoint=True)
+                last_checkpoint = time.monotonic()
+                logging.info(f"Punto de control guardado: {processed}/{num_images} imágenes procesadas.")
+
+        # Las copias reciben el vector de su original; si el original no se pudo leer, se registran sin vector.
+        valid_duplicates = [path for path in duplicates if hashes[path] in computed]
+        for start in range(0, len(valid_duplicates), batch_size):
+            batch_paths = valid_duplicates[start:start + batch_size]
+            batch_vectors = np.stack([computed[hashes[path]] for path in batch_paths])
+            added_count += self.add_vectors(batch_paths, batch_paths, batch_vectors, manifest)
+        for path in duplicates:
+            self.index_metadata[path] = manifest[path]
+        metrics.increment("embeddings_reused", len(valid_duplicates))
+
+        self.engine.progress_callback(num_images, num_images)
+        return added_count
+
+    def check_cancelled(self, processed: int, num_images: int):
+        """Si se pidió cancelar, guarda un punto de control y lanza IndexingCancelled."""
+        if not self.engine.cancel_event.is_set():
+            return
+        self.save_index(checkpoint=True)
+        logging.info(f"Indexación cancelada: {processed}/{num_images} imágenes procesadas.")
+        raise IndexingCancelled(f"Indexación cancelada en {self.image_dir}.")
+
+    def add_vectors(self, batch_paths: List[str], valid_paths: List[str], batch_vectors: np.ndarray,
+                    manifest: Dict[str, Tuple[int, int]]) -> int:
+        """Añade los vectores normalizados de `valid_paths` al índice y al archivo de vectores.
+
+        Los atributos de cada imagen (carpeta, tamaño, mtime, dimensiones y fecha EXIF) se añaden a la
+        tabla de atributos con el mismo ID; las dimensiones y la fecha se leen de la cabecera del archivo.
+        Todas las rutas del lote, también las que no se pudieron leer, quedan registradas en el manifiesto.
+        """
+        metrics = self.engine.metrics
+        first_id = len(self.image_paths)
+        ids = np.arange(first_id, first_id + len(valid_paths), dtype=np.int64)
+        with metrics.time("index_add", len(valid_paths)):
+            self.index.add_with_ids(batch_vectors, ids)
+        with metrics.time("vector_store_append", len(valid_paths)):
+            self.vector_store.append(batch_vectors)
+        with metrics.time("read_attributes", len(valid_paths)):
+            for path in valid_paths:
+                self.attributes.append(path, manifest[path], read_image_attributes(path))
+        self.image_paths.extend(valid_paths)
+        self.path_ids.update(zip(valid_paths, ids.tolist()))
+        for path in batch_paths:
+            self.index_metadata[path] = manifest[path]
+        metrics.increment("images_indexed", len(valid_paths))
+        return len(valid_paths)
+
+
+class ImageSearchEngine:
+    """Modelo CLIP, índice FAISS, indexación y búsqueda, sin dependencias de la interfaz gráfica.
+
+    El índice se reparte en fragmentos (IndexShard) por subárbol de los directorios de imágenes
+    y las búsquedas combinan el top-k de todos ellos. La ventana Tkinter y la línea de comandos
+    usan esta clase. El progreso de la indexación y los mensajes de estado se notifican con
+    `progress_callback(procesadas, total)` y `status_callback(texto, color)`.
+    """
+
+    def __init__(self, config: Optional[dict] = None, index_dir: str = INDEX_DIR):
+        self.config = {**DEFAULT_CONFIG, **(config or {})}
+        self.image_dir = self.config.get("image_dir", "")
+        self.index_dir = index_dir
+        self.device = None
+        self.model = None
+        self.preprocess = None
+        self.fast_preprocess: Optional[FastPreprocess] = None
+        self.precision = None
+        self.tokenize = None
+        self.query_cache = None
+        self.embedding_store: Optional[EmbeddingStore] = None
+        self.thumbnail_store = ThumbnailStore()
+        self.feature_dim = DEFAULT_FEATURE_DIM
+        self.batch_size = 64
+        self.shards: List[IndexShard] = []
+        self.search_pool: Optional[ThreadPoolExecutor] = None
+        # Carga una copia del modelo y del preprocesado en los procesos de inferencia (`model_workers`).
+        self.model_loader: Optional[Callable] = None
+        self.model_pool: Optional[ModelWorkerPool] = None
+        self.decode_pool: Optional[DecodeWorkerPool] = None
+        self.metrics = Metrics()
+        self.cancel_event = threading.Event()
+        # Serializa las escrituras del índice (indexación y vigilancia); las búsquedas no lo usan.
+        self.index_lock = threading.RLock()
+        # Directorios de los fragmentos descartados en la última actualización, que las búsquedas
+        # en curso aún pueden leer; se borran en la siguiente.
+        self.retired_shard_dirs: Set[str] = set()
+        self.progress_callback: Callable[[int, int], None] = lambda done, total: None
+        self.status_callback: Callable[[str, str], None] = lambda text, color: None
+
+    def load_model(self):
+        """Carga el modelo CLIP con la precisión configurada y crea la caché de consultas.
+
+        `model` se asigna al final: otros hilos (la interfaz, las colecciones) lo usan como señal de
+        que el motor está listo, así que todo lo demás ya debe estar en su sitio cuando deja de ser None.
+        """
+        import clip
+        model, self.preprocess, self.device, self.precision = load_clip_model(self.config.get("precision", "auto"))
+        self.tokenize = clip.tokenize
+        self.model_loader = partial(load_worker_model, self.precision, self.config.get("fast_preprocess", True))
+        logging.info(f"Modelo CLIP cargado correctamente (precisión: {self.precision}).")
+        self.fast_preprocess = None
+        if self.config.get("fast_preprocess", True):
+            self.fast_preprocess = FastPreprocess.from_transform(self.preprocess)
+            if self.fast_preprocess is None:
+                logging.info("La transformación del modelo no admite el preprocesamiento rápido; se usa la de CLIP.")
+        self.query_cache = self.create_query_cache()
+        self.embedding_store = self.create_embedding_store()
+        self.model = model
+
+    def share_model(self, other: "ImageSearchEngine"):
+        """Usa el modelo, las cachés y las métricas de otro motor ya cargado en vez de cargar los propios.
+
+        Así varias colecciones comparten un único modelo CLIP en memoria.
+        """
+        # `model` va al final, igual que en load_model: con él asignado el motor se considera listo.
+        for name in ("preprocess", "fast_preprocess", "device", "precision", "tokenize", "model_loader", "feature_dim",
+                     "batch_size", "query_cache", "embedding_store", "thumbnail_store", "metrics", "model"):
+            setattr(self, name, getattr(other, name))
+        self.search_pool = other.shard_search_pool()
+
+    def image_preprocess(self):
+        """Transformación de imágenes a usar: la rápida (FastPreprocess) si está disponible o la de CLIP."""
+        return self.fast_preprocess or self.preprocess
+
+    def model_worker_pool(self) -> Optional[ModelWorkerPool]:
+        """Procesos de inferencia configurados con `model_workers`, creados la primera vez que se piden.
+
+        Devuelve None si `model_workers` es 0, si el modelo no se puede cargar en otros procesos o
+        si la inferencia va a la GPU, donde varios procesos no aceleran.
+        """
+        num_workers = int(self.config.get("model_workers") or 0)
+        if num_workers <= 0 or self.model_loader is None:
+            return None
+        if self.device is not None and self.device.type != "cpu":
+            logging.info("Los procesos de inferencia solo se usan en CPU; se codifica en el proceso principal.")
+            return None
+        if self.model_pool is None or self.model_pool.broken:
+            self.close_model_workers()
+            thumbnail_store = self.thumbnail_store if self.config.get("thumbnails_during_indexing", True) else None
+            self.model_pool = ModelWorkerPool(num_workers, self.model_loader, thumbnail_store,
+                                              self.config.get("model_worker_threads"))
+            groups = ", ".join(f"{len(group)} CPU" for group in self.model_pool.core_groups)
+            logging.info(f"Iniciando {self.model_pool.num_workers} procesos de inferencia ({groups}).")
+            try:
+                with self.metrics.time("model_workers_start"):
+                    self.model_pool.start()
+            except BrokenProcessPool as e:
+                logging.error(f"No se pudieron iniciar los procesos de inferencia: {e}. Se codifica en el proceso principal.")
+                self.close_model_workers()
+        return self.model_pool
+
+    def close_model_workers(self):
+        """Detiene los procesos de inferencia y libera sus copias del modelo."""
+        if self.model_pool is not None:
+            self.model_pool.close()
+            self.model_pool = None
+
+    def decode_worker_pool(self) -> Optional[DecodeWorkerPool]:
+        """Procesos de decodificación configurados con `decode_workers`, creados la primera vez que se piden.
+
+        El grupo se comparte entre todos los fragmentos de una indexación y se cierra al terminarla
+        (close_worker_pools). Devuelve None si `decode_workers` es 0.
+        """
+        num_workers = self.config.get("decode_workers")
+        if num_workers is None:
+            num_workers = default_decode_workers()
+        if num_workers <= 0:
+            return None
+        if self.decode_pool is None or self.decode_pool.broken:
+            if self.decode_pool is not None:
+                self.decode_pool.close()
+            thumbnail_store = self.thumbnail_store if self.config.get("thumbnails_during_indexing", True) else None
+            self.decode_pool = DecodeWorkerPool(num_workers, self.image_preprocess(), thumbnail_store)
+        return self.decode_pool
+
+    def close_worker_pools(self):
+        """Detiene los procesos de decodificación y de inferencia creados durante la indexación."""
+        if self.decode_pool is not None:
+            self.decode_pool.close()
+            self.decode_pool = None
+        self.close_model_workers()
+
+    def create_query_cache(self) -> QueryEmbeddingCache:
+        """Crea la caché de consultas del modelo cargado y recupera la guardada en disco si está activada."""
+        persist = self.config.get("query_cache_persist", True)
+        cache = QueryEmbeddingCache(f"{MODEL_NAME}|{self.precision}", self.config.get("query_cache_size", 1024),
+                                    QUERY_CACHE_FILE if persist else None)
+        cache.load()
+        return cache
+
+    def create_embedding_store(self) -> Optional[EmbeddingStore]:
+        """Almacén de vectores por contenido del modelo cargado, o None si `embedding_store` está desactivado."""
+        file_path = self.config.get("embedding_store")
+        return EmbeddingStore(file_path, f"{MODEL_NAME}|{self.precision}") if file_path else None
+
+    def save_query_cache(self):
+        """Guarda en disco la caché de consultas, si el modelo llegó a cargarse."""
+        if self.query_cache is not None:
+            try:
+                self.query_cache.save()
+            except OSError as e:
+                logging.warning(f"No se pudo guardar la caché de consultas: {e}")
+
+    def model_identity(self) -> Tuple[str, str]:
+        """Modelo y precisión con los que se generan los vectores.
+
+        Se puede llamar antes de que el modelo termine de cargarse: la precisión se deduce de la configuración.
+        """
+        precision = self.precision or resolve_precision(self.config.get("precision", "auto"), select_device())
+        return MODEL_NAME, precision
+
+    def matches_model(self, header: dict) -> bool:
+        """Comprueba que los vectores almacenados se generaron con el mismo modelo y precisión."""
+        model_name, precision = self.model_identity()
+        if header.get("model") != model_name or header.get("precision") != precision:
+            logging.info(f"El índice se generó con {header.get('model')} ({header.get('precision')}) y el modelo "
+                         f"actual es {model_name} ({precision}). Es necesario reindexar.")
+            return False
+        return True
+
+    def root_dirs(self) -> List[str]:
+        """Directorios raíz de la colección: `image_dir` admite varios separados por os.pathsep."""
+        return [d.strip() for d in (self.image_dir or "").split(os.pathsep) if d.strip()]
+
+    def plan_shards(self) -> List[IndexShard]:
+        """Reparte los directorios raíz en fragmentos, omitiendo los subárboles sin imágenes."""
+        recursive = self.config.get("recursive", True)
+        shards = []
+        for root in self.root_dirs():
+            if not os.path.isdir(root):
+                logging.warning(f"El directorio de imágenes no existe: {root}")
+                continue
+            subtrees = [(root, False)]
+            if recursive:
+                with os.scandir(root) as entries:
+                    subtrees += sorted((entry.path, True) for entry in entries
+                                       if entry.is_dir(follow_symlinks=False) and not entry.name.startswith("."))
+            for image_dir, shard_recursive in subtrees:
+                if has_images(image_dir, shard_recursive):
+                    shards.append(self.make_shard(image_dir, shard_recursive))
+        return shards
+
+    def make_shard(self, image_dir: str, recursive: bool) -> IndexShard:
+        return IndexShard(self, image_dir, recursive,
+                          os.path.join(self.index_dir, SHARDS_DIR, shard_dir_name(image_dir, recursive)))
+
+    def read_collection(self) -> Optional[dict]:
+        """Lee la lista de fragmentos de la colección almacenada."""
+        try:
+            with open(os.path.join(self.index_dir, COLLECTION_FILE), "r", encoding="utf-8") as f:
+                collection = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError) as e:
+            logging.warning(f"No se encontró la lista de fragmentos del índice o está corrupta: {e}")
+            return None
+        if collection.get("version") != INDEX_FORMAT_VERSION:
+            logging.info("El formato del índice almacenado es antiguo. Es necesario reindexar.")
+            return None
+        return collection
+
+    def save_collection(self):
+        """Guarda la lista de fragmentos vigente y elimina los que ya no forman parte de la colección."""
+        collection = {
+            "version": INDEX_FORMAT_VERSION,
+            "image_dir": self.image_dir,
+            "shards": [{"image_dir": shard.image_dir, "recursive": shard.recursive} for shard in self.shards],
+        }
+
+        def writer(tmp_path):
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(collection, f, indent=2)
+
+        os.makedirs(self.index_dir, exist_ok=True)
+        atomic_write(os.path.join(self.index_dir, COLLECTION_FILE), writer)
+        self.remove_stale_shards()
+
+    def remove_stale_shards(self):
+        """Borra los fragmentos de subárboles que ya no existen y los archivos de formatos anteriores.
+
+        El directorio del índice lo elige el usuario (`--index-dir`, colecciones) y puede contener
+        otros archivos: solo se borran los nombres que este programa escribe y el resto se deja.
+        """
+        current = {os.path.basename(shard.index_dir) for shard in self.shards}
+        shards_dir = os.path.join(self.index_dir, SHARDS_DIR)
+        if os.path.isdir(shards_dir):
+            for name in os.listdir(shards_dir):
+                if name not in current and name not in self.retired_shard_dirs and SHARD_DIR_PATTERN.fullmatch(name):
+                    shutil.rmtree(os.path.join(shards_dir, name), ignore_errors=True)
+        unknown = []
+        for name in os.listdir(self.index_dir):
+            path = os.path.join(self.index_dir, name)
+            if name == COLLECTION_FILE or not os.path.isfile(path):
+                continue
+            if name not in LEGACY_INDEX_FILES and not LEGACY_INDEX_FILE_PATTERN.fullmatch(name):
+                unknown.append(name)
+                continue
+            try:
+                os.remove(path)
+            except OSError as e:
+                logging.debug(f"No se pudo eliminar el archivo antiguo del índice {name}: {e}")
+        if unknown:
+            logging.debug(f"Se conservan archivos ajenos al índice en {self.index_dir}: {', '.join(sorted(unknown))}")
+
+    @staticmethod
+    def shard_keys(shards: Iterable) -> List[Tuple[str, bool]]:
+        return [(shard["image_dir"], shard["recursive"]) if isinstance(shard, dict) else
+                (shard.image_dir, shard.recursive) for shard in shards]
+
+    def is_index_valid(self) -> bool:
+        """Verifica que los fragmentos almacenados cubren los subárboles actuales y están al día."""
+        collection = self.read_collection()
+        if collection is None or collection.get("image_dir") != self.image_dir:
+            return False
+        shards = self.plan_shards()
+        if not shards or self.shard_keys(shards) != self.shard_keys(collection.get("shards", [])):
+            logging.info("Los subdirectorios de la colección han cambiado.")
+            return False
+        return all(shard.is_index_valid() for shard in shards)
+
+    def can_update_incrementally(self) -> bool:
+        """Indica si algún fragmento almacenado puede reutilizarse en lugar de reindexar todo."""
+        return any(shard.can_update_incrementally() for shard in self.plan_shards())
+
+    def read_stored_index(self, writable: bool = False) -> Optional[dict]:
+        """Lee los fragmentos almacenados de los subárboles actuales sin aplicarlos."""
+        shards = self.plan_shards()
+        stored_shards = []
+        for shard in shards:
+            stored_data = shard.read_stored_index(writable)
+            if stored_data is None:
+                return None
+            stored_shards.append((shard, stored_data))
+        return {"shards": stored_shards}
+
+    def apply_stored_index(self, stored_data: dict) -> bool:
+        """Carga en memoria los fragmentos leídos con read_stored_index."""
+        for shard, shard_data in stored_data["shards"]:
+            if not shard.apply_stored_index(shard_data):
+                self.shards = []
+                return False
+        self.shards = [shard for shard, _ in stored_data["shards"]]
+        return True
+
+    def load_stored_index(self) -> bool:
+        """Carga el índice almacenado tal como está, sin comprobar si los directorios han cambiado.
+
+        Los directorios de imágenes pasan a ser los del índice. Devuelve False si no hay índice
+        o si algún fragmento se generó con otro modelo o precisión.
+        """
+        collection = self.read_collection()
+        if collection is None:
+            return False
+        shards = [self.make_shard(image_dir, recursive) for image_dir, recursive
+                  in self.shard_keys(collection.get("shards", []))]
+        stored_shards = []
+        for shard in shards:
+            header = shard.read_index_header()
+            if header is None or not self.matches_model(header):
+                return False
+            stored_data = shard.read_stored_index()
+            if stored_data is None:
+                return False
+            stored_shards.append((shard, stored_data))
+        if not shards or not self.apply_stored_index({"shards": stored_shards}):
+            return False
+        self.image_dir = collection.get("image_dir", "")
+        return True
+
+    def refresh_index(self, rebuild: bool = False):
+        """Deja el índice al día con los directorios de imágenes, fragmento a fragmento.
+
+        Los fragmentos válidos se cargan sin más, los que cambiaron se actualizan de forma incremental
+        y el resto se reconstruye; con `rebuild` se reconstruyen todos. Lanza IndexingError si no hay
+        directorios, no contienen imágenes o no se pudo indexar ningún fragmento.
+        """
+        if not self.root_dirs():
+            raise IndexingError("Por favor, seleccione un directorio de imágenes.")
+        with self.index_lock:
+            self.cancel_event.clear()
+            try:
+                with self.profile("index" if rebuild else "update"), self.metrics.time("refresh_index"):
+                    self._refresh_shards(rebuild)
+            finally:
+                self.close_worker_pools()
+
+    def _refresh_shards(self, rebuild: bool):
+        """Planifica los fragmentos y los carga, actualiza o reconstruye uno a uno."""
+        shards = self.plan_shards()
+        if not shards:
+            logging.warning("No se encontraron imágenes en el directorio especificado.")
+            raise IndexingError("No se encontraron imágenes en el directorio especificado.")
+        self.retain_live_files(shards)
+
+        loaded = []
+        for position, shard in enumerate(shards, start=1):
+            if self.cancel_event.is_set():
+                raise IndexingCancelled("Indexación cancelada.")
+            self.status_callback(f"Indexando {shard.image_dir} ({position}/{len(shards)})...", "red")
+            try:
+                if rebuild:
+                    shard.index_images()
+                else:
+                    shard.refresh()
+            except IndexingCancelled:
+                raise
+            except IndexingError as e:
+                logging.warning(f"Se omite el fragmento {shard.image_dir}: {e}")
+                continue
+            loaded.append(shard)
+
+        if not loaded:
+            raise IndexingError("No se pudieron extraer las características de ninguna imagen.")
+        self.replace_shards(loaded)
+        self.save_collection()
+        logging.info(f"Índice listo. Fragmentos: {len(self.shards)}, imágenes: {self.count_indexed_images()}")
+
+    def refresh_changed(self, changed_paths: Iterable[str]) -> List[str]:
+        """Actualiza solo los fragmentos que contienen alguna de las rutas cambiadas y devuelve sus directorios.
+
+        Los fragmentos afectados se actualizan en objetos nuevos mientras las búsquedas siguen usando
+        los actuales; al terminar, la lista de fragmentos se sustituye de una sola vez. Los subárboles
+        nuevos se indexan y los que ya no tienen imágenes se descartan.
+        """
+        changed_paths = [os.path.abspath(path) for path in changed_paths]
+        with self.index_lock:
+            try:
+                return self._refresh_changed_shards(changed_paths)
+            finally:
+                self.close_worker_pools()
+
+    def _refresh_changed_shards(self, changed_paths: List[str]) -> List[str]:
+        """Cuerpo de refresh_changed, con el cerrojo del índice ya tomado."""
+        self.cancel_event.clear()
+        current = {(shard.image_dir, shard.recursive): shard for shard in self.shards}
+        planned = self.plan_shards()
+        self.retain_live_files(planned)
+        refreshed = []
+        shards = []
+        for shard in planned:
+            existing = current.get((shard.image_dir, shard.recursive))
+            if existing is not None and existing.index is not None and \
+                    not any(existing.contains(path) for path in changed_paths):
+                shards.append(existing)
+                continue
+            try:
+                shard.refresh()
+            except IndexingCancelled:
+                raise
+            except IndexingError as e:
+                logging.warning(f"Se omite el fragmento {shard.image_dir}: {e}")
+                continue
+            shards.append(shard)
+            refreshed.append(shard.image_dir)
+
+        removed = len(set(current) - {(shard.image_dir, shard.recursive) for shard in shards})
+        if refreshed or removed:
+            self.replace_shards(shards)
+            self.save_collection()
+            logging.info(f"Fragmentos actualizados: {len(refreshed)}, descartados: {removed}. "
+                         f"Imágenes: {self.count_indexed_images()}")
+        return refreshed
+
+    def retain_live_files(self, shards: List[IndexShard]):
+        """Conserva en cada fragmento nuevo los archivos de la generación que usa el fragmento vigente.
+
+        Las búsquedas siguen leyendo (mapeados en memoria) el índice y los vectores del fragmento
+        vigente hasta que se sustituye la lista, así que esa generación se borra en el guardado
+        siguiente y no en el que la reemplaza.
+        """
+        current = {(shard.image_dir, shard.recursive): shard for shard in self.shards}
+        for shard in shards:
+            live = current.get((shard.image_dir, shard.recursive))
+            if live is not None:
+                shard.retained_files = {name for name in live.files.values() if name}
+
+    def replace_shards(self, shards: List[IndexShard]):
+        """Sustituye la lista de fragmentos; los directorios de los descartados se borran en la próxima actualización."""
+        kept = {shard.index_dir for shard in shards}
+        self.retired_shard_dirs = {os.path.basename(shard.index_dir) for shard in self.shards
+                                   if shard.index_dir not in kept}
+        self.shards = shards
+
+    def index_images(self):
+        """Reindexa desde cero todas las imágenes de los directorios seleccionados."""
+        self.refresh_index(rebuild=True)
+
+    def update_index_incremental(self):
+        """Actualiza el índice procesando solo los fragmentos con imágenes nuevas, modificadas o eliminadas."""
+        self.refresh_index()
+
+    def cancel_indexing(self):
+        """Pide que la indexación en curso se detenga tras el lote actual; refresh_index lanzará IndexingCancelled."""
+        self.cancel_event.set()
+
+    def count_indexed_images(self) -> int:
+        """Cuenta las imágenes indexadas en todos los fragmentos."""
+        return sum(shard.count_indexed_images() for shard in self.shards)
+
+    def memory_bytes(self) -> int:
+        """Estimación de la memoria que ocupan los fragmentos cargados."""
+        return sum(shard.memory_bytes() for shard in self.shards)
+
+    def has_index(self) -> bool:
+        return any(shard.index is not None for shard in self.shards)
+
+    @contextmanager
+    def profile(self, label: str):
+        """Perfila el bloque si la configuración activa `profiler` (`cprofile` o `torch`); si no, no hace nada."""
+        profiler = self.config.get("profiler")
+        if not profiler:
+            yield
+            return
+        output_path = profile_output_path(self.config.get("profile_dir") or "profiles", label, profiler)
+        with profile_run(output_path, profiler):
+            yield
+
+    def metrics_snapshot(self) -> dict:
+        """Métricas por etapa junto con el estado de la caché de consultas y del índice."""
+        snapshot = self.metrics.snapshot()
+        if self.query_cache is not None:
+            snapshot["query_cache"] = {"entries": len(self.query_cache), "hits": self.query_cache.hits,
+                                       "misses": self.query_cache.misses}
+        snapshot["index"] = {"shards": len(self.shards), "images": self.count_indexed_images()}
+        return snapshot
+
+    def dump_metrics(self, file_path: Optional[str] = None) -> str:
+        """Guarda las métricas en JSON (por defecto en `metrics_dir` con marca de tiempo) y devuelve la ruta."""
+        if file_path is None:
+            file_path = os.path.join(self.config.get("metrics_dir") or "metrics",
+                                     f"metrics-{time.strftime('%Y%m%d-%H%M%S')}.json")
+        snapshot = self.metrics_snapshot()
+        self.metrics.dump(file_path, {key: snapshot[key] for key in ("query_cache", "index") if key in snapshot})
+        return file_path
+
+    def find_near_duplicates(self, threshold: float = 0.95, k: int = 10,
+                             block_size: int = 4096) -> List[dict]:
+        """Agrupa las imágenes cuya similitud coseno supera `threshold` (duplicados, recortes, ráfagas).
+
+        Los vectores almacenados se consultan por bloques de `block_size` contra el índice de cada
+        fragmento (`k` vecinos por imagen), así que la memoria no depende del tamaño de la colección.
+        Los pares candidatos se confirman con el producto exacto de los vectores guardados, para que
+        los índices aproximados (IVF-PQ) no introduzcan falsos positivos, y se unen en grupos con
+        union-find. Devuelve los grupos de mayor a menor tamaño.
+        """
+        shards = [shard for shard in self.shards if shard.index is not None and shard.index.ntotal > 0]
+        offsets = np.cumsum([0] + [len(shard.image_paths) for shard in shards])
+        groups = UnionFind(int(offsets[-1]))
+        edges: List[Tuple[int, int, float]] = []
+        seen_pairs = set()
+        # Margen para no perder pares cuya puntuación aproximada queda algo por debajo de la exacta.
+        candidate_threshold = threshold - 0.05
+
+        for source_position, source in enumerate(shards):
+            live_ids = np.array([i for i, path in enumerate(source.image_paths) if path is not None], dtype=np.int64)
+            for start in range(0, len(live_ids), block_size):
+                block_ids = live_ids[start:start + block_size]
+                queries = np.ascontiguousarray(source.vector_store.array()[block_ids], dtype=np.float32)
+                for target_position, target in enumerate(shards):
+                    D, I = target.index.search(queries, min(k + 1, target.index.ntotal))
+                    rows, cols = np.nonzero((I >= 0) & (D >= candidate_threshold))
+                    query_global = offsets[source_position] + block_ids[rows]
+                    target_local = I[rows, cols]
+                    target_global = offsets[target_position] + target_local
+                    # Las listas de vecinos no son simétricas: un par puede aparecer solo desde uno de sus extremos,
+                    # así que se aceptan ambos sentidos y cada par se normaliza a (menor, mayor).
+                    keep = query_global != target_global
+                    if not keep.any():
+                        continue
+                    rows, target_local = rows[keep], target_local[keep]
+                    query_global, target_global = query_global[keep], target_global[keep]
+                    similarity = np.einsum("ij,ij->i", queries[rows],
+                                           np.asarray(target.vector_store.array()[target_local], dtype=np.float32))
+                    confirmed = similarity >= threshold
+                    for a, b, score in zip(query_global[confirmed], target_global[confirmed], similarity[confirmed]):
+                        pair = (int(min(a, b)), int(max(a, b)))
+                        if pair in seen_pairs:
+                            continue
+                        seen_pairs.add(pair)
+                        groups.union(*pair)
+                        edges.append((*pair, float(score)))
+            logging.info(f"Duplicados: fragmento {source_position + 1}/{len(shards)} procesado.")
+
+        def path_of(global_id: int) -> str:
+            position = int(np.searchsorted(offsets, global_id, side="right")) - 1
+            return shards[position].image_paths[global_id - int(offsets[position])]
+
+        clusters: Dict[int, dict] = {}
+        for a, b, score in edges:
+            cluster = clusters.setdefault(groups.find(a), {"ids": set(), "min_similarity": 1.0, "max_similarity": -1.0})
+            cluster["ids"].update((a, b))
+            cluster["min_similarity"] = min(cluster["min_similarity"], score)
+            cluster["max_similarity"] = max(cluster["max_similarity"], score)
+        report = [{
+            "size": len(cluster["ids"]),
+            "min_similarity": cluster["min_similarity"],
+            "max_similarity": cluster["max_similarity"],
+            "images": sorted(path_of(global_id) for global_id in cluster["ids"]),
+        } for cluster in clusters.values()]
+        report.sort(key=lambda cluster: (-cluster["size"], cluster["images"][0]))
+        return report
+
+    def extract_image_features_batch(self, image_paths: List[str]) -> Optional[Tuple[List[str], np.ndarray]]:
+        """Extrae las características de un lote de imágenes y devuelve las rutas válidas junto a sus vectores."""
+        valid_paths, batch_images = load_and_preprocess_batch(image_paths, self.image_preprocess(),
+                                                              metrics=self.metrics)
+        if batch_images is None:
+            logging.warning("No se pudieron cargar imágenes validas del lote.")
+            return None
+
+        batch_features = self.encode_image_batch(batch_images)
+        if batch_features is None:
+            return None
+        return valid_paths, batch_features
+
+    def encode_image_batch(self, batch_images: torch.Tensor) -> Optional[np.ndarray]:
+        """Codifica con CLIP un lote de imágenes ya preprocesadas."""
+        import torch
+        try:
+            with self.metrics.time("encode_image", len(batch_images)):
+                if self.device.type == "cuda":
+                    batch_images = batch_images.pin_memory().to(self.device, non_blocking=True)
+                else:
+                    batch_images = batch_images.to(self.device)
+                with torch.no_grad():
+                    return self.model.encode_image(batch_images).float().cpu().numpy()
+
+        except Exception as e:
+            logging.error(f"Error al procesar el lote de imágenes: {e}")
+            return None
+
+    def extract_image_features(self, image_path: str) -> Optional[np.ndarray]:
+        """Extrae las características de una imagen utilizando el modelo CLIP."""
+        import torch
+        try:
+            _, batch_images = load_and_preprocess_batch([image_path], self.image_preprocess())
+            if batch_images is None:
+                return None
+
+            with torch.no_grad():
+                features = self.model.encode_image(batch_images.to(self.device))
+                features = features.squeeze().float().cpu().numpy()
+
+            return features
+
+        except Exception as e:
+            logging.error(f"Error al extraer características de la imagen {image_path}: {e}")
+            return None
+
+    def extract_text_features(self, text: str) -> Optional[np.ndarray]:
+        """Extrae las características de un texto utilizando el modelo CLIP."""
+        import torch
+        try:
+            text_input = self.tokenize([text]).to(self.device)
+            with torch.no_grad():
+                features = self.model.encode_text(text_input)
+                features = features.squeeze().float().cpu().numpy()
+
+            return features
+
+        except Exception as e:
+            logging.error(f"Error al extraer features de texto: {e}")
+            return None
+
+    def encode_texts(self, texts: List[str]) -> Optional[np.ndarray]:
+        """Codifica con CLIP una lista de textos en una sola llamada a encode_text."""
+        import torch
+        try:
+            with self.metrics.time("encode_text", len(texts)):
+                text_input = self.tokenize(texts, truncate=True).to(self.device)
+                with torch.no_grad():
+                    return self.model.encode_text(text_input).float().cpu().numpy()
+        except Exception as e:
+            logging.error(f"Error al extraer features de texto: {e}")
+            return None
+
+    def encode_images(self, images: List[Image.Image]) -> Optional[np.ndarray]:
+        """Preprocesa y codifica con CLIP una lista de imágenes ya abiertas en una sola llamada a encode_image."""
+        import torch
+        try:
+            with self.metrics.time("preprocess_query", len(images)):
+                if self.fast_preprocess is not None:
+                    batch_images = self.fast_preprocess.batch(images)
+                else:
+                    batch_images = torch.stack([self.preprocess(img.convert("RGB")) for img in images])
+        except Exception as e:
+            logging.error(f"Error al preprocesar las imágenes de consulta: {e}")
+            return None
+        return self.encode_image_batch(batch_images)
+
+    def normalize_vectors(self, vectors: np.ndarray) -> np.ndarray:
+        """Normaliza un array de vectores para que tenga longitud unitaria."""
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / (norms + 1e-8)
+
+    def search(self, query_feature: Optional[np.ndarray], k: int = 5,
+               image_filter: Optional[ImageFilter] = None) -> List[Tuple[str, float]]:
+        """Devuelve las rutas de las `k` imágenes más parecidas a la consulta con su puntuación."""
+        if query_feature is None:
+            return []
+        return self.search_features(query_feature.reshape(1, -1), k, image_filter)[0]
+
+    def search_features(self, query_features: np.ndarray, k: int = 5,
+                        image_filter: Optional[ImageFilter] = None) -> List[List[Tuple[str, float]]]:
+        """Busca varias consultas en todos los fragmentos y mezcla sus top-k; devuelve (ruta, puntuación).
+
+        Cada fragmento se consulta con una sola llamada a index.search; con varios fragmentos las
+        búsquedas se lanzan en paralelo (FAISS libera el GIL) y se combinan por puntuación.
+        Con `image_filter` (ver parse_filter) solo se devuelven las imágenes que lo cumplen.
+        """
+        query_features = self.normalize_vectors(query_features.astype(np.float32))
+        shards = [shard for shard in self.shards if shard.index is not None and shard.index.ntotal > 0]
+        if not shards:
+            return [[] for _ in range(len(query_features))]
+        start = time.perf_counter()
+        if len(shards) == 1:
+            shard_results = [shards[0].search(query_features, k, image_filter)]
+        else:
+            shard_results = list(self.shard_search_pool().map(
+                lambda shard: shard.search(query_features, k, image_filter), shards))
+        searched = time.perf_counter()
+        self.metrics.record("faiss_search", searched - start, len(query_features))
+
+        D = np.concatenate([scores for scores, _ in shard_results], axis=1)
+        I = np.concatenate([ids for _, ids in shard_results], axis=1)
+        owners = np.repeat(np.arange(len(shards)), [ids.shape[1] for _, ids in shard_results])
+        order = np.argsort(-D, axis=1, kind="stable")
+        results = []
+        for row in range(len(query_features)):
+            matches = []
+            for col in order[row]:
+                idx = I[row, col]
+                image_paths = shards[owners[col]].image_paths
+                if 0 <= idx < len(image_paths) and image_paths[idx] is not None:
+                    matches.append((image_paths[idx], float(D[row, col])))
+                    if len(matches) == k:
+                        break
+            results.append(matches)
+        self.metrics.record("merge_results", time.perf_counter() - searched, len(query_features))
+        self.metrics.increment("queries", len(query_features))
+        return results
+
+    def shard_search_pool(self) -> ThreadPoolExecutor:
+        """Hilos con los que se consultan los fragmentos en paralelo."""
+        if self.search_pool is None:
+            self.search_pool = ThreadPoolExecutor(max_workers=min(32, os.cpu_count() or 1),
+                                                  thread_name_prefix="shard-search")
+        return self.search_pool
+
+    def get_image_query_features(self, query_image_path: str) -> Optional[np.ndarray]:
+        """Vector de una imagen de consulta, tomado de la caché si ya se calculó para el mismo contenido."""
+        try:
+            key = QueryEmbeddingCache.image_key(query_image_path)
+        except OSError as e:
+            logging.error(f"Error al leer la imagen de consulta {query_image_path}: {e}")
+            return None
+        query_feature = self.query_cache.get(key)
+        if query_feature is None:
+            query_feature = self.extract_image_features(query_image_path)
+            if query_feature is not None:
+                self.query_cache.put(key, query_feature)
+        return query_feature
+
+    def get_text_query_features(self, query_text: str) -> Optional[np.ndarray]:
+        """Vector de un texto de consulta, tomado de la caché si ya se calculó."""
+        key = QueryEmbeddingCache.text_key(query_text)
+        query_feature = self.query_cache.get(key)
+        if query_feature is None:
+            query_feature = self.extract_text_features(query_text)
+            if query_feature is not None:
+                self.query_cache.put(key, query_feature)
+        return query_feature
+
+    def search_texts(self, texts: List[str], k: int = 5, chunk_size: int = QUERY_CHUNK_SIZE,
+                     image_filter: Optional[ImageFilter] = None) -> List[List[Tuple[str, float]]]:
+        """Busca muchos textos a la vez: por cada bloque, una llamada a encode_text y una a index.search.
+
+        Los vectores ya presentes en la caché de consultas no se vuelven a calcular. Si un bloque no se
+        puede codificar, sus consultas quedan sin resultados.
+        """
+        results = []
+        for start in range(0, len(texts), chunk_size):
+            results.extend(self.search_feature_list(self.text_query_features(texts[start:start + chunk_size]), k,
+                                                    image_filter))
+        return results
+
+    def text_query_features(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Vectores de varios textos de consulta; los que faltan en la caché se codifican en una sola llamada."""
+        keys = [QueryEmbeddingCache.text_key(text) for text in texts]
+        features = [self.query_cache.get(key) for key in keys]
+        misses = [i for i, feature in enumerate(features) if feature is None]
+        if misses:
+            encoded = self.encode_texts([texts[i] for i in misses])
+            if encoded is not None:
+                for row, i in enumerate(misses):
+                    features[i] = encoded[row]
+                    self.query_cache.put(keys[i], encoded[row])
+        return features
+
+    def search_images(self, image_paths: List[str], k: int = 5, chunk_size: int = QUERY_CHUNK_SIZE,
+                      image_filter: Optional[ImageFilter] = None) -> List[List[Tuple[str, float]]]:
+        """Busca muchas imágenes de consulta a la vez: por cada bloque, un encode_image y un index.search.
+
+        Las imágenes ilegibles quedan sin resultados, sin afectar al resto del bloque.
+        """
+        results = []
+        for start in range(0, len(image_paths), chunk_size):
+            results.extend(self.search_feature_list(self.image_query_features(image_paths[start:start + chunk_size]), k,
+                                                    image_filter))
+        return results
+
+    def image_query_features(self, image_paths: List[str]) -> List[Optional[np.ndarray]]:
+        """Vectores de varias imágenes de consulta, codificadas en un solo lote; las ilegibles quedan en None."""
+        keys: List[Optional[str]] = []
+        for path in image_paths:
+            try:
+                keys.append(QueryEmbeddingCache.image_key(path))
+            except OSError as e:
+                logging.error(f"Error al leer la imagen de consulta {path}: {e}")
+                keys.append(None)
+        features = [self.query_cache.get(key) if key else None for key in keys]
+        misses: Dict[str, List[int]] = {}
+        for i, feature in enumerate(features):
+            if feature is None and keys[i]:
+                misses.setdefault(image_paths[i], []).append(i)
+        if misses:
+            valid_paths, batch_images = load_and_preprocess_batch(list(misses), self.image_preprocess())
+            encoded = self.encode_image_batch(batch_images) if batch_images is not None else None
+            if encoded is not None:
+                for row, path in enumerate(valid_paths):
+                    for i in misses[path]:
+                        features[i] = encoded[row]
+                    self.query_cache.put(keys[misses[path][0]], encoded[row])
+        return features
+
+    def search_feature_list(self, features: List[Optional[np.ndarray]], k: int,
+                            image_filter: Optional[ImageFilter] = None) -> List[List[Tuple[str, float]]]:
+        """Busca juntos los vectores disponibles; las consultas sin vector devuelven una lista vacía."""
+        ready = [i for i, feature in enumerate(features) if feature is not None]
+        results: List[List[Tuple[str, float]]] = [[] for _ in features]
+        if ready:
+            for i, matches in zip(ready, self.search_features(np.stack([features[i] for i in ready]), k, image_filter)):
+                results[i] = matches
+        return results
+
+    def search_by_image(self, query_image_path: str, k: int = 5,
+                        image_filter: Optional[ImageFilter] = None) -> List[Tuple[str, float]]:
+        """Busca las imágenes más parecidas a una imagen de consulta."""
+        return self.search(self.get_image_query_features(query_image_path), k, image_filter)
+
+    def search_by_text(self, query_text: str, k: int = 5,
+                       image_filter: Optional[ImageFilter] = None) -> List[Tuple[str, float]]:
+        """Busca las imágenes que mejor corresponden a un texto de consulta."""
+        return self.search(self.get_text_query_features(query_text), k, image_filter)
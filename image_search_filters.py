@@ -0,0 +1,166 @@
+"""Filtros por atributos de las imágenes (carpeta, fechas, dimensiones, tamaño) para acotar las búsquedas."""
+
+from __future__ import annotations
+
+import os
+import re
+import time
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+# Fecha EXIF ausente en la columna "taken".
+NO_DATE = np.iinfo(np.int64).min
+FILTER_FIELDS = ("folder", "date", "mtime", "width", "height", "pixels", "size")
+TOKEN_PATTERN = re.compile(r'(?:[^\s"]|"[^"]*")+')
+CLAUSE_PATTERN = re.compile(r"^(\w+)(!=|>=|<=|=|:|>|<)(.*)$", re.DOTALL)
+NUMBER_SUFFIXES = {"": 1, "B": 1, "K": 1e3, "M": 1e6, "G": 1e9, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+NUMBER_PATTERN = re.compile(r"^(\d+(?:\.\d+)?)\s*([KMG]?B?)$", re.IGNORECASE)
+COMPARISONS = {
+    "=": np.equal,
+    ":": np.equal,
+    "!=": np.not_equal,
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+}
+
+
+def parse_date_range(value: str) -> Tuple[int, int]:
+    """Intervalo [inicio, fin) en segundos (hora local) de una fecha AAAA, AAAA-MM, AAAA-MM-DD o AAAA-MM-DDTHH:MM."""
+    for fmt, unit in (("%Y-%m-%dT%H:%M", "minute"), ("%Y-%m-%d %H:%M", "minute"), ("%Y-%m-%d", "day"),
+                      ("%Y-%m", "month"), ("%Y", "year")):
+        try:
+            parsed = time.strptime(value, fmt)
+        except ValueError:
+            continue
+        year, month, day, hour, minute = parsed[:5]
+        start = time.mktime((year, month, day, hour, minute, 0, 0, 0, -1))
+        if unit == "minute":
+            end = start + 60
+        elif unit == "day":
+            end = time.mktime((year, month, day + 1, 0, 0, 0, 0, 0, -1))
+        elif unit == "month":
+            end = time.mktime((year, month + 1, 1, 0, 0, 0, 0, 0, -1))
+        else:
+            end = time.mktime((year + 1, 1, 1, 0, 0, 0, 0, 0, -1))
+        return int(start), int(end)
+    raise ValueError(f"Fecha no válida: '{value}'. Use AAAA, AAAA-MM, AAAA-MM-DD o AAAA-MM-DDTHH:MM.")
+
+
+def parse_number(value: str) -> float:
+    """Número con sufijo opcional: B (bytes), K, M o G (potencias de 1000) y KB, MB o GB (potencias de 1024)."""
+    match = NUMBER_PATTERN.match(value.strip())
+    multiplier = NUMBER_SUFFIXES.get(match.group(2).upper()) if match else None
+    if multiplier is None:
+        raise ValueError(f"Número no válido: '{value}'.")
+    return float(match.group(1)) * multiplier
+
+
+def folder_matcher(value: str) -> Callable[[str], bool]:
+    """Comprueba si una carpeta es `value` o está dentro de ella.
+
+    Una ruta absoluta selecciona ese subárbol; un nombre (o ruta relativa) selecciona las carpetas
+    que lo contienen como componente en cualquier posición, sin distinguir mayúsculas.
+    """
+    value = os.path.normpath(value.replace("/", os.sep))
+    if os.path.isabs(value):
+        root = os.path.abspath(value)
+        return lambda folder: folder == root or folder.startswith(root.rstrip(os.sep) + os.sep)
+    needle = os.sep + value.lower().strip(os.sep) + os.sep
+    return lambda folder: needle in os.sep + folder.lower().strip(os.sep) + os.sep
+
+
+class ImageFilter:
+    """Filtro compilado: conjunción de condiciones sobre las columnas de atributos de un fragmento.
+
+    `mask(attributes)` devuelve un array booleano por ID de vector, calculado sobre las columnas
+    completas con operaciones de numpy; la condición de carpeta se evalúa una sola vez por carpeta.
+    """
+
+    def __init__(self, text: str, clauses: List[Callable]):
+        self.text = text
+        self.clauses = clauses
+
+    def __str__(self) -> str:
+        return self.text
+
+    def mask(self, attributes) -> np.ndarray:
+        mask = np.ones(len(attributes), dtype=bool)
+        for clause in self.clauses:
+            mask &= clause(attributes)
+        return mask
+
+
+def compile_clause(field: str, operator: str, value: str) -> Callable:
+    """Convierte una condición `campo operador valor` en una función de las columnas de atributos."""
+    if field not in FILTER_FIELDS:
+        raise ValueError(f"Campo de filtro desconocido: '{field}'. Opciones: {', '.join(FILTER_FIELDS)}")
+    if not value:
+        raise ValueError(f"Falta el valor de '{field}'.")
+
+    if field == "folder":
+        if operator not in ("=", ":", "!="):
+            raise ValueError("La carpeta solo admite '=', ':' o '!='.")
+        matches = folder_matcher(value)
+        negate = operator == "!="
+
+        def folder_clause(attributes):
+            selected = np.array([matches(folder) != negate for folder in attributes.folders] or [False])
+            return selected[attributes.column("folder")]
+        return folder_clause
+
+    if field in ("date", "mtime"):
+        start, end = parse_date_range(value)
+
+        def date_clause(attributes):
+            dates = attributes.column("mtime") // 1_000_000_000
+            if field == "date":
+                taken = attributes.column("taken")
+                dates = np.where(taken != NO_DATE, taken, dates)
+            if operator in ("=", ":"):
+                return (dates >= start) & (dates < end)
+            if operator == "!=":
+                return (dates < start) | (dates >= end)
+            if operator == ">":
+                return dates >= end
+            if operator == ">=":
+                return dates >= start
+            if operator == "<":
+                return dates < start
+            return dates < end
+        return date_clause
+
+    number = parse_number(value)
+    compare = COMPARISONS[operator]
+
+    def number_clause(attributes):
+        if field == "pixels":
+            values = attributes.column("width").astype(np.int64) * attributes.column("height")
+        else:
+            values = attributes.column(field)
+        return compare(values, number)
+    return number_clause
+
+
+def parse_filter(text: Optional[str]) -> Optional[ImageFilter]:
+    """Compila una expresión de filtro; devuelve None si está vacía.
+
+    La expresión es una lista de condiciones `campo operador valor` (sin espacios alrededor del
+    operador) que deben cumplirse todas, p. ej. `folder:vacaciones date>=2023-06 pixels>=2M size<5MB`.
+    Los valores con espacios van entre comillas. Lanza ValueError si la expresión no es válida.
+    """
+    text = (text or "").strip()
+    if not text:
+        return None
+    if text.count('"') % 2:
+        raise ValueError("Filtro no válido: faltan comillas de cierre.")
+    clauses = []
+    for token in TOKEN_PATTERN.findall(text):
+        match = CLAUSE_PATTERN.match(token)
+        if not match:
+            raise ValueError(f"Condición no válida: '{token}'. Use campo operador valor, p. ej. width>=1024.")
+        field, operator, value = match.groups()
+        clauses.append(compile_clause(field.lower(), operator, value.replace('"', "").strip()))
+    return ImageFilter(text, clauses)
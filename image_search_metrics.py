@@ -0,0 +1,234 @@
+"""Métricas por etapa (contadores e histogramas de latencia), ritmo de la indexación y perfiles opcionales."""
+
+from __future__ import annotations
+
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+# Límites superiores de los cubos del histograma, en segundos: de 50 µs a ~30 min, duplicando cada vez.
+HISTOGRAM_BOUNDS = tuple(50e-6 * 2 ** i for i in range(26))
+PROFILERS = ("cprofile", "torch")
+
+
+class LatencyHistogram:
+    """Histograma de latencias con cubos exponenciales fijos; los percentiles se estiman por cubo."""
+
+    def __init__(self):
+        self.count = 0
+        self.items = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self.buckets = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+
+    def record(self, seconds: float, items: int = 1):
+        self.count += 1
+        self.items += items
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        self.buckets[bisect.bisect_left(HISTOGRAM_BOUNDS, seconds)] += 1
+
+    def merge(self, state: Tuple[int, int, float, float, float, List[int]]):
+        count, items, total, minimum, maximum, buckets = state
+        self.count += count
+        self.items += items
+        self.total += total
+        self.min = min(self.min, minimum)
+        self.max = max(self.max, maximum)
+        self.buckets = [a + b for a, b in zip(self.buckets, buckets)]
+
+    def state(self) -> Tuple[int, int, float, float, float, List[int]]:
+        return self.count, self.items, self.total, self.min, self.max, list(self.buckets)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Límite superior del cubo que contiene el percentil `q`, acotado por el máximo observado."""
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for i, bucket in enumerate(self.buckets):
+            seen += bucket
+            if bucket and seen >= rank:
+                upper = HISTOGRAM_BOUNDS[i] if i < len(HISTOGRAM_BOUNDS) else self.max
+                return min(upper, self.max)
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "items": self.items,
+            "seconds": self.total,
+            "items_per_s": self.items / self.total if self.total > 0 else None,
+            "mean_ms": self.total / self.count * 1000 if self.count else None,
+            "min_ms": self.min * 1000 if self.count else None,
+            "p50_ms": _to_ms(self.percentile(50)),
+            "p95_ms": _to_ms(self.percentile(95)),
+            "p99_ms": _to_ms(self.percentile(99)),
+            "max_ms": self.max * 1000 if self.count else None,
+        }
+
+
+def _to_ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else seconds * 1000
+
+
+class Metrics:
+    """Contadores e histogramas de latencia por etapa, seguros entre hilos.
+
+    Los procesos de decodificación registran en su propia instancia y devuelven `export()`,
+    que el proceso principal suma con `merge()`.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.counters: Dict[str, int] = {}
+        self.stages: Dict[str, LatencyHistogram] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def time(self, stage: str, items: int = 1):
+        """Mide la duración del bloque y la registra en el histograma de `stage`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start, items)
+
+    def record(self, stage: str, seconds: float, items: int = 1):
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = LatencyHistogram()
+            histogram.record(seconds, items)
+
+    def increment(self, counter: str, amount: int = 1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def export(self) -> dict:
+        """Estado en bruto, para sumarlo en otra instancia con `merge`."""
+        with self._lock:
+            return {"counters": dict(self.counters),
+                    "stages": {stage: histogram.state() for stage, histogram in self.stages.items()}}
+
+    def merge(self, exported: dict):
+        with self._lock:
+            for counter, amount in exported.get("counters", {}).items():
+                self.counters[counter] = self.counters.get(counter, 0) + amount
+            for stage, state in exported.get("stages", {}).items():
+                self.stages.setdefault(stage, LatencyHistogram()).merge(state)
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.counters.clear()
+            self.stages.clear()
+
+    def snapshot(self) -> dict:
+        """Resumen legible de los contadores y de cada etapa (rendimiento y percentiles en ms)."""
+        with self._lock:
+            return {
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self.started)),
+                "uptime_s": time.time() - self.started,
+                "counters": dict(sorted(self.counters.items())),
+                "stages": {stage: histogram.snapshot() for stage, histogram in sorted(self.stages.items())},
+            }
+
+    def dump(self, file_path: str, extra: Optional[dict] = None) -> str:
+        """Escribe el resumen en un archivo JSON y devuelve su ruta."""
+        snapshot = self.snapshot()
+        snapshot.update(extra or {})
+        directory = os.path.dirname(file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Importación diferida: el motor importa este módulo.
+        from image_search_engine import atomic_write
+
+        def writer(tmp_path):
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, indent=2, ensure_ascii=False)
+
+        atomic_write(file_path, writer)
+        logging.info(f"Métricas guardadas en {file_path}")
+        return file_path
+
+
+class ProgressRate:
+    """Ritmo (elementos/s) sobre los últimos segundos y tiempo restante estimado de un proceso con progreso."""
+
+    def __init__(self, window_seconds: float = 10.0):
+        self.window_seconds = window_seconds
+        self.samples: deque = deque()
+
+    def update(self, done: int, total: int) -> Tuple[Optional[float], Optional[float]]:
+        """Registra el avance y devuelve (elementos/s, segundos restantes), o None si aún no se puede estimar."""
+        now = time.monotonic()
+        if not self.samples or done < self.samples[-1][1]:
+            self.samples.clear()
+        self.samples.append((now, done))
+        while len(self.samples) > 2 and now - self.samples[1][0] >= self.window_seconds:
+            self.samples.popleft()
+        first_time, first_done = self.samples[0]
+        if now - first_time <= 0 or done <= first_done:
+            return None, None
+        rate = (done - first_done) / (now - first_time)
+        return rate, max(total - done, 0) / rate
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+@contextmanager
+def profile_run(output_path: str, profiler: str = "cprofile"):
+    """Perfila el bloque con cProfile (archivo .prof para pstats/snakeviz) o con el perfilador de torch.
+
+    El perfil de torch se guarda como traza de Chrome (chrome://tracing o Perfetto) y, junto a ella,
+    una tabla de los operadores más costosos en `<ruta>.txt`.
+    """
+    if profiler not in PROFILERS:
+        raise ValueError(f"Perfilador desconocido: {profiler}. Opciones: {', '.join(PROFILERS)}")
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    if profiler == "cprofile":
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(output_path)
+            logging.info(f"Perfil de cProfile guardado en {output_path}")
+        return
+
+    import torch
+    from torch.profiler import ProfilerActivity, profile as torch_profile
+    activities = [ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(ProfilerActivity.CUDA)
+    with torch_profile(activities=activities, record_shapes=True) as profile:
+        yield
+    profile.export_chrome_trace(output_path)
+    with open(f"{output_path}.txt", "w", encoding="utf-8") as f:
+        f.write(profile.key_averages().table(sort_by="self_cpu_time_total", row_limit=40))
+    logging.info(f"Perfil de torch guardado en {output_path}")
+
+
+def profile_output_path(directory: str, label: str, profiler: str) -> str:
+    """Ruta con marca de tiempo para el perfil de una ejecución."""
+    extension = "prof" if profiler == "cprofile" else "json"
+    return os.path.join(directory, f"{label}-{time.strftime('%Y%m%d-%H%M%S')}.{extension}")
@@ -0,0 +1,134 @@
+"""Preprocesamiento rápido de imágenes para CLIP: decodificación a escala reducida y normalización por lotes."""
+
+from __future__ import annotations
+
+import io
+import math
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import ExifTags, Image
+
+# Lado corto mínimo de la imagen reducida respecto al tamaño de entrada del modelo: con algo de margen
+# el redimensionado final sigue filtrando como el de la imagen completa.
+DRAFT_OVERSAMPLE = 1.5
+EXIF_THUMBNAIL_OFFSET = 0x0201
+EXIF_THUMBNAIL_LENGTH = 0x0202
+# Diferencia de proporción tolerada entre la vista previa EXIF y la imagen.
+PREVIEW_ASPECT_TOLERANCE = 0.01
+
+
+class FastPreprocess:
+    """Equivale a la transformación de CLIP (Resize bicúbico, CenterCrop, ToTensor y Normalize) pero más barata.
+
+    Las fotos grandes no se decodifican a resolución completa: si traen una vista previa EXIF lo
+    bastante grande y con la misma proporción se usa esa, y si no los JPEG se decodifican con
+    `draft` a la menor escala DCT (1/2, 1/4 o 1/8) que conserva `DRAFT_OVERSAMPLE` veces el tamaño
+    de entrada. El redimensionado y el recorte central se hacen en una sola llamada a `resize` sobre
+    la zona recortada, y la conversión a float y la normalización, sobre el lote completo.
+    El objeto se puede enviar a los procesos de decodificación.
+    """
+
+    def __init__(self, size: int, mean: Sequence[float], std: Sequence[float], resample: int = Image.BICUBIC,
+                 use_exif_preview: bool = True):
+        self.size = size
+        self.mean = tuple(float(m) for m in mean)
+        self.std = tuple(float(s) for s in std)
+        self.resample = resample
+        self.use_exif_preview = use_exif_preview
+
+    @classmethod
+    def from_transform(cls, transform, use_exif_preview: bool = True) -> Optional["FastPreprocess"]:
+        """Crea el equivalente de una transformación de torchvision como la de CLIP.
+
+        Devuelve None si la transformación tiene otros pasos o parámetros que no se pueden reproducir.
+        """
+        try:
+            from torchvision import transforms as T
+        except ImportError:
+            return None
+        if not isinstance(transform, T.Compose):
+            return None
+        steps = {}
+        for step in transform.transforms:
+            if isinstance(step, (T.Resize, T.CenterCrop, T.Normalize)):
+                steps[type(step)] = step
+            elif not (isinstance(step, T.ToTensor) or getattr(step, "__name__", "") == "_convert_image_to_rgb"):
+                return None
+        resize, crop, normalize = steps.get(T.Resize), steps.get(T.CenterCrop), steps.get(T.Normalize)
+        if resize is None or crop is None or normalize is None or resize.max_size is not None:
+            return None
+        size = resize.size if isinstance(resize.size, int) else resize.size[0] if len(resize.size) == 1 else None
+        resample = {T.InterpolationMode.BICUBIC: Image.BICUBIC, T.InterpolationMode.BILINEAR: Image.BILINEAR,
+                    T.InterpolationMode.NEAREST: Image.NEAREST}.get(resize.interpolation)
+        if size is None or resample is None or tuple(crop.size) != (size, size):
+            return None
+        return cls(size, normalize.mean, normalize.std, resample, use_exif_preview)
+
+    def reduce(self, img: Image.Image) -> Image.Image:
+        """Imagen RGB más pequeña de la que se obtiene el mismo recorte: la vista previa EXIF o el JPEG reducido.
+
+        Debe llamarse antes de que se decodifiquen los píxeles de `img` (justo después de Image.open).
+        """
+        target = self.size * DRAFT_OVERSAMPLE
+        width, height = img.size
+        scale = target / min(width, height)
+        if scale < 1:
+            preview = self.exif_preview(img, target) if self.use_exif_preview else None
+            if preview is not None:
+                return preview
+            img.draft("RGB", (math.ceil(width * scale), math.ceil(height * scale)))
+        return img.convert("RGB") if img.mode != "RGB" else img
+
+    @staticmethod
+    def exif_preview(img: Image.Image, min_side: float) -> Optional[Image.Image]:
+        """Vista previa JPEG incrustada en el EXIF (IFD1) si su lado corto llega a `min_side` y tiene la misma proporción."""
+        raw = img.info.get("exif")
+        if not raw:
+            return None
+        try:
+            thumbnail_ifd = img.getexif().get_ifd(ExifTags.IFD.IFD1)
+            offset, length = thumbnail_ifd.get(EXIF_THUMBNAIL_OFFSET), thumbnail_ifd.get(EXIF_THUMBNAIL_LENGTH)
+            if not offset or not length:
+                return None
+            # Los desplazamientos son relativos a la cabecera TIFF, que va tras el prefijo "Exif\0\0".
+            start = offset + 6 if raw.startswith(b"Exif\x00\x00") else offset
+            preview = Image.open(io.BytesIO(raw[start:start + length]))
+            if min(preview.size) < min_side:
+                return None
+            aspect = img.width / img.height
+            if abs(preview.width / preview.height - aspect) > PREVIEW_ASPECT_TOLERANCE * aspect:
+                return None
+            return preview.convert("RGB")
+        except Exception:
+            return None
+
+    def crop_box(self, width: int, height: int) -> Tuple[float, float, float, float]:
+        """Zona de la imagen (en sus coordenadas) que acaba en el recorte central tras redimensionar como torchvision."""
+        short, long = (width, height) if width <= height else (height, width)
+        new_short, new_long = self.size, int(self.size * long / short)
+        new_width, new_height = (new_short, new_long) if width <= height else (new_long, new_short)
+        left = int(round((new_width - self.size) / 2.0))
+        top = int(round((new_height - self.size) / 2.0))
+        scale_x, scale_y = width / new_width, height / new_height
+        return left * scale_x, top * scale_y, (left + self.size) * scale_x, (top + self.size) * scale_y
+
+    def crop_array(self, img: Image.Image) -> np.ndarray:
+        """Redimensiona y recorta una imagen RGB en una sola operación; devuelve un array uint8 (size, size, 3)."""
+        cropped = img.resize((self.size, self.size), self.resample, box=self.crop_box(*img.size))
+        return np.asarray(cropped, dtype=np.uint8)
+
+    def to_tensor(self, arrays: List[np.ndarray]):
+        """Convierte los recortes uint8 en un tensor float32 (N, 3, size, size) normalizado, de una vez para todo el lote."""
+        import torch
+        batch = torch.from_numpy(np.stack(arrays))
+        scale = torch.tensor([1.0 / (255.0 * s) for s in self.std])
+        offset = torch.tensor([-m / s for m, s in zip(self.mean, self.std)])
+        return torch.addcmul(offset, batch.float(), scale).permute(0, 3, 1, 2).contiguous()
+
+    def batch(self, images: List[Image.Image]):
+        """Preprocesa imágenes ya abiertas (sin decodificar aún, si es posible) y devuelve el tensor del lote."""
+        return self.to_tensor([self.crop_array(self.reduce(img)) for img in images])
+
+    def __call__(self, img: Image.Image):
+        return self.batch([img])[0]
@@ -0,0 +1,290 @@
+"""Servidor HTTP local de búsqueda: agrupa las consultas concurrentes en lotes para el modelo y el índice."""
+
+from __future__ import annotations
+
+import base64
+import binascii
+import io
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from PIL import Image
+
+from image_search_engine import ImageSearchEngine, QueryEmbeddingCache
+from image_search_filters import ImageFilter, parse_filter
+
+REQUEST_TIMEOUT = 60
+MAX_K = 1000
+
+
+class QueryError(ValueError):
+    """Consulta inválida: texto vacío, imagen ilegible o parámetros incorrectos."""
+
+
+class PendingQuery:
+    def __init__(self, query_type: str, query, k: int, image_filter: Optional[ImageFilter] = None):
+        self.query_type = query_type
+        self.query = query
+        self.k = k
+        self.image_filter = image_filter
+        self.future = Future()
+
+
+class QueryBatcher:
+    """Agrupa las consultas que llegan dentro de una ventana de tiempo y las resuelve juntas.
+
+    Un único hilo usa el modelo: por cada lote hace como mucho una llamada a encode_text, una a
+    encode_image y una a index.search (una por filtro distinto), así que el coste crece con los lotes
+    y no con las peticiones.
+    """
+
+    def __init__(self, engine: ImageSearchEngine, window_ms: float = 5, max_batch_size: int = 64):
+        self.engine = engine
+        self.window = window_ms / 1000
+        self.max_batch_size = max(1, max_batch_size)
+        self.queue = queue.Queue()
+        self.stats_lock = threading.Lock()
+        self.num_queries = 0
+        self.num_batches = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, query_type: str, query, k: int, image_filter: Optional[ImageFilter] = None) -> Future:
+        """Encola una consulta (`text`, `image` con una ruta o `image_bytes`) y devuelve su resultado futuro."""
+        pending = PendingQuery(query_type, query, k, image_filter)
+        self.queue.put(pending)
+        return pending.future
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        running = True
+        while running:
+            first = self.queue.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+            try:
+                self.process(batch)
+            except Exception as e:
+                logging.error(f"Error al procesar un lote de consultas: {e}")
+                for pending in batch:
+                    if not pending.future.done():
+                        pending.future.set_exception(e)
+
+    def process(self, batch: List[PendingQuery]):
+        """Codifica las consultas del lote que no están en la caché y las busca con un solo index.search."""
+        engine = self.engine
+        features: List[Optional[np.ndarray]] = [None] * len(batch)
+        text_misses: List[Tuple[int, str]] = []
+        image_misses: List[Tuple[int, str, Image.Image]] = []
+
+        for i, pending in enumerate(batch):
+            try:
+                if pending.query_type == "text":
+                    key = QueryEmbeddingCache.text_key(pending.query)
+                    features[i] = engine.query_cache.get(key)
+                    if features[i] is None:
+                        text_misses.append((i, key))
+                else:
+                    data = pending.query
+                    if pending.query_type == "image":
+                        with open(pending.query, "rb") as f:
+                            data = f.read()
+                    key = QueryEmbeddingCache.image_bytes_key(data)
+                    features[i] = engine.query_cache.get(key)
+                    if features[i] is None:
+                        image_misses.append((i, key, Image.open(io.BytesIO(data))))
+            except (OSError, Image.UnidentifiedImageError) as e:
+                pending.future.set_exception(QueryError(f"No se pudo leer la imagen de consulta: {e}"))
+
+        if text_misses:
+            encoded = engine.encode_texts([batch[i].query for i, _ in text_misses])
+            for row, (i, key) in enumerate(text_misses):
+                if encoded is not None:
+                    features[i] = encoded[row]
+                    engine.query_cache.put(key, encoded[row])
+        if image_misses:
+            images = [img for _, _, img in image_misses]
+            encoded = engine.encode_images(images)
+            rows: List[Optional[np.ndarray]] = list(encoded) if encoded is not None else [None] * len(images)
+            if encoded is None and len(images) > 1:
+                # Las imágenes se decodifican al codificarlas: una dañada hace fallar el lote entero, así que
+                # se repite una a una para que solo falle su consulta.
+                logging.warning("Error al codificar el lote de imágenes de consulta; se codifican una a una.")
+                rows = [None if single is None else single[0]
+                        for single in (engine.encode_images([img]) for img in images)]
+            for row, (i, key, img) in zip(rows, image_misses):
+                img.close()
+                if row is not None:
+                    features[i] = row
+                    engine.query_cache.put(key, row)
+
+        ready = [i for i, feature in enumerate(features) if feature is not None and not batch[i].future.done()]
+        ready_set = set(ready)
+        for i, pending in enumerate(batch):
+            if i not in ready_set and not pending.future.done():
+                pending.future.set_exception(QueryError("No se pudieron extraer las características de la consulta."))
+        # Las consultas con el mismo filtro se buscan juntas.
+        groups = {}
+        for i in ready:
+            image_filter = batch[i].image_filter
+            groups.setdefault(str(image_filter) if image_filter else "", []).append(i)
+        for group in groups.values():
+            k = max(batch[i].k for i in group)
+            results = engine.search_features(np.stack([features[i] for i in group]), k, batch[group[0]].image_filter)
+            for i, matches in zip(group, results):
+                batch[i].future.set_result(matches[:batch[i].k])
+
+        with self.stats_lock:
+            self.num_queries += len(batch)
+            self.num_batches += 1
+
+    def stats(self) -> dict:
+        with self.stats_lock:
+            return {
+                "queries": self.num_queries,
+                "batches": self.num_batches,
+                "mean_batch_size": self.num_queries / self.num_batches if self.num_batches else 0.0,
+                "pending": self.queue.qsize(),
+            }
+
+
+class SearchRequestHandler(BaseHTTPRequestHandler):
+    """GET /search?q=texto&k=5&filter=..., POST /search con JSON {"text"|"image"|"image_base64", "k", "filter"},
+    GET /health, /stats y /metrics."""
+
+    server: "SearchServer"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/health":
+            self.send_json(200, {"status": "ok", "images": self.server.engine.count_indexed_images()})
+        elif url.path == "/stats":
+            self.send_json(200, self.server.batcher.stats())
+        elif url.path == "/metrics":
+            self.send_json(200, {**self.server.engine.metrics_snapshot(), "batcher": self.server.batcher.stats()})
+        elif url.path == "/search":
+            params = parse_qs(url.query)
+            self.handle_search({"text": params.get("q", [""])[0], "k": params.get("k", [None])[0],
+                                "filter": params.get("filter", [None])[0]})
+        else:
+            self.send_json(404, {"error": "Ruta desconocida."})
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/search":
+            self.send_json(404, {"error": "Ruta desconocida."})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except (ValueError, json.JSONDecodeError):
+            self.send_json(400, {"error": "El cuerpo de la petición no es un JSON válido."})
+            return
+        if not isinstance(body, dict):
+            self.send_json(400, {"error": "El cuerpo de la petición debe ser un objeto JSON."})
+            return
+        self.handle_search(body)
+
+    def handle_search(self, request: dict):
+        if not self.server.slots.acquire(blocking=False):
+            self.send_json(503, {"error": "Servidor ocupado. Inténtelo de nuevo."}, {"Retry-After": "1"})
+            return
+        try:
+            query_type, query, k = self.parse_query(request)
+            try:
+                image_filter = parse_filter(str(request.get("filter") or ""))
+            except ValueError as e:
+                raise QueryError(str(e))
+            future = self.server.batcher.submit(query_type, query, k, image_filter)
+            matches = future.result(timeout=REQUEST_TIMEOUT)
+        except QueryError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            logging.error(f"Error al atender la búsqueda: {e}")
+            self.send_json(500, {"error": str(e)})
+            return
+        finally:
+            self.server.slots.release()
+
+        self.send_json(200, {
+            "query": request.get("text") or request.get("image") or "",
+            "type": "text" if query_type == "text" else "image",
+            "results": [{"rank": rank, "path": path, "score": score}
+                        for rank, (path, score) in enumerate(matches, start=1)],
+        })
+
+    def parse_query(self, request: dict) -> Tuple[str, object, int]:
+        try:
+            k = int(request.get("k") or 5)
+        except (TypeError, ValueError):
+            raise QueryError("El parámetro k debe ser un número entero.")
+        if not 1 <= k <= MAX_K:
+            raise QueryError(f"El parámetro k debe estar entre 1 y {MAX_K}.")
+
+        if request.get("text"):
+            return "text", str(request["text"]), k
+        if request.get("image"):
+            return "image", str(request["image"]), k
+        if request.get("image_base64"):
+            try:
+                return "image_bytes", base64.b64decode(request["image_base64"], validate=True), k
+            except (binascii.Error, ValueError):
+                raise QueryError("image_base64 no contiene datos base64 válidos.")
+        raise QueryError("Indique una consulta: text, image o image_base64.")
+
+    def send_json(self, status: int, payload: dict, headers: Optional[dict] = None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} - {format % args}")
+
+
+class SearchServer(ThreadingHTTPServer):
+    """Servidor HTTP que comparte un motor cargado entre todas las peticiones."""
+
+    daemon_threads = True
+
+    def __init__(self, engine: ImageSearchEngine, host: Optional[str] = None, port: Optional[int] = None):
+        config = engine.config
+        super().__init__((host or config.get("server_host", "127.0.0.1"),
+                          config.get("server_port", 8765) if port is None else port), SearchRequestHandler)
+        self.engine = engine
+        self.batcher = QueryBatcher(engine, config.get("server_batch_window_ms", 5),
+                                    config.get("server_max_batch_size", 64))
+        self.slots = threading.BoundedSemaphore(config.get("server_max_concurrent_requests", 256))
+
+    def server_close(self):
+        super().server_close()
+        self.batcher.stop()
@@ -0,0 +1,193 @@
+"""Vigilancia de los directorios indexados: agrupa los cambios y actualiza el índice en segundo plano."""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from typing import Callable, List, Optional, Set
+
+from image_search_engine import IMAGE_EXTENSIONS, ImageSearchEngine, IndexingCancelled, IndexingError
+
+WATCH_BACKENDS = ("auto", "watchdog", "polling")
+# Eventos de watchdog que no indican cambios en el contenido.
+IGNORED_EVENT_TYPES = ("opened", "closed_no_write")
+# Eventos de directorio que se tienen en cuenta: un subárbol que desaparece (borrado o movido fuera)
+# no genera eventos por cada imagen. Los de creación y modificación (cada alta o baja de un archivo
+# modifica su carpeta) se descartan: las imágenes que contienen ya llegan como eventos propios.
+DIRECTORY_EVENT_TYPES = ("deleted", "moved")
+
+
+class DirectoryWatcher:
+    """Vigila los directorios raíz del motor y aplica los cambios con `refresh_changed`.
+
+    Usa watchdog (inotify, FSEvents o ReadDirectoryChangesW) si está instalado y, si no, compara
+    cada `watch_poll_interval_s` segundos el manifiesto de cada fragmento con el del índice.
+    Las ráfagas de eventos se agrupan: la actualización empieza cuando pasan `watch_debounce_s`
+    segundos sin cambios, o `watch_max_delay_s` desde el primero si los cambios no cesan.
+    Las búsquedas siguen usando los fragmentos anteriores hasta que la actualización termina.
+    """
+
+    def __init__(self, engine: ImageSearchEngine, on_update: Optional[Callable[[List[str]], None]] = None):
+        config = engine.config
+        self.engine = engine
+        self.backend = config.get("watch_backend", "auto")
+        self.debounce = float(config.get("watch_debounce_s", 2.0))
+        self.max_delay = max(self.debounce, float(config.get("watch_max_delay_s", 30.0)))
+        self.poll_interval = float(config.get("watch_poll_interval_s", 10.0))
+        self.on_update = on_update or (lambda refreshed: None)
+        self.ignored_dirs = [os.path.abspath(engine.index_dir), os.path.abspath(engine.thumbnail_store.directory)]
+        self.pending: Set[str] = set()
+        self.reported: Set[tuple] = set()
+        self.first_event: Optional[float] = None
+        self.last_event: Optional[float] = None
+        self.condition = threading.Condition()
+        self.stop_event = threading.Event()
+        self.observer = None
+        self.threads: List[threading.Thread] = []
+
+    def start(self) -> "DirectoryWatcher":
+        if self.backend not in WATCH_BACKENDS:
+            raise ValueError(f"Modo de vigilancia desconocido: {self.backend}. Opciones: {', '.join(WATCH_BACKENDS)}")
+        if self.backend in ("auto", "watchdog"):
+            try:
+                self.observer = self.start_observer()
+            except ImportError:
+                if self.backend == "watchdog":
+                    raise
+                logging.info("watchdog no está instalado; los directorios se vigilarán por sondeo.")
+        if self.observer is None:
+            self.threads.append(threading.Thread(target=self.poll, name="watch-poll", daemon=True))
+        self.threads.append(threading.Thread(target=self.run, name="watch-update", daemon=True))
+        for thread in self.threads:
+            thread.start()
+        logging.info(f"Vigilando {', '.join(self.engine.root_dirs())} "
+                     f"({'eventos del sistema' if self.observer is not None else 'sondeo'}).")
+        return self
+
+    def stop(self, wait: bool = True):
+        """Detiene la vigilancia; una actualización en curso termina igualmente. Con `wait` se espera a los hilos."""
+        self.stop_event.set()
+        with self.condition:
+            self.condition.notify_all()
+        if self.observer is not None:
+            self.observer.stop()
+        if not wait:
+            return
+        if self.observer is not None:
+            self.observer.join()
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join()
+
+    def start_observer(self):
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                watcher.handle_event(event)
+
+        observer = Observer()
+        for root in self.engine.root_dirs():
+            observer.schedule(Handler(), root, recursive=self.engine.config.get("recursive", True))
+        observer.start()
+        return observer
+
+    def handle_event(self, event):
+        """Filtra un evento de watchdog antes de registrarlo, para que el ruido no reinicie la espera."""
+        if event.event_type in IGNORED_EVENT_TYPES:
+            return
+        if event.is_directory:
+            if event.event_type in DIRECTORY_EVENT_TYPES:
+                self.notify(os.fsdecode(event.src_path), True)
+            return
+        for path in (event.src_path, getattr(event, "dest_path", "")):
+            if path and os.fsdecode(path).lower().endswith(IMAGE_EXTENSIONS):
+                self.notify(os.fsdecode(path))
+
+    def notify(self, path: str, is_directory: bool = False):
+        """Registra un cambio en `path`; se ignoran los archivos que no son imágenes y los del propio índice."""
+        if not is_directory and not path.lower().endswith(IMAGE_EXTENSIONS):
+            return
+        path = os.path.abspath(path)
+        if any(path == d or path.startswith(d + os.sep) for d in self.ignored_dirs):
+            return
+        with self.condition:
+            now = time.monotonic()
+            self.pending.add(path)
+            if self.first_event is None:
+                self.first_event = now
+            self.last_event = now
+            self.condition.notify_all()
+
+    def poll(self):
+        """Detecta los cambios comparando el contenido de los directorios con el de cada fragmento.
+
+        Solo se notifican las diferencias que no estaban en el sondeo anterior; las que siguen pendientes
+        mientras se actualiza el índice no reinician la espera.
+        """
+        while not self.stop_event.wait(self.poll_interval):
+            try:
+                changes = set(self.scan_changes())
+                for path, is_directory in changes - self.reported:
+                    self.notify(path, is_directory)
+                self.reported = changes
+            except Exception as e:
+                logging.warning(f"Error al comprobar los cambios de los directorios: {e}")
+
+    def scan_changes(self) -> List[tuple]:
+        """Rutas que difieren entre los directorios y el índice cargado, y subárboles nuevos o eliminados."""
+        changes = []
+        shards = list(self.engine.shards)
+        for shard in shards:
+            try:
+                manifest = shard.scan_image_dir()
+            except OSError:
+                changes.append((shard.image_dir, True))
+                continue
+            added, removed, modified = shard.diff_metadata(shard.index_metadata, manifest)
+            changes += [(path, False) for path in added + removed + modified]
+        planned = {(shard.image_dir, shard.recursive) for shard in self.engine.plan_shards()}
+        current = {(shard.image_dir, shard.recursive) for shard in shards}
+        changes += [(image_dir, True) for image_dir, _ in planned ^ current]
+        return changes
+
+    def run(self):
+        """Espera a que se calme cada ráfaga de cambios y actualiza los fragmentos afectados."""
+        while True:
+            with self.condition:
+                while not self.pending and not self.stop_event.is_set():
+                    self.condition.wait()
+                while not self.stop_event.is_set():
+                    remaining = min(self.last_event + self.debounce, self.first_event + self.max_delay) - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                if self.stop_event.is_set():
+                    return
+                paths, self.pending = self.pending, set()
+                self.first_event = self.last_event = None
+
+            logging.info(f"Cambios detectados en {len(paths)} rutas. Actualizando el índice...")
+            shards = self.engine.shards
+            try:
+                refreshed = self.engine.refresh_changed(paths)
+            except IndexingCancelled:
+                logging.info("Actualización automática cancelada; se reintentará más tarde.")
+                for path in paths:
+                    self.notify(path, os.path.isdir(path))
+                continue
+            except IndexingError as e:
+                logging.warning(f"No se pudo actualizar el índice automáticamente: {e}")
+                continue
+            except Exception as e:
+                logging.error(f"Error en la actualización automática del índice: {e}")
+                continue
+            # El índice ya refleja los cambios: el siguiente sondeo vuelve a compararlo todo.
+            self.reported = set()
+            if self.engine.shards is not shards:
+                self.on_update(refreshed)
@@ -0,0 +1,41 @@
+"""Configuración común de las pruebas: los módulos del proyecto se importan desde la raíz del repositorio."""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def write_images(directory: str, count: int, size=(64, 48), seed: int = 0, prefix: str = "img"):
+    """Crea `count` JPEG de ruido en `directory` y devuelve sus rutas."""
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"{prefix}{i:03d}.jpg")
+        Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)).save(path)
+        paths.append(path)
+    return paths
+
+
+@pytest.fixture
+def make_engine(tmp_path, monkeypatch):
+    """Crea motores con el codificador aleatorio del benchmark (CPU, sin descargar CLIP) en `tmp_path`."""
+    pytest.importorskip("torch")
+    pytest.importorskip("faiss")
+    from image_search_benchmark import create_benchmark_engine
+
+    monkeypatch.chdir(tmp_path)
+
+    def factory(image_dir: str, batch_size: int = 8, decode_workers: int = 0, index_dir: str = "index",
+                embedding_store=None, **config):
+        engine = create_benchmark_engine("random", image_dir, str(tmp_path / index_dir), str(tmp_path / "thumbnails"),
+                                         decode_workers, batch_size, 0, embedding_store)
+        engine.config.update(config)
+        return engine
+
+    return factory
@@ -0,0 +1,90 @@
+"""Pruebas de los puntos de control: una indexación interrumpida se reanuda sin repetir lo ya confirmado."""
+
+import json
+
+import numpy as np
+import pytest
+
+from conftest import write_images
+from image_search_engine import IndexingCancelled
+
+
+def count_encoded(engine):
+    """Envuelve encode_image_batch para contar las imágenes que pasan por el modelo."""
+    encoded = []
+    original = engine.encode_image_batch
+
+    def counting(batch_images):
+        encoded.append(len(batch_images))
+        return original(batch_images)
+
+    engine.encode_image_batch = counting
+    return encoded
+
+
+def read_header(engine):
+    with open(engine.plan_shards()[0].header_file, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def assert_same_results(engine, reference):
+    query = np.random.default_rng(1).standard_normal(engine.feature_dim).astype(np.float32)
+    actual, expected = engine.search(query, k=20), reference.search(query, k=20)
+    assert [path for path, _ in actual] == [path for path, _ in expected]
+    np.testing.assert_allclose([s for _, s in actual], [s for _, s in expected], atol=1e-5)
+
+
+def test_cancelled_run_resumes_from_checkpoint(make_engine, tmp_path):
+    root = str(tmp_path / "fotos")
+    write_images(root, 20)
+    engine = make_engine(root, batch_size=4)
+
+    def cancel_after_two_batches(done, total):
+        if done >= 8:
+            engine.cancel_indexing()
+
+    engine.progress_callback = cancel_after_two_batches
+    with pytest.raises(IndexingCancelled):
+        engine.index_images()
+    header = read_header(engine)
+    assert header["complete"] is False and header["files"]["index"] is None
+    assert header["num_vectors"] == 8
+
+    resumed = make_engine(root, batch_size=4)
+    assert not resumed.is_index_valid() and resumed.can_update_incrementally()
+    encoded = count_encoded(resumed)
+    resumed.update_index_incremental()
+    assert sum(encoded) == 12
+    assert resumed.count_indexed_images() == 20
+    assert read_header(resumed)["complete"] is True
+    assert resumed.is_index_valid()
+
+    reference = make_engine(root, batch_size=4, index_dir="reference")
+    reference.index_images()
+    assert_same_results(resumed, reference)
+
+
+def test_crash_resumes_from_last_periodic_checkpoint(make_engine, tmp_path):
+    root = str(tmp_path / "fotos")
+    write_images(root, 20)
+    engine = make_engine(root, batch_size=4, checkpoint_interval=1e-9)
+
+    def crash(done, total):
+        if done == 12:
+            raise RuntimeError("cierre inesperado")
+
+    engine.progress_callback = crash
+    with pytest.raises(RuntimeError):
+        engine.index_images()
+    # El tercer lote se añadió al índice en memoria, pero el último punto de control es el del segundo.
+    assert read_header(engine)["num_vectors"] == 8
+
+    resumed = make_engine(root, batch_size=4)
+    encoded = count_encoded(resumed)
+    resumed.update_index_incremental()
+    assert sum(encoded) == 12
+    assert resumed.count_indexed_images() == 20
+
+    reference = make_engine(root, batch_size=4, index_dir="reference")
+    reference.index_images()
+    assert_same_results(resumed, reference)
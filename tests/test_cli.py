@@ -0,0 +1,50 @@
+"""Pruebas de la línea de comandos que no necesitan el modelo."""
+
+import argparse
+import os
+
+import pytest
+
+from conftest import write_images
+from image_search_cli import benchmark_image_paths, parse_worker_counts, read_queries
+
+
+def test_benchmark_image_paths_walks_every_root(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    first = write_images(str(tmp_path / "a"), 2) + write_images(str(tmp_path / "a" / "sub"), 2, prefix="s")
+    second = write_images(str(tmp_path / "b"), 3)
+    (tmp_path / "b" / "notas.txt").write_text("no es una imagen")
+    image_dir = os.pathsep.join([str(tmp_path / "a"), str(tmp_path / "b")])
+
+    found_dir, paths = benchmark_image_paths(argparse.Namespace(image_dir=image_dir, images=100))
+    assert found_dir == image_dir
+    assert paths == sorted(first + second)
+
+    _, limited = benchmark_image_paths(argparse.Namespace(image_dir=image_dir, images=3))
+    assert limited == sorted(first + second)[:3]
+
+
+def test_benchmark_image_paths_rejects_missing_roots(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_images(str(tmp_path / "a"), 1)
+    with pytest.raises(SystemExit):
+        benchmark_image_paths(argparse.Namespace(image_dir=os.pathsep.join([str(tmp_path / "a"),
+                                                                            str(tmp_path / "no")]), images=5))
+    with pytest.raises(SystemExit):
+        benchmark_image_paths(argparse.Namespace(image_dir="", images=5))
+
+
+def test_read_queries_distinguishes_images(tmp_path):
+    queries = tmp_path / "consultas.txt"
+    queries.write_text("un perro en la playa\n\nimage:/fotos/gato.jpg\n  atardecer  \n", encoding="utf-8")
+    assert read_queries(str(queries)) == [("text", "un perro en la playa"), ("image", "/fotos/gato.jpg"),
+                                          ("text", "atardecer")]
+
+
+def test_parse_worker_counts():
+    assert parse_worker_counts("0,2,4") == [0, 2, 4]
+    assert parse_worker_counts("") == []
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_worker_counts("2,x")
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_worker_counts("-1")
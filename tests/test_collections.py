@@ -0,0 +1,79 @@
+"""Pruebas de las colecciones con nombre y de la mezcla de resultados entre índices."""
+
+import os
+
+import numpy as np
+import pytest
+
+import image_search_engine
+from conftest import write_images
+from image_search_collections import CollectionManager, collection_dir_name, merge_top_k
+from image_search_engine import ImageSearchEngine
+
+
+def test_merge_top_k_orders_by_score_and_deduplicates():
+    first = [("a", 0.9), ("b", 0.7), ("c", 0.1)]
+    second = [("b", 0.8), ("d", 0.75), ("a", 0.2)]
+    assert merge_top_k([first, second], 3) == [("a", 0.9), ("b", 0.8), ("d", 0.75)]
+    assert merge_top_k([first, second], 10) == [("a", 0.9), ("b", 0.8), ("d", 0.75), ("c", 0.1)]
+    assert merge_top_k([[], []], 5) == []
+
+
+def test_collection_dir_names_are_safe_and_distinct():
+    names = {collection_dir_name(name) for name in ("Viajes 2023", "Viajes/2023", "viajes 2023", "../..")}
+    assert len(names) == 4
+    assert all(os.sep not in name and not name.startswith(".") for name in names)
+
+
+class RecordingEngine(ImageSearchEngine):
+    """Registra si la caché de consultas ya existía cuando se asignó el modelo."""
+
+    def __setattr__(self, name, value):
+        if name == "model" and value is not None:
+            self.__dict__["cache_when_model_set"] = self.__dict__.get("query_cache")
+        super().__setattr__(name, value)
+
+
+def test_load_model_assigns_model_last(tmp_path, monkeypatch):
+    pytest.importorskip("clip")
+    from image_search_benchmark import create_random_encoder, random_preprocess
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(image_search_engine, "load_clip_model",
+                        lambda precision, device=None: (create_random_encoder(), random_preprocess, None, "fp32"))
+    engine = RecordingEngine({"query_cache_persist": False, "embedding_store": None})
+    engine.load_model()
+    assert engine.model is not None
+    assert engine.cache_when_model_set is engine.query_cache is not None
+
+
+def test_shared_engine_receives_model_last(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    base = ImageSearchEngine({"embedding_store": None})
+    base.model, base.query_cache = object(), object()
+    engine = RecordingEngine({"embedding_store": None})
+    engine.share_model(base)
+    assert engine.cache_when_model_set is base.query_cache
+
+
+def test_search_across_collections(make_engine, tmp_path):
+    write_images(str(tmp_path / "viajes"), 6, seed=1)
+    write_images(str(tmp_path / "familia"), 5, seed=2)
+    base = make_engine(str(tmp_path / "viajes"), collection_cache_size=1)
+    manager = CollectionManager(base, str(tmp_path / "collections.json"), str(tmp_path / "collections"))
+    for name in ("viajes", "familia"):
+        manager.add(name, str(tmp_path / name))
+        manager.engine_for(name).index_images()
+        manager.touch(name)
+    assert list(manager.loaded) == ["familia"]
+
+    query = np.random.default_rng(0).standard_normal((2, base.feature_dim)).astype(np.float32)
+    results = manager.search_features(["viajes", "familia"], query, k=20)
+    assert [len(matches) for matches in results] == [11, 11]
+    scores = [score for _, score in results[0]]
+    assert scores == sorted(scores, reverse=True)
+    assert {os.path.basename(os.path.dirname(path)) for path, _ in results[0]} == {"viajes", "familia"}
+    assert base.metrics.export()["counters"]["collection_evictions"] >= 1
+
+    reloaded = CollectionManager(base, str(tmp_path / "collections.json"), str(tmp_path / "collections"))
+    assert reloaded.names() == ["familia", "viajes"]
@@ -0,0 +1,85 @@
+"""Pruebas de la detección de casi duplicados (UnionFind y find_near_duplicates)."""
+
+import math
+import os
+
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+
+from image_search_engine import ImageSearchEngine, IndexShard, PathTable, UnionFind, VectorStore  # noqa: E402
+
+DIM = 8
+
+
+def unit_vector(degrees: float) -> np.ndarray:
+    """Vector unitario en el plano de las dos primeras dimensiones."""
+    vector = np.zeros(DIM, dtype=np.float32)
+    vector[0], vector[1] = math.cos(math.radians(degrees)), math.sin(math.radians(degrees))
+    return vector
+
+
+def make_shard(engine: ImageSearchEngine, root: str, name: str, vectors: np.ndarray) -> IndexShard:
+    image_dir = os.path.join(root, name)
+    shard = IndexShard(engine, image_dir, True, os.path.join(root, "index", name))
+    os.makedirs(shard.index_dir)
+    shard.index = faiss.IndexIDMap2(faiss.IndexFlatIP(DIM))
+    shard.index.add_with_ids(vectors, np.arange(len(vectors), dtype=np.int64))
+    shard.image_paths = PathTable()
+    shard.image_paths.extend(os.path.join(image_dir, f"{i}.jpg") for i in range(len(vectors)))
+    shard.vector_store = VectorStore.create(os.path.join(shard.index_dir, "vectors.f32"), DIM)
+    shard.vector_store.append(vectors)
+    return shard
+
+
+@pytest.fixture
+def engine(make_engine, tmp_path):
+    engine = make_engine(str(tmp_path / "fotos"))
+    engine.feature_dim = DIM
+    return engine
+
+
+def cluster_names(report):
+    return [sorted(os.path.relpath(path, os.path.dirname(os.path.dirname(path))) for path in cluster["images"])
+            for cluster in report]
+
+
+def test_union_find_groups_and_sizes():
+    groups = UnionFind(6)
+    groups.union(0, 1)
+    groups.union(2, 3)
+    groups.union(1, 3)
+    assert len({groups.find(i) for i in range(4)}) == 1
+    assert groups.find(4) != groups.find(5)
+    assert groups.size[groups.find(0)] == 4
+    groups.union(0, 3)
+    assert groups.size[groups.find(0)] == 4
+
+
+def test_pair_found_only_from_higher_id_is_kept(engine, tmp_path):
+    """b (ID 1) tiene a (ID 0) entre sus vecinos, pero a solo ve a c con k=1: el grupo debe incluir a b."""
+    vectors = np.stack([unit_vector(0), unit_vector(-8), unit_vector(5), unit_vector(90)])
+    engine.shards = [make_shard(engine, str(tmp_path), "fotos", vectors)]
+    report = engine.find_near_duplicates(threshold=0.98, k=1)
+    assert cluster_names(report) == [["fotos/0.jpg", "fotos/1.jpg", "fotos/2.jpg"]]
+    assert report[0]["size"] == 3
+    assert report[0]["min_similarity"] == pytest.approx(math.cos(math.radians(8)), abs=1e-5)
+    assert report[0]["max_similarity"] == pytest.approx(math.cos(math.radians(5)), abs=1e-5)
+
+
+def test_pairs_across_shards_are_joined_once(engine, tmp_path):
+    first = np.stack([unit_vector(0), unit_vector(5), unit_vector(90)])
+    second = np.stack([unit_vector(-8), unit_vector(180)])
+    engine.shards = [make_shard(engine, str(tmp_path), "a", first), make_shard(engine, str(tmp_path), "b", second)]
+    report = engine.find_near_duplicates(threshold=0.98, k=1)
+    assert cluster_names(report) == [["a/0.jpg", "a/1.jpg", "b/0.jpg"]]
+
+
+def test_removed_images_and_dissimilar_vectors_are_ignored(engine, tmp_path):
+    vectors = np.stack([unit_vector(0), unit_vector(1), unit_vector(45), unit_vector(46)])
+    shard = make_shard(engine, str(tmp_path), "fotos", vectors)
+    shard.image_paths[1] = None
+    shard.index.remove_ids(np.array([1], dtype=np.int64))
+    engine.shards = [shard]
+    assert cluster_names(engine.find_near_duplicates(threshold=0.99, k=3)) == [["fotos/2.jpg", "fotos/3.jpg"]]
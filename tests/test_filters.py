@@ -0,0 +1,94 @@
+"""Pruebas de las expresiones de filtro (image_search_filters)."""
+
+import os
+import time
+
+import numpy as np
+import pytest
+
+from image_search_engine import AttributeTable, NO_DATE
+from image_search_filters import parse_date_range, parse_filter, parse_number
+
+
+def local_time(year, month, day, hour=0, minute=0) -> int:
+    return int(time.mktime((year, month, day, hour, minute, 0, 0, 0, -1)))
+
+
+@pytest.fixture
+def attributes(tmp_path):
+    """Cuatro imágenes en dos carpetas con tamaños, dimensiones y fechas distintos."""
+    table = AttributeTable()
+    vacaciones = os.path.join(str(tmp_path), "fotos", "Vacaciones")
+    casa = os.path.join(str(tmp_path), "fotos", "casa")
+    june = local_time(2023, 6, 15, 12)
+    table.append(os.path.join(vacaciones, "a.jpg"), (400, june * 10 ** 9), (4000, 3000, NO_DATE))
+    table.append(os.path.join(vacaciones, "b.jpg"), (2 * 1024 ** 2, june * 10 ** 9),
+                 (640, 480, local_time(2020, 1, 1)))
+    table.append(os.path.join(casa, "c.jpg"), (1500, local_time(2024, 1, 2) * 10 ** 9), (1024, 768, NO_DATE))
+    table.append(os.path.join(casa, "d.jpg"), (6 * 1024 ** 2, june * 10 ** 9), (100, 100, NO_DATE))
+    return table, vacaciones
+
+
+def selected(text, attributes):
+    return np.flatnonzero(parse_filter(text).mask(attributes)).tolist()
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("500", 500), ("500B", 500), ("500b", 500), ("2K", 2000), ("2M", 2e6), ("1G", 1e9),
+    ("1KB", 1024), ("1.5MB", 1.5 * 1024 ** 2), ("2GB", 2 * 1024 ** 3), ("3 mb", 3 * 1024 ** 2),
+])
+def test_parse_number_suffixes(value, expected):
+    assert parse_number(value) == expected
+
+
+@pytest.mark.parametrize("value", ["abc", "5X", "5KBB", "-1", ""])
+def test_parse_number_rejects_invalid_values(value):
+    with pytest.raises(ValueError):
+        parse_number(value)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("size<500B", [0]), ("size<=1500", [0, 2]), ("size>1KB", [1, 2, 3]), ("size<5MB", [0, 1, 2]),
+    ("size>=2M", [1, 3]), ("pixels>=2M", [0]), ("pixels<1K", []), ("width>=1024 height>=768", [0, 2]),
+])
+def test_size_and_dimension_filters(attributes, text, expected):
+    assert selected(text, attributes[0]) == expected
+
+
+def test_invalid_suffix_raises_value_error(attributes):
+    with pytest.raises(ValueError):
+        parse_filter("size<5XB")
+
+
+def test_folder_filters(attributes):
+    table, vacaciones = attributes
+    assert selected("folder:vacaciones", table) == [0, 1]
+    assert selected("folder!=vacaciones", table) == [2, 3]
+    assert selected("folder:fotos", table) == [0, 1, 2, 3]
+    assert selected("folder:fot", table) == []
+    assert selected(f'folder="{vacaciones}"', table) == [0, 1]
+
+
+def test_date_uses_exif_then_mtime(attributes):
+    table, _ = attributes
+    assert selected("date=2023-06", table) == [0, 3]
+    assert selected("date<2021", table) == [1]
+    assert selected("mtime=2023-06-15", table) == [0, 1, 3]
+    assert selected("date>2023", table) == [2]
+
+
+def test_parse_date_range_covers_whole_unit():
+    start, end = parse_date_range("2023-02")
+    assert start == local_time(2023, 2, 1)
+    assert end == local_time(2023, 3, 1)
+
+
+def test_empty_filter_is_none():
+    assert parse_filter("") is None
+    assert parse_filter("   ") is None
+
+
+@pytest.mark.parametrize("text", ["foo=1", "width", "width>=", 'folder:"sin cerrar', "folder>3", "date=20x"])
+def test_invalid_expressions_raise_value_error(text):
+    with pytest.raises(ValueError):
+        parse_filter(text)
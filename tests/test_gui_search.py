@@ -0,0 +1,142 @@
+"""Pruebas de la búsqueda y la indexación en segundo plano de la interfaz: los errores deben llegar a la ventana."""
+
+import pytest
+
+tk = pytest.importorskip("tkinter")
+
+import ImageSemanticSearchEs  # noqa: E402
+from ImageSemanticSearchEs import ImageSearchWindow  # noqa: E402
+from image_search_engine import IndexingCancelled, IndexingError  # noqa: E402
+
+
+class Widget:
+    def __init__(self):
+        self.options = {}
+
+    def config(self, **options):
+        self.options.update(options)
+
+
+class Engine:
+    def __init__(self, error=None):
+        self.error = error
+
+    def get_text_query_features(self, query):
+        if self.error:
+            raise self.error
+        return [1.0]
+
+    get_image_query_features = get_text_query_features
+
+
+class Window:
+    """Ventana mínima con los métodos reales de la búsqueda; `post` ejecuta el callback en el acto."""
+
+    run_search = ImageSearchWindow.run_search
+    on_search_failed = ImageSearchWindow.on_search_failed
+    on_search_finished = ImageSearchWindow.on_search_finished
+    is_superseded = ImageSearchWindow.is_superseded
+
+    def __init__(self, engine, html_error=None):
+        self.engine = engine
+        self.html_error = html_error
+        self.search_generation = 1
+        self.btn_cancel = Widget()
+        self.status_label = Widget()
+
+    def post(self, callback, *args):
+        callback(*args)
+
+    def generate_html(self, *args):
+        if self.html_error:
+            raise self.html_error
+        return None
+
+
+@pytest.mark.parametrize("engine_error, html_error", [
+    (RuntimeError("fallo al codificar"), None),
+    (None, ValueError("filtro no válido")),
+    (OSError("imagen ilegible"), None),
+])
+def test_search_errors_are_reported(engine_error, html_error):
+    window = Window(Engine(engine_error), html_error)
+    window.btn_cancel.config(state="normal")
+    window.run_search(1, "text", "perro", 5)
+    assert window.btn_cancel.options["state"] == "disabled"
+    assert window.status_label.options["foreground"] == "red"
+    assert str(engine_error or html_error) in window.status_label.options["text"]
+
+
+def test_superseded_search_error_is_ignored():
+    window = Window(Engine(RuntimeError("fallo")))
+    window.btn_cancel.config(state="normal")
+    window.search_generation = 2
+    window.run_search(1, "image", "consulta.jpg", 5)
+    assert window.btn_cancel.options["state"] == "normal"
+    assert window.status_label.options == {}
+
+
+def test_search_without_results_reports_it():
+    window = Window(Engine())
+    window.run_search(1, "text", "perro", 5)
+    assert window.btn_cancel.options["state"] == "disabled"
+    assert "No se encontraron resultados" in window.status_label.options["text"]
+
+
+class IndexingEngine:
+    def __init__(self, error, indexed=False):
+        self.error = error
+        self.indexed = indexed
+
+    def index_images(self):
+        raise self.error
+
+    update_index_incremental = index_images
+
+    def has_index(self):
+        return self.indexed
+
+
+class IndexingWindow:
+    """Ventana mínima con los métodos reales de la indexación en segundo plano."""
+
+    index_images = ImageSearchWindow.index_images
+    update_index_incremental = ImageSearchWindow.update_index_incremental
+    on_indexing_failed = ImageSearchWindow.on_indexing_failed
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.indexing = True
+        self.btn_cancel = Widget()
+        self.btn_cancel.config(state="normal")
+        self.btn_update_index = Widget()
+        self.btn_search = Widget()
+        self.status_label = Widget()
+        self.progress_bar = {"value": 50}
+
+    def post(self, callback, *args):
+        callback(*args)
+
+
+@pytest.mark.parametrize("method", ["index_images", "update_index_incremental"])
+@pytest.mark.parametrize("error", [OSError("disco desconectado"), RuntimeError("faiss"), IndexingError("vacío")])
+def test_indexing_errors_unlock_the_window(monkeypatch, method, error):
+    shown = []
+    monkeypatch.setattr(ImageSemanticSearchEs.messagebox, "showerror", lambda title, message: shown.append(message))
+    window = IndexingWindow(IndexingEngine(error, indexed=True))
+    getattr(window, method)()
+    assert window.indexing is False
+    assert window.btn_cancel.options["state"] == "disabled"
+    assert window.btn_update_index.options["state"] == "normal"
+    assert window.btn_search.options["state"] == "normal"
+    assert window.progress_bar["value"] == 0
+    assert len(shown) == 1 and str(error) in shown[0]
+
+
+def test_cancelled_indexing_is_not_an_error(monkeypatch):
+    monkeypatch.setattr(ImageSemanticSearchEs.messagebox, "showerror", lambda *args: pytest.fail("no es un error"))
+    window = IndexingWindow(IndexingEngine(IndexingCancelled("cancelada")))
+    window.update_index_incremental()
+    assert window.indexing is False
+    assert window.status_label.options["foreground"] == "orange"
+    assert "state" not in window.btn_search.options
@@ -0,0 +1,18 @@
+"""Los módulos del proyecto se importan sin cargar torch, clip ni faiss (se importan al usarlos)."""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize("module", ["image_search_engine", "image_search_collections", "image_search_server",
+                                    "image_search_cli", "image_search_benchmark", "image_search_watcher"])
+def test_module_import_is_lazy(module):
+    code = (f"import sys, {module}; "
+            "print(sorted(name for name in ('torch', 'clip', 'faiss') if name in sys.modules))")
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, cwd=REPO_ROOT, check=True, text=True)
+    assert result.stdout.strip() == "[]"
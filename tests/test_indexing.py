@@ -0,0 +1,122 @@
+"""Pruebas de la indexación por fragmentos con el codificador aleatorio."""
+
+import os
+import shutil
+
+import numpy as np
+
+import image_search_engine
+from conftest import write_images
+
+
+def test_decode_pool_is_shared_by_all_shards(make_engine, tmp_path, monkeypatch):
+    root = str(tmp_path / "fotos")
+    for name in ("a", "b", "c"):
+        write_images(os.path.join(root, name), 10, seed=ord(name))
+    created = []
+    original = image_search_engine.DecodeWorkerPool.__init__
+
+    def counting_init(self, *args, **kwargs):
+        created.append(self)
+        original(self, *args, **kwargs)
+
+    monkeypatch.setattr(image_search_engine.DecodeWorkerPool, "__init__", counting_init)
+    engine = make_engine(root, batch_size=4, decode_workers=1)
+    engine.index_images()
+    assert len(engine.shards) == 3
+    assert engine.count_indexed_images() == 30
+    assert len(created) == 1
+    assert engine.decode_pool is None
+
+
+def test_saving_keeps_unrelated_files_in_the_index_dir(make_engine, tmp_path):
+    root = str(tmp_path / "fotos")
+    write_images(root, 4)
+    index_dir = tmp_path / "compartido"
+    (index_dir / "shards" / "mis notas").mkdir(parents=True)
+    (index_dir / "shards" / "0123456789abcdef").mkdir()
+    unrelated = ["notas.txt", "foto.jpg", "index.faiss", "paths-final.bin"]
+    legacy = ["image_index.bin", "header.json", "index-18c3f2a.faiss", "paths-18c3f2a.bin",
+              "vectors-18c3f2a.f32", "manifest-18c3f2a.bin.tmp-1234"]
+    for name in unrelated + legacy:
+        (index_dir / name).write_text("x")
+
+    engine = make_engine(root, batch_size=4, index_dir="compartido")
+    engine.index_images()
+    names = set(os.listdir(index_dir))
+    assert set(unrelated) <= names
+    assert not names & set(legacy)
+    assert sorted(os.listdir(index_dir / "shards")) == sorted(
+        ["mis notas", os.path.basename(engine.shards[0].index_dir)])
+
+
+def test_incremental_update_looks_up_only_changed_paths(make_engine, tmp_path, monkeypatch):
+    root = str(tmp_path / "fotos")
+    paths = write_images(root, 10)
+    engine = make_engine(root, batch_size=4)
+    engine.index_images()
+
+    os.remove(paths[5])
+    os.replace(write_images(str(tmp_path / "otra"), 1, seed=7)[0], paths[0])
+    os.utime(paths[0], ns=(1, 1))
+    added = write_images(root, 1, seed=8, prefix="nueva")[0]
+
+    # Guardar reescribe la tabla de rutas entera; fuera de save_index no debe recorrerse.
+    saving = []
+    original_iter = image_search_engine.PathTable.__iter__
+    original_save = image_search_engine.IndexShard.save_index
+
+    def checked_iter(self):
+        assert saving, "la actualización no debe recorrer la tabla de rutas completa"
+        return original_iter(self)
+
+    def tracked_save(self, *args, **kwargs):
+        saving.append(True)
+        try:
+            return original_save(self, *args, **kwargs)
+        finally:
+            saving.pop()
+
+    updated = make_engine(root, batch_size=4)
+    monkeypatch.setattr(image_search_engine.PathTable, "__iter__", checked_iter)
+    monkeypatch.setattr(image_search_engine.IndexShard, "save_index", tracked_save)
+    updated.update_index_incremental()
+    monkeypatch.undo()
+
+    shard = updated.shards[0]
+    expected = sorted(set(paths) - {paths[5]} | {added})
+    assert sorted(shard.path_ids) == expected
+    assert all(shard.image_paths[vector_id] == path for path, vector_id in shard.path_ids.items())
+    assert shard.image_paths.count() == shard.index.ntotal == 10
+
+    reloaded = make_engine(root, batch_size=4)
+    assert reloaded.is_index_valid() and reloaded.load_stored_index()
+    assert reloaded.shards[0].path_ids == shard.path_ids
+
+
+def test_refresh_keeps_the_replaced_generation_until_the_next_one(make_engine, tmp_path):
+    root = str(tmp_path / "fotos")
+    for name in ("a", "b"):
+        write_images(os.path.join(root, name), 6, seed=ord(name))
+    engine = make_engine(root, batch_size=4)
+    engine.index_images()
+    old = next(shard for shard in engine.shards if shard.image_dir.endswith("a"))
+    old_files = {name for name in old.files.values() if name}
+    query = np.random.default_rng(0).standard_normal((1, engine.feature_dim)).astype(np.float32)
+    expected = old.search(query, 3)
+
+    added = write_images(os.path.join(root, "a"), 1, seed=1, prefix="nueva")
+    shutil.rmtree(os.path.join(root, "b"))
+    engine.refresh_changed(added + [os.path.join(root, "b")])
+    new = next(shard for shard in engine.shards if shard.image_dir.endswith("a"))
+    assert new is not old and len(engine.shards) == 1
+    assert all(os.path.exists(os.path.join(old.index_dir, name)) for name in old_files)
+    assert len(os.listdir(os.path.join(engine.index_dir, "shards"))) == 2
+    for got, want in zip(old.search(query, 3), expected):
+        np.testing.assert_array_equal(got, want)
+
+    engine.refresh_changed(write_images(os.path.join(root, "a"), 1, seed=2, prefix="otra"))
+    current = {name for name in engine.shards[0].files.values() if name}
+    assert not any(os.path.exists(os.path.join(old.index_dir, name)) for name in old_files - current)
+    assert all(os.path.exists(os.path.join(new.index_dir, name)) for name in new.files.values() if name)
+    assert os.listdir(os.path.join(engine.index_dir, "shards")) == [os.path.basename(old.index_dir)]
@@ -0,0 +1,132 @@
+"""Pruebas de los histogramas de latencia y de la suma de métricas entre procesos."""
+
+import json
+import pickle
+import threading
+
+import pytest
+
+from image_search_metrics import HISTOGRAM_BOUNDS, LatencyHistogram, Metrics, format_duration
+
+
+def test_percentiles_report_bucket_upper_bounds():
+    histogram = LatencyHistogram()
+    for seconds in [0.001] * 90 + [0.1] * 9 + [2.0]:
+        histogram.record(seconds)
+    # 0,001 s cae en el cubo de 1,6 ms y 0,1 s en el de 102,4 ms; el percentil 100 es el máximo.
+    assert histogram.percentile(50) == pytest.approx(0.0016)
+    assert histogram.percentile(95) == pytest.approx(0.1024)
+    assert histogram.percentile(99) == pytest.approx(0.1024)
+    assert histogram.percentile(100) == pytest.approx(2.0)
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 100
+    assert snapshot["min_ms"] == pytest.approx(1.0) and snapshot["max_ms"] == pytest.approx(2000.0)
+    assert snapshot["mean_ms"] == pytest.approx((0.09 + 0.9 + 2.0) / 100 * 1000)
+
+
+def test_percentile_never_exceeds_observed_maximum():
+    histogram = LatencyHistogram()
+    histogram.record(0.00011)
+    assert histogram.percentile(50) == pytest.approx(0.00011)
+    histogram.record(HISTOGRAM_BOUNDS[-1] * 10)
+    assert histogram.percentile(99) == pytest.approx(HISTOGRAM_BOUNDS[-1] * 10)
+
+
+def test_empty_histogram_snapshot():
+    snapshot = LatencyHistogram().snapshot()
+    assert snapshot["count"] == 0
+    assert snapshot["p50_ms"] is None and snapshot["mean_ms"] is None and snapshot["items_per_s"] is None
+
+
+def test_merged_histograms_match_recording_everything_once():
+    samples = [0.0001 * 3 ** i for i in range(12)]
+    combined, left, right = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+    for i, seconds in enumerate(samples):
+        combined.record(seconds, items=4)
+        (left if i % 2 else right).record(seconds, items=4)
+    left.merge(right.state())
+    left.merge(LatencyHistogram().state())
+    assert left.state() == pytest.approx(combined.state())
+    assert left.snapshot() == pytest.approx(combined.snapshot())
+
+
+def test_metrics_export_survives_pickling_and_merges():
+    worker = Metrics()
+    worker.record("decode", 0.01, items=8)
+    worker.increment("images_failed", 2)
+    main = Metrics()
+    main.record("decode", 0.03, items=8)
+    main.increment("images_failed")
+    main.merge(pickle.loads(pickle.dumps(worker.export())))
+    snapshot = main.snapshot()
+    assert snapshot["counters"] == {"images_failed": 3}
+    assert snapshot["stages"]["decode"]["count"] == 2
+    assert snapshot["stages"]["decode"]["items_per_s"] == pytest.approx(16 / 0.04)
+
+
+def test_time_records_failed_blocks():
+    metrics = Metrics()
+    with pytest.raises(RuntimeError):
+        with metrics.time("encode_image", items=3):
+            raise RuntimeError("fallo")
+    assert metrics.snapshot()["stages"]["encode_image"]["items"] == 3
+
+
+def test_concurrent_records_are_not_lost():
+    metrics = Metrics()
+
+    def work():
+        for _ in range(1000):
+            metrics.record("search", 0.001)
+            metrics.increment("queries")
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    snapshot = metrics.snapshot()
+    assert snapshot["counters"]["queries"] == 8000
+    assert snapshot["stages"]["search"]["count"] == 8000
+
+
+def test_dump_writes_json(tmp_path):
+    metrics = Metrics()
+    metrics.record("search", 0.002)
+    file_path = metrics.dump(str(tmp_path / "metrics" / "metrics.json"), {"images": 10})
+    with open(file_path, encoding="utf-8") as f:
+        data = json.load(f)
+    assert data["images"] == 10 and data["stages"]["search"]["count"] == 1
+    assert sorted(p.name for p in (tmp_path / "metrics").iterdir()) == ["metrics.json"]
+
+
+def test_concurrent_dumps_do_not_collide(tmp_path):
+    metrics = Metrics()
+    metrics.record("search", 0.002)
+    file_path = str(tmp_path / "metrics.json")
+    errors = []
+    barrier = threading.Barrier(8)
+
+    def dump(worker):
+        barrier.wait()
+        try:
+            for i in range(20):
+                metrics.dump(file_path, {"worker": worker, "i": i})
+        except OSError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=dump, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    with open(file_path, encoding="utf-8") as f:
+        assert json.load(f)["stages"]["search"]["count"] == 1
+    assert [p.name for p in tmp_path.iterdir()] == ["metrics.json"]
+
+
+@pytest.mark.parametrize("seconds, text", [(0, "0:00"), (59.6, "1:00"), (61, "1:01"), (3600, "1:00:00"),
+                                           (3725, "1:02:05")])
+def test_format_duration(seconds, text):
+    assert format_duration(seconds) == text
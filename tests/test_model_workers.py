@@ -0,0 +1,84 @@
+"""Pruebas de los procesos de inferencia: reparto de núcleos, arranque sin torch e indexación."""
+
+import os
+import pickle
+import subprocess
+import sys
+from functools import partial
+
+import numpy as np
+from PIL import Image
+
+import image_search_engine
+from conftest import write_images
+from image_search_engine import ThumbnailStore, load_worker_model, plan_core_groups
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Dos sockets de cuatro núcleos con dos hilos cada uno; las CPU hermanas son n y n + 8.
+TWO_SOCKETS = sorted((cpu // 4 % 2, cpu % 4, cpu) for cpu in range(16))
+
+
+def test_core_groups_stay_within_a_socket(monkeypatch):
+    monkeypatch.setattr(image_search_engine, "cpu_topology", lambda: TWO_SOCKETS)
+    groups = plan_core_groups(2)
+    assert sorted(cpu for group in groups for cpu in group) == list(range(16))
+    sockets = [{cpu // 4 % 2 for cpu in group} for group in groups]
+    assert sockets == [{0}, {1}]
+    for group in plan_core_groups(4):
+        assert len(group) == 4
+        # Cada grupo reúne dos núcleos completos, con sus dos hilos hermanos.
+        assert len({cpu % 4 for cpu in group}) == 2 and len({cpu // 4 % 2 for cpu in group}) == 1
+
+
+def test_more_workers_than_cpus_share_cpus(monkeypatch):
+    monkeypatch.setattr(image_search_engine, "cpu_topology", lambda: [(0, 0, 0), (0, 1, 1)])
+    assert plan_core_groups(3) == [[0], [1], [0]]
+    assert plan_core_groups(1) == [[0, 1]]
+
+
+def unpickle_imports_torch(obj) -> bool:
+    """Deserializa `obj` en un intérprete nuevo (como el arranque de un proceso) y dice si importó torch."""
+    code = ("import pickle, sys; pickle.loads(sys.stdin.buffer.read()); "
+            "print('torch' in sys.modules)")
+    result = subprocess.run([sys.executable, "-c", code], input=pickle.dumps(obj), capture_output=True,
+                            cwd=REPO_ROOT, check=True)
+    return result.stdout.strip() == b"True"
+
+
+def test_worker_arguments_do_not_import_torch(tmp_path):
+    from image_search_benchmark import load_random_worker_model
+    initargs = (partial(load_worker_model, "fp32", True), partial(load_random_worker_model, 512, 0),
+                ThumbnailStore(str(tmp_path / "thumbnails")), 2)
+    assert not unpickle_imports_torch(initargs)
+
+
+def test_index_with_model_workers_matches_main_process(make_engine, tmp_path):
+    root = str(tmp_path / "fotos")
+    paths = write_images(root, 12, size=(320, 240))
+    local = make_engine(root, batch_size=4, index_dir="local")
+    local.index_images()
+    workers = make_engine(root, batch_size=4, index_dir="workers", model_workers=2)
+    workers.index_images()
+    assert workers.model_pool is None
+    assert "model_wait" in workers.metrics.export()["stages"]
+    assert workers.count_indexed_images() == local.count_indexed_images() == 12
+    with Image.open(paths[3]) as img:
+        query = local.encode_images([img.convert("RGB")])[0]
+    expected = local.search(query, k=12)
+    actual = workers.search(query, k=12)
+    assert [path for path, _ in actual] == [path for path, _ in expected]
+    np.testing.assert_allclose([score for _, score in actual], [score for _, score in expected], atol=1e-4)
+
+
+def test_start_waits_for_every_worker():
+    from image_search_benchmark import load_random_worker_model
+    pool = image_search_engine.ModelWorkerPool(3, partial(load_random_worker_model, 64, 0), threads=1)
+    try:
+        pool.start()
+        assert len(set(pool.worker_pids)) == 3
+        if hasattr(os, "sched_getaffinity"):
+            pinned = sorted(sorted(os.sched_getaffinity(pid)) for pid in pool.worker_pids)
+            assert pinned == sorted(pool.core_groups)
+    finally:
+        pool.close()
@@ -0,0 +1,94 @@
+"""Pruebas del preprocesamiento rápido frente a la transformación de CLIP en torchvision."""
+
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+torch = pytest.importorskip("torch")
+T = pytest.importorskip("torchvision.transforms")
+
+from image_search_preprocess import FastPreprocess  # noqa: E402
+
+MEAN = (0.48145466, 0.4578275, 0.40821073)
+STD = (0.26862954, 0.26130258, 0.27577711)
+
+
+def _convert_image_to_rgb(image):
+    return image.convert("RGB")
+
+
+def clip_transform(size=224):
+    return T.Compose([T.Resize(size, interpolation=T.InterpolationMode.BICUBIC), T.CenterCrop(size),
+                      _convert_image_to_rgb, T.ToTensor(), T.Normalize(MEAN, STD)])
+
+
+def smooth_image(width, height, seed=0):
+    """Imagen suave (ruido de baja resolución ampliado), parecida a una foto a efectos del remuestreo."""
+    noise = np.random.default_rng(seed).integers(0, 256, (12, 16, 3), dtype=np.uint8)
+    return Image.fromarray(noise).resize((width, height), Image.BICUBIC)
+
+
+@pytest.mark.parametrize("width, height", [(224, 224), (640, 480), (480, 640), (1000, 300), (225, 999), (100, 80)])
+def test_crop_box_matches_torchvision_resize_and_crop(width, height):
+    """El recorte de crop_box, escalado a 224, coincide con el de T.Resize + T.CenterCrop."""
+    fast = FastPreprocess(224, MEAN, STD)
+    left, top, right, bottom = fast.crop_box(width, height)
+    resized = T.Resize(224)(Image.new("RGB", (width, height)))
+    scale_x, scale_y = resized.width / width, resized.height / height
+    crop_left = int(round((resized.width - 224) / 2.0))
+    crop_top = int(round((resized.height - 224) / 2.0))
+    assert left * scale_x == pytest.approx(crop_left)
+    assert top * scale_y == pytest.approx(crop_top)
+    assert (right - left) * scale_x == pytest.approx(224)
+    assert (bottom - top) * scale_y == pytest.approx(224)
+
+
+@pytest.mark.parametrize("width, height", [(640, 480), (480, 640), (1000, 300), (224, 224), (100, 80)])
+def test_fast_output_matches_reference(width, height):
+    transform = clip_transform()
+    fast = FastPreprocess.from_transform(transform)
+    img = smooth_image(width, height)
+    expected = transform(img)
+    actual = fast(img)
+    assert actual.shape == expected.shape == (3, 224, 224)
+    assert float((actual - expected).abs().mean()) < 0.02
+    cosine = torch.nn.functional.cosine_similarity(actual.flatten(), expected.flatten(), dim=0)
+    assert float(cosine) > 0.999
+
+
+def test_jpeg_draft_decoding_stays_close_to_reference():
+    buffer = io.BytesIO()
+    smooth_image(3000, 2000).save(buffer, "JPEG", quality=95)
+    transform = clip_transform()
+    fast = FastPreprocess.from_transform(transform)
+    with Image.open(io.BytesIO(buffer.getvalue())) as img:
+        expected = transform(img)
+    with Image.open(io.BytesIO(buffer.getvalue())) as img:
+        reduced = fast.reduce(img)
+        assert min(reduced.size) >= 224 * 1.5
+        assert reduced.size[0] < 3000
+        actual = fast.to_tensor([fast.crop_array(reduced)])[0]
+    cosine = torch.nn.functional.cosine_similarity(actual.flatten(), expected.flatten(), dim=0)
+    assert float(cosine) > 0.999
+
+
+def test_batch_normalizes_every_image():
+    fast = FastPreprocess.from_transform(clip_transform())
+    images = [smooth_image(300, 200, seed) for seed in range(3)]
+    batch = fast.batch(images)
+    assert batch.shape == (3, 3, 224, 224) and batch.dtype == torch.float32
+    for img, row in zip(images, batch):
+        assert torch.allclose(row, fast(img))
+
+
+@pytest.mark.parametrize("transform", [
+    T.Compose([T.Resize(224), T.CenterCrop(224), T.ToTensor()]),
+    T.Compose([T.Resize(224), T.CenterCrop(200), T.ToTensor(), T.Normalize(MEAN, STD)]),
+    T.Compose([T.Resize((224, 300)), T.CenterCrop(224), T.ToTensor(), T.Normalize(MEAN, STD)]),
+    T.Compose([T.Resize(224), T.CenterCrop(224), T.RandomHorizontalFlip(), T.ToTensor(), T.Normalize(MEAN, STD)]),
+    lambda img: img,
+])
+def test_unsupported_transforms_are_rejected(transform):
+    assert FastPreprocess.from_transform(transform) is None
@@ -0,0 +1,104 @@
+"""Pruebas de la caché LRU de vectores de consulta y de su espacio de nombres."""
+
+import numpy as np
+
+from conftest import write_images
+from image_search_engine import QueryEmbeddingCache
+
+
+def vector(value):
+    return np.full(4, value, dtype=np.float32)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = QueryEmbeddingCache("modelo|fp32", max_entries=2)
+    cache.put("a", vector(1))
+    cache.put("b", vector(2))
+    assert cache.get("a") is not None
+    cache.put("c", vector(3))
+    assert cache.get("b") is None
+    assert cache.get("a")[0] == 1 and cache.get("c")[0] == 3
+    assert len(cache) == 2
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_put_refreshes_existing_key():
+    cache = QueryEmbeddingCache("modelo|fp32", max_entries=2)
+    cache.put("a", vector(1))
+    cache.put("b", vector(2))
+    cache.put("a", vector(5))
+    cache.put("c", vector(3))
+    assert cache.get("b") is None
+    assert cache.get("a")[0] == 5
+
+
+def test_keys_normalize_text_and_hash_image_content(tmp_path):
+    assert QueryEmbeddingCache.text_key("  Perro  en la\tPLAYA ") == QueryEmbeddingCache.text_key("perro en la playa")
+    path = write_images(str(tmp_path), 1)[0]
+    with open(path, "rb") as f:
+        data = f.read()
+    assert QueryEmbeddingCache.image_key(path) == QueryEmbeddingCache.image_bytes_key(data)
+    assert QueryEmbeddingCache.image_key(path) != QueryEmbeddingCache.image_bytes_key(data + b"\0")
+
+
+def test_saved_cache_keeps_recency_order(tmp_path):
+    file_path = str(tmp_path / "cache.npz")
+    cache = QueryEmbeddingCache("modelo|fp32", max_entries=3, file_path=file_path)
+    for i, key in enumerate("abc"):
+        cache.put(key, vector(i))
+    cache.get("a")
+    cache.save()
+
+    loaded = QueryEmbeddingCache("modelo|fp32", max_entries=3, file_path=file_path)
+    loaded.load()
+    assert len(loaded) == 3
+    np.testing.assert_array_equal(loaded.get("c"), vector(2))
+    loaded.put("d", vector(3))
+    assert loaded.get("b") is None and loaded.get("a") is not None
+
+    smaller = QueryEmbeddingCache("modelo|fp32", max_entries=2, file_path=file_path)
+    smaller.load()
+    assert len(smaller) == 2
+    assert smaller.get("b") is None and smaller.get("a") is not None and smaller.get("c") is not None
+
+
+def test_cache_from_another_namespace_is_discarded(tmp_path):
+    file_path = str(tmp_path / "cache.npz")
+    cache = QueryEmbeddingCache("modelo|fp16", file_path=file_path)
+    cache.put("text:perro", vector(1))
+    cache.save()
+    other = QueryEmbeddingCache("modelo|fp32", file_path=file_path)
+    other.load()
+    assert len(other) == 0
+    same = QueryEmbeddingCache("modelo|fp16", file_path=file_path)
+    same.load()
+    assert len(same) == 1
+
+
+def test_unreadable_cache_file_is_ignored(tmp_path):
+    file_path = tmp_path / "cache.npz"
+    file_path.write_bytes(b"no es un npz")
+    cache = QueryEmbeddingCache("modelo|fp32", file_path=str(file_path))
+    cache.load()
+    assert len(cache) == 0
+    cache.put("a", vector(1))
+    cache.save()
+    reloaded = QueryEmbeddingCache("modelo|fp32", file_path=str(file_path))
+    reloaded.load()
+    assert len(reloaded) == 1
+
+
+def test_engine_encodes_each_text_once(make_engine, tmp_path):
+    engine = make_engine(str(tmp_path / "fotos"))
+    encoded = []
+    original = engine.encode_texts
+
+    def counting(texts):
+        encoded.append(list(texts))
+        return original(texts)
+
+    engine.encode_texts = counting
+    first = engine.text_query_features(["perro", "gato"])
+    second = engine.text_query_features(["Gato ", "playa"])
+    assert encoded == [["perro", "gato"], ["playa"]]
+    np.testing.assert_array_equal(first[1], second[0])
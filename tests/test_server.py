@@ -0,0 +1,82 @@
+"""Pruebas del agrupador de consultas del servidor (QueryBatcher)."""
+
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from image_search_engine import QueryEmbeddingCache
+from image_search_server import PendingQuery, QueryBatcher, QueryError
+
+
+def jpeg_bytes(color) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (256, 192), color).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def truncated_jpeg() -> bytes:
+    """JPEG con cabecera válida (Image.open lo acepta) cuyos datos terminan a medias."""
+    noise = np.random.default_rng(0).integers(0, 256, (192, 256, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(noise).save(buffer, "JPEG")
+    data = buffer.getvalue()
+    return data[:len(data) // 2]
+
+
+class Engine:
+    """Motor mínimo: el vector de una imagen es su color medio y el de un texto, su longitud."""
+
+    def __init__(self):
+        self.query_cache = QueryEmbeddingCache("prueba", 16)
+        self.image_batches = []
+
+    def encode_images(self, images):
+        self.image_batches.append(len(images))
+        try:
+            return np.stack([np.asarray(img.convert("RGB"), dtype=np.float32).mean(axis=(0, 1)) for img in images])
+        except Exception:
+            return None
+
+    def encode_texts(self, texts):
+        return np.array([[len(text), 1.0, 0.0] for text in texts], dtype=np.float32)
+
+    def search_features(self, features, k, image_filter=None):
+        return [[(f"v{row[0]:.0f}", 1.0)] * k for row in features]
+
+
+@pytest.fixture
+def batcher():
+    engine = Engine()
+    batcher = QueryBatcher(engine, window_ms=0)
+    yield batcher
+    batcher.stop()
+
+
+def test_submitted_queries_are_resolved(batcher):
+    futures = [batcher.submit("image_bytes", jpeg_bytes((200, 0, 0)), 1), batcher.submit("text", "perro", 2)]
+    assert futures[0].result(timeout=10) == [("v200", 1.0)]
+    assert futures[1].result(timeout=10) == [("v5", 1.0), ("v5", 1.0)]
+
+
+def test_corrupt_image_only_fails_its_own_query():
+    engine = Engine()
+    batcher = QueryBatcher(engine, window_ms=0)
+    try:
+        good = jpeg_bytes((0, 0, 250))
+        batch = [PendingQuery("image_bytes", good, 1), PendingQuery("image_bytes", truncated_jpeg(), 1),
+                 PendingQuery("image_bytes", jpeg_bytes((10, 10, 10)), 1)]
+        batcher.process(batch)
+    finally:
+        batcher.stop()
+    assert engine.image_batches == [3, 1, 1, 1]
+    assert batch[0].future.result() == [("v0", 1.0)]
+    assert isinstance(batch[1].future.exception(), QueryError)
+    assert batch[2].future.result() == [("v10", 1.0)]
+
+
+def test_unreadable_image_path_is_a_query_error(batcher, tmp_path):
+    future = batcher.submit("image", str(tmp_path / "no_existe.jpg"), 1)
+    with pytest.raises(QueryError):
+        future.result(timeout=10)
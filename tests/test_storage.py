@@ -0,0 +1,149 @@
+"""Pruebas del formato del índice en disco: tablas, manifiesto, cabecera y escrituras atómicas."""
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+import image_search_engine
+from conftest import write_images
+from image_search_engine import AttributeTable, PathTable, atomic_write, load_manifest, save_manifest
+
+PATHS = ["/fotos/a.jpg", "/fotos/ñandú/b.png", "/fotos/日本/c.jpeg", "/fotos/d e.webp"]
+
+
+def test_path_table_round_trip(tmp_path):
+    table = PathTable()
+    table.extend(PATHS)
+    table[1] = None
+    file_path = str(tmp_path / "paths.bin")
+    table.save(file_path)
+
+    loaded = PathTable.load(file_path)
+    assert list(loaded) == [PATHS[0], None, PATHS[2], PATHS[3]]
+    assert loaded.count() == 3
+    assert loaded.live_mask().tolist() == [True, False, True, True]
+
+    loaded[2] = None
+    loaded.append("/fotos/e.jpg")
+    assert len(loaded) == 5 and loaded.count() == 3
+    assert loaded.live_mask().tolist() == [True, False, False, True, True]
+    loaded.save(file_path)
+    assert list(PathTable.load(file_path)) == [PATHS[0], None, None, PATHS[3], "/fotos/e.jpg"]
+
+
+def test_path_table_rejects_replacements_and_bad_files(tmp_path):
+    table = PathTable()
+    table.append(PATHS[0])
+    with pytest.raises(ValueError):
+        table[0] = "/otra.jpg"
+    with pytest.raises(IndexError):
+        table[1]
+    bad = tmp_path / "paths.bin"
+    bad.write_bytes(b"no es una tabla")
+    with pytest.raises(ValueError):
+        PathTable.load(str(bad))
+
+
+def test_empty_path_table_round_trip(tmp_path):
+    file_path = str(tmp_path / "paths.bin")
+    PathTable().save(file_path)
+    loaded = PathTable.load(file_path)
+    assert len(loaded) == 0 and loaded.count() == 0 and loaded.live_mask().tolist() == []
+
+
+@pytest.mark.parametrize("manifest", [{}, {path: (i * 1000 + 1, 1_700_000_000_123_456_789 + i)
+                                           for i, path in enumerate(PATHS)}])
+def test_manifest_round_trip(tmp_path, manifest):
+    file_path = str(tmp_path / "manifest.bin")
+    # La segunda imagen no se pudo leer: está en el manifiesto pero no tiene vector.
+    path_ids = {path: i * 2 for i, path in enumerate(manifest) if i != 1}
+    save_manifest(file_path, manifest, path_ids)
+    assert load_manifest(file_path) == (manifest, path_ids)
+
+
+def test_attribute_table_round_trip(tmp_path):
+    table = AttributeTable()
+    table.append("/fotos/a.jpg", (10, 20), (640, 480, 1_600_000_000))
+    table.append("/fotos/sub/b.jpg", (30, 40), (100, 200, image_search_engine.NO_DATE))
+    file_path = str(tmp_path / "attrs.bin")
+    table.save(file_path)
+
+    loaded = AttributeTable.load(file_path)
+    loaded.append("/fotos/c.jpg", (50, 60), (1, 2, 3))
+    assert loaded.folders == [os.path.abspath("/fotos"), os.path.abspath("/fotos/sub")]
+    assert loaded.column("folder").tolist() == [0, 1, 0]
+    assert loaded.column("width").tolist() == [640, 100, 1]
+    assert loaded.column("size").tolist() == [10, 30, 50]
+    assert loaded.column("taken").tolist() == [1_600_000_000, image_search_engine.NO_DATE, 3]
+
+
+def test_atomic_write_keeps_original_when_writer_fails(tmp_path):
+    file_path = tmp_path / "header.json"
+    file_path.write_text("original")
+
+    def failing_writer(tmp_file):
+        with open(tmp_file, "w") as f:
+            f.write("a medias")
+        raise RuntimeError("fallo simulado")
+
+    with pytest.raises(RuntimeError):
+        atomic_write(str(file_path), failing_writer)
+    assert file_path.read_text() == "original"
+    assert os.listdir(tmp_path) == ["header.json"]
+
+    def writer(tmp_file):
+        with open(tmp_file, "w") as f:
+            f.write("nuevo")
+
+    atomic_write(str(file_path), writer)
+    assert file_path.read_text() == "nuevo"
+    assert os.listdir(tmp_path) == ["header.json"]
+
+
+def shard_header(engine):
+    with open(engine.shards[0].header_file, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_stored_index_round_trip(make_engine, tmp_path):
+    root = str(tmp_path / "fotos")
+    write_images(root, 6)
+    engine = make_engine(root, batch_size=4)
+    engine.index_images()
+    header = shard_header(engine)
+    assert header["complete"] and header["num_vectors"] == 6
+    index_dir = engine.shards[0].index_dir
+    assert sorted(os.listdir(index_dir)) == sorted([os.path.basename(engine.shards[0].header_file),
+                                                    *header["files"].values()])
+
+    reloaded = make_engine(root, batch_size=4)
+    assert reloaded.is_index_valid() and reloaded.load_stored_index()
+    query = np.random.default_rng(0).standard_normal(engine.feature_dim).astype(np.float32)
+    assert reloaded.search(query, k=6) == engine.search(query, k=6)
+
+
+def test_interrupted_save_keeps_previous_generation(make_engine, tmp_path, monkeypatch):
+    root = str(tmp_path / "fotos")
+    write_images(root, 6)
+    engine = make_engine(root, batch_size=4)
+    engine.index_images()
+    header = shard_header(engine)
+
+    write_images(root, 2, seed=1, prefix="nueva")
+
+    def crash(*args, **kwargs):
+        raise OSError("disco lleno")
+
+    monkeypatch.setattr(image_search_engine, "save_manifest", crash)
+    engine.update_index_incremental()
+    assert shard_header(engine) == header
+    monkeypatch.undo()
+
+    reloaded = make_engine(root, batch_size=4)
+    assert reloaded.load_stored_index()
+    assert reloaded.count_indexed_images() == 6
+    assert not reloaded.is_index_valid()
+    reloaded.update_index_incremental()
+    assert reloaded.count_indexed_images() == 8
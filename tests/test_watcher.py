@@ -0,0 +1,76 @@
+"""Pruebas del filtrado de eventos y de la actualización en segundo plano de DirectoryWatcher."""
+
+import os
+import time
+from types import SimpleNamespace
+
+from conftest import write_images
+from image_search_engine import ImageSearchEngine
+from image_search_watcher import DirectoryWatcher
+
+
+def event(event_type, src_path, is_directory=False, dest_path=""):
+    return SimpleNamespace(event_type=event_type, src_path=src_path, dest_path=dest_path, is_directory=is_directory)
+
+
+def make_watcher(tmp_path, **config):
+    engine = ImageSearchEngine({"image_dir": str(tmp_path / "fotos"), **config}, index_dir=str(tmp_path / "index"))
+    return DirectoryWatcher(engine)
+
+
+def test_noise_events_do_not_start_the_debounce(tmp_path):
+    watcher = make_watcher(tmp_path)
+    root = str(tmp_path / "fotos")
+    for noise in (event("modified", root, is_directory=True),
+                  event("created", os.path.join(root, "nueva"), is_directory=True),
+                  event("created", os.path.join(root, "notas.txt")),
+                  event("modified", os.path.join(root, "foto.jpg.part")),
+                  event("opened", os.path.join(root, "foto.jpg")),
+                  event("closed_no_write", os.path.join(root, "foto.jpg")),
+                  event("created", str(tmp_path / "index" / "shard.jpg"))):
+        watcher.handle_event(noise)
+    assert watcher.pending == set()
+    assert watcher.first_event is None and watcher.last_event is None
+
+
+def test_image_events_are_registered(tmp_path):
+    watcher = make_watcher(tmp_path)
+    root = str(tmp_path / "fotos")
+    watcher.handle_event(event("created", os.path.join(root, "a.JPG")))
+    watcher.handle_event(event("moved", os.path.join(root, "b.tmp"), dest_path=os.path.join(root, "b.png")))
+    watcher.handle_event(event("deleted", os.path.join(root, "viaje"), is_directory=True))
+    watcher.handle_event(event("moved", os.path.join(root, "x"), is_directory=True, dest_path=os.path.join(root, "y")))
+    assert watcher.pending == {os.path.join(root, "a.JPG"), os.path.join(root, "b.png"),
+                               os.path.join(root, "viaje"), os.path.join(root, "x")}
+
+
+def test_noise_does_not_postpone_a_pending_update(tmp_path):
+    watcher = make_watcher(tmp_path)
+    root = str(tmp_path / "fotos")
+    watcher.handle_event(event("created", os.path.join(root, "a.jpg")))
+    last_event = watcher.last_event
+    time.sleep(0.01)
+    watcher.handle_event(event("modified", root, is_directory=True))
+    watcher.handle_event(event("modified", os.path.join(root, "a.xmp")))
+    assert watcher.last_event == last_event
+
+
+def test_events_update_the_index_in_background(make_engine, tmp_path):
+    root = str(tmp_path / "fotos")
+    write_images(root, 4)
+    engine = make_engine(root, batch_size=4, watch_backend="polling", watch_debounce_s=0.05,
+                         watch_poll_interval_s=3600)
+    engine.index_images()
+    updates = []
+    watcher = DirectoryWatcher(engine, on_update=updates.append).start()
+    try:
+        new_path = write_images(root, 1, seed=1, prefix="nueva")[0]
+        watcher.handle_event(event("modified", root, is_directory=True))
+        watcher.handle_event(event("created", new_path))
+        deadline = time.monotonic() + 30
+        while not updates and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        watcher.stop()
+    assert updates == [[root]]
+    assert engine.count_indexed_images() == 5